@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-import os
+import queue
+import shutil
+import threading
 
 from common import (
     run_kiwix_build,
@@ -11,6 +13,7 @@ from common import (
     update_flathub_git,
     upload_archive,
     fix_macos_rpath,
+    snapshot_export_files,
     BASE_DIR,
     OS_NAME,
     COMPILE_CONFIG,
@@ -31,17 +34,102 @@ TARGETS = select_build_targets(PUBLISH)
 if MAKE_RELEASE:
     TARGETS = tuple(filter(release_filter, TARGETS))
 
-for target in TARGETS:
-    run_kiwix_build(target, config=COMPILE_CONFIG, make_release=MAKE_RELEASE)
-    if target == "kiwix-desktop":
-        archive = create_desktop_image(make_release=MAKE_RELEASE)
-    else:
-        if OS_NAME == "macos" and COMPILE_CONFIG.endswith("_mixed"):
-            fix_macos_rpath(target)
-            notarize_macos_build(target)
-        archive = make_archive(target, make_release=MAKE_RELEASE)
+
+# Run once `target` is built, before the next target is built: the files to
+# package are copied, the next targets install in INSTALL_DIR while they are
+# packaged.
+def prepare_package(target):
+    if OS_NAME == "macos" and COMPILE_CONFIG.endswith("_mixed"):
+        # In place, the next targets must link with the fixed libraries.
+        fix_macos_rpath(target)
+    return (target, snapshot_export_files(target))
+
+
+def package(item):
+    target, export_dir = item
+    try:
+        if target == "kiwix-desktop":
+            # Always the last target, nothing is installed while it is
+            # packaged from INSTALL_DIR.
+            archive = create_desktop_image(make_release=MAKE_RELEASE)
+        else:
+            if OS_NAME == "macos" and COMPILE_CONFIG.endswith("_mixed"):
+                notarize_macos_build(target, base_dir=export_dir)
+            archive = make_archive(
+                target, make_release=MAKE_RELEASE, base_dir=export_dir
+            )
+    finally:
+        if export_dir is not None:
+            shutil.rmtree(str(export_dir))
     if archive:
-        upload_archive(archive, target, make_release=MAKE_RELEASE)
+        return (archive, target)
+
+
+def upload(item):
+    archive, target = item
+    upload_archive(archive, target, make_release=MAKE_RELEASE)
+
+
+# Targets are packaged and uploaded in their own threads while the next
+# targets are built. Queues are bounded, the build doesn't go more than one
+# target ahead of the packaging, and the packaging of the upload.
+# Failures keep the semantic of a sequential run: after a failure on a
+# target, the targets before it are still packaged and uploaded, no new
+# build is started and nothing more is done for the targets after it. The
+# error is raised once the running steps are done.
+STOP = object()
+errors = []
+
+
+def first_failure():
+    return min(errors, key=lambda e: e[0]) if errors else None
+
+
+def run_stage(function, in_queue, out_queue):
+    while True:
+        item = in_queue.get()
+        if item is STOP:
+            break
+        index, arg = item
+        failure = first_failure()
+        if failure is not None and failure[0] < index:
+            continue
+        try:
+            result = function(arg)
+        except BaseException as e:
+            errors.append((index, e))
+            continue
+        if out_queue is not None and result is not None:
+            out_queue.put((index, result))
+    if out_queue is not None:
+        out_queue.put(STOP)
+
+
+package_queue = queue.Queue(maxsize=1)
+upload_queue = queue.Queue(maxsize=1)
+stages = [
+    threading.Thread(target=run_stage, args=(package, package_queue, upload_queue)),
+    threading.Thread(target=run_stage, args=(upload, upload_queue, None)),
+]
+for stage in stages:
+    stage.start()
+try:
+    for index, target in enumerate(TARGETS):
+        if errors:
+            break
+        try:
+            run_kiwix_build(target, config=COMPILE_CONFIG, make_release=MAKE_RELEASE)
+            item = prepare_package(target)
+        except BaseException as e:
+            errors.append((index, e))
+            break
+        package_queue.put((index, item))
+finally:
+    package_queue.put(STOP)
+    for stage in stages:
+        stage.join()
+if errors:
+    raise first_failure()[1]
 
 # We have few more things to do for release:
 if MAKE_RELEASE:
@@ -1,46 +1,84 @@
 import os
+import atexit
+import importlib.util
 from os import environ as _environ
 from pathlib import Path, PurePosixPath
 from datetime import date
-import tarfile
 import zipfile
+import hashlib
 import subprocess
 import re
 import shutil
 import platform
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
 from build_definition import get_platform_name, get_dependency_archive_name
+from uploader import Uploader
 
+from kiwixbuild.api import Session
+from kiwixbuild import archive as kbarchive, chunkstore
+from kiwixbuild.cache import get_store
 from kiwixbuild.dependencies.apple_xcframework import AppleXCFramework
+from kiwixbuild.manifest import MANIFESTS_DIR, read_manifest, manifest_files
 from kiwixbuild.versions import (
     main_project_versions,
     release_versions,
     base_deps_versions,
 )
 
-
-def get_build_dir(config) -> Path:
-    command = ["kiwix-build"]
-    command.extend(["--config", config])
-    command.append("--get-build-dir")
-    command.append("--use-target-arch-name")
-    return Path(
-        subprocess.run(command, cwd=str(HOME), check=True, stdout=subprocess.PIPE)
-        .stdout.strip()
-        .decode("utf8")
-    )
-
-
 COMPILE_CONFIG = _environ["COMPILE_CONFIG"]
 OS_NAME = _environ["OS_NAME"]
 HOME = Path(os.path.expanduser("~"))
 
+# Per dependency cache of built dependencies (see `--remote-cache`)
+REMOTE_CACHE = _environ.get("KBUILD_REMOTE_CACHE")
+PUSH_CACHE = bool(_environ.get("KBUILD_PUSH_CACHE"))
+
+# Chunk store where the deps archives are also stored, to only download what
+# changed (see `kiwixbuild.chunkstore`)
+CHUNK_STORE = _environ.get("KBUILD_CHUNK_STORE")
+
+# Compression level of the tar archives we create (default to the level of the
+# compression format, see `kiwixbuild.archive`)
+COMPRESSION_LEVEL = int(_environ.get("COMPRESSION_LEVEL", 0)) or None
+
+# All the builds of a script run in the same kiwix-build session, the tools
+# detection and the configs setup are done once.
+_sessions = {}
+
+
+def get_session(config) -> Session:
+    if config not in _sessions:
+        options = {
+            "working_dir": str(HOME),
+            "show_progress": False,
+            "fast_clone": True,
+            "assume_packages_installed": True,
+            "use_target_arch_name": True,
+            "env": {"SKIP_BIG_MEMORY_TEST": "1"},
+        }
+        if REMOTE_CACHE:
+            options["remote_cache"] = REMOTE_CACHE
+            options["push_cache"] = PUSH_CACHE
+        # Only one session can be used at a time.
+        _sessions.clear()
+        _sessions[config] = Session(config=config, **options)
+    return _sessions[config]
+
+
+def get_build_dir(config) -> Path:
+    return Path(get_session(COMPILE_CONFIG).get_build_dir(config))
+
+
 BASE_DIR = get_build_dir(COMPILE_CONFIG)
 SOURCE_DIR = HOME / "SOURCE"
 ARCHIVE_DIR = HOME / "ARCHIVE"
 TOOLCHAIN_DIR = BASE_DIR / "TOOLCHAINS"
+# The build state exported in the base deps archives.
+STATE_EXPORT_FILE = HOME / "build_state.json"
 INSTALL_DIR = BASE_DIR / "INSTALL"
 default_tmp_dir = os.getenv("TEMP") if platform.system() == "Windows" else "/tmp"
 TMP_DIR = Path(os.getenv("TMP_DIR", default_tmp_dir))
@@ -51,7 +89,6 @@ else:
     KBUILD_SOURCE_DIR = HOME / "kiwix-build"
     BIN_EXT = ""
 
-
 _ref = _environ.get("GITHUB_REF", "").split("/")[-1]
 MAKE_RELEASE = re.fullmatch(r"r_[0-9]+", _ref) is not None
 MAKE_RELEASE = MAKE_RELEASE and (_environ.get("GITHUB_EVENT_NAME") != "schedule")
@@ -200,6 +237,30 @@ def write_manifest(manifest_file, archive_name, target, config):
         )
 
 
+# The sha256 digest of `path`, stored next to it in `<path>.sha256`
+# (`sha256sum` format), is used to check downloads.
+def write_digest_file(path):
+    sha256 = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    digest_file = path.with_name(path.name + ".sha256")
+    digest_file.write_text("{}  {}\n".format(sha256.hexdigest(), path.name))
+    return digest_file
+
+
+# A CalledProcessError, as when kiwix-build was run as a command.
+class BuildError(subprocess.CalledProcessError):
+    def __init__(self, target, config, failed_steps):
+        super().__init__(1, ["kiwix-build", target, "--config", config])
+        self.failed_steps = failed_steps
+
+    def __str__(self):
+        return "Build of {} failed (failed steps: {})".format(
+            self.cmd[1], self.failed_steps
+        )
+
+
 def run_kiwix_build(
     target,
     config,
@@ -208,21 +269,6 @@ def run_kiwix_build(
     make_release=False,
     make_dist=False,
 ):
-    command = ["kiwix-build"]
-    command.append(target)
-    command.append("--hide-progress")
-    command.append("--fast-clone")
-    command.append("--assume-packages-installed")
-    command.append("--use-target-arch-name")
-    command.extend(["--config", config])
-    if build_deps_only:
-        command.append("--build-deps-only")
-    if target_only:
-        command.append("--build-nodeps")
-    if make_release:
-        command.append("--make-release")
-    if make_dist:
-        command.append("--make-dist")
     print_message(
         "Build {} (deps={}, release={}, dist={})",
         target,
@@ -230,129 +276,113 @@ def run_kiwix_build(
         make_release,
         make_dist,
     )
-    env = dict(_environ)
-    env["SKIP_BIG_MEMORY_TEST"] = "1"
-    subprocess.check_call(command, cwd=str(HOME), env=env)
-    print_message("Build ended")
+    (result,) = get_session(config).build(
+        [target],
+        deps_only=build_deps_only,
+        target_only=target_only,
+        make_release=make_release,
+        make_dist=make_dist,
+    )
+    print_message("Build ended ({:.0f}s)", result.duration)
+    if not result.success:
+        raise BuildError(target, config, result.failed_steps)
+    return result
 
 
-try:
-    import paramiko
+# Upload to this local directory instead of the servers (for tests)
+UPLOAD_LOCAL_DIR = _environ.get("UPLOAD_LOCAL_DIR")
 
-    def upload(file_to_upload, host, dest_path):
-        if not file_to_upload.exists():
-            print_message("No {} to upload!", file_to_upload)
-            return
+_uploader = None
 
-        if ":" in host:
-            host, port = host.split(":", 1)
-        else:
-            port = "22"
-        if "@" in host:
-            user, host = host.split("@", 1)
-        else:
-            user = None
-
-        from contextlib import contextmanager
-
-        @contextmanager
-        def get_client():
-            client = paramiko.client.SSHClient()
-            client.set_missing_host_key_policy(paramiko.client.WarningPolicy)
-            print_message(f"Connect to {host}:{port}")
-            client.connect(
-                host,
-                port=port,
-                username=user,
-                key_filename=_environ.get("SSH_KEY"),
-                look_for_keys=False,
-                compress=True,
-            )
-            try:
-                yield client
-            finally:
-                client.close()
-
-        @contextmanager
-        def get_sftp():
-            with get_client() as client:
-                sftp = client.open_sftp()
-                try:
-                    yield sftp
-                finally:
-                    sftp.close()
-
-        dest_path = PurePosixPath(dest_path)
-        remote_file = dest_path.joinpath(file_to_upload.name)
-
-        with get_sftp() as sftp:
-            for part in list(reversed(dest_path.parents)) + [dest_path]:
-                part = str(part)
-                try:
-                    sftp.stat(part)
-                except FileNotFoundError:
-                    sftp.mkdir(part)
-
-            print_message(f"Sending archive {file_to_upload} to {remote_file}")
-            sftp.put(str(file_to_upload), str(remote_file), confirm=True)
-
-except ModuleNotFoundError:
-    # On old system (bionic) paramiko is really complex to install
-    # Keep the old implementaion on sush system.
-
-    def upload(file_to_upload, host, dest_path):
-        if not file_to_upload.exists():
-            print_message("No {} to upload!", file_to_upload)
-            return
-
-        if ":" in host:
-            host, port = host.split(":", 1)
-        else:
-            port = "22"
-
-        # Using SFTP to create the directory hierarchy because we can not
-        # use SSH (no shell for this user); and then scp to upload the file.
-        #
-        # Sending SFTP mkdir command to the SFTP interactive mode and not batch (-b) mode
-        # as the latter would exit on any mkdir error while it is most likely
-        # the first parts of the destination is already present and thus can't be created
-        sftp_commands = "\n".join(
-            [
-                f"mkdir {part}"
-                for part in list(reversed(Path(dest_path).parents)) + [dest_path]
-            ]
+
+def get_uploader() -> Uploader:
+    global _uploader
+    if _uploader is None:
+        _uploader = Uploader(
+            local_dir=UPLOAD_LOCAL_DIR,
+            key_file=_environ.get("SSH_KEY"),
+            log=print_message,
         )
-        command = [
-            "sftp",
-            "-c",
-            "aes128-ctr",
-            "-i",
-            _environ.get("SSH_KEY"),
-            "-P",
-            port,
-            "-o",
-            "StrictHostKeyChecking=no",
-            host,
-        ]
-        print_message("Creating dest path {}", dest_path)
-        subprocess.run(command, input=sftp_commands.encode("utf-8"), check=True)
+        atexit.register(_uploader.close)
+    return _uploader
 
-        command = [
-            "scp",
-            "-c",
-            "aes128-ctr",
-            "-rp",
-            "-P",
-            port,
-            "-i",
-            _environ.get("SSH_KEY"),
-            "-o",
-            "StrictHostKeyChecking=no",
-            str(file_to_upload),
-            "{}:{}".format(host, dest_path),
+
+# Upload `file_to_upload` (and its sha256 in `<file>.sha256`) in the directory
+# `dest_path` of `host`. See `uploader.py`.
+def upload(file_to_upload, host, dest_path, overwrite=True):
+    if not file_to_upload.exists():
+        print_message("No {} to upload!", file_to_upload)
+        return
+    if UPLOAD_LOCAL_DIR or importlib.util.find_spec("paramiko"):
+        get_uploader().upload(file_to_upload, host, dest_path, overwrite)
+    else:
+        # On old system (bionic) paramiko is really complex to install
+        # Keep the old implementaion on sush system.
+        _upload_with_scp(file_to_upload, host, dest_path)
+
+
+# Upload several files at once: `uploads` are tuples of `upload` arguments.
+def upload_many(uploads):
+    if UPLOAD_LOCAL_DIR or importlib.util.find_spec("paramiko"):
+        get_uploader().upload_many(uploads)
+    else:
+        for args in uploads:
+            upload(*args)
+
+
+def _upload_with_scp(file_to_upload, host, dest_path):
+    if ":" in host:
+        host, port = host.split(":", 1)
+    else:
+        port = "22"
+
+    # Using SFTP to create the directory hierarchy because we can not
+    # use SSH (no shell for this user); and then scp to upload the file.
+    #
+    # Sending SFTP mkdir command to the SFTP interactive mode and not batch (-b) mode
+    # as the latter would exit on any mkdir error while it is most likely
+    # the first parts of the destination is already present and thus can't be created
+    sftp_commands = "\n".join(
+        [
+            f"mkdir {part}"
+            for part in list(reversed(Path(dest_path).parents)) + [dest_path]
         ]
-        print_message("Sending archive with command {}", command)
-        subprocess.check_call(command)
+    )
+    command = [
+        "sftp",
+        "-c",
+        "aes128-ctr",
+        "-i",
+        _environ.get("SSH_KEY"),
+        "-P",
+        port,
+        "-o",
+        "StrictHostKeyChecking=no",
+        host,
+    ]
+    print_message("Creating dest path {}", dest_path)
+    subprocess.run(command, input=sftp_commands.encode("utf-8"), check=True)
+
+    digest_file = write_digest_file(file_to_upload)
+
+    command = [
+        "scp",
+        "-c",
+        "aes128-ctr",
+        "-rp",
+        "-P",
+        port,
+        "-i",
+        _environ.get("SSH_KEY"),
+        "-o",
+        "StrictHostKeyChecking=no",
+        str(file_to_upload),
+        str(digest_file),
+        "{}:{}".format(host, dest_path),
+    ]
+    print_message("Sending archive with command {}", command)
+    subprocess.check_call(command)
+    digest_file.unlink()
 
 
 def upload_archive(archive, project, make_release, dev_branch=None):
@@ -377,9 +407,11 @@ def upload_archive(archive, project, make_release, dev_branch=None):
     else:
         # Make the archive read only. This way, scp will preserve rights.
         # If somehow we try to upload twice the same archive, scp will fails.
+        # (sftp upload makes the remote file read only itself, skips the same
+        # archive and fails for a different one)
         archive.chmod(0o444)
 
-    upload(archive, host, dest_path)
+    upload(archive, host, dest_path, overwrite=bool(dev_branch))
 
 
 # This remove "share/doc" and "share/man" from the thing to copy in the deps archive
@@ -393,27 +425,68 @@ def filter_install_dir(path):
                     yield sub_dir
 
 
+# Files of `install_dir` to put in a deps archive.
+# If `scope` (a set of dependency names) is given, the files installed by other
+# dependencies (as recorded in their manifest) are left out. Files not listed in
+# any manifest are always kept.
+def install_dir_files(install_dir, scope=None):
+    if scope is None:
+        yield from filter_install_dir(install_dir)
+        return
+    excluded = set()
+    for manifest_path in (install_dir / MANIFESTS_DIR).glob("*.json"):
+        if manifest_path.stem in scope:
+            continue
+        excluded.add(manifest_path)
+        manifest = read_manifest(str(install_dir), manifest_path.stem)
+        if manifest is not None:
+            excluded.update(install_dir / path for path in manifest_files(manifest))
+    for path in filter_install_dir(install_dir):
+        if path.is_dir() and not path.is_symlink():
+            paths = path.rglob("*")
+        else:
+            paths = [path]
+        for file in paths:
+            if file in excluded or (file.is_dir() and not file.is_symlink()):
+                continue
+            yield file
+
+
 # Full: True if we are creating a full archive to be used as cache by kiwix-build (base_deps_{os}_{config}_{base_deps_version}.tar.gz)
 # Full: False if we are creating a archive to be used as pre-cached dependencies for project's CI (deps_{config}_{target}.tar.gz)
-def make_deps_archive(target=None, name=None, full=False):
+# steps: The builder steps of the build of the deps of target. If given, only the
+# files of those dependencies are put in the archive.
+def make_deps_archive(target=None, name=None, full=False, steps=None):
     archive_name = name or "deps_{}_{}.tar.gz".format(
         get_dependency_archive_name(), target
     )
     print_message("Create archive {}.", archive_name)
-    files_to_archive = list(filter_install_dir(INSTALL_DIR))
+
+    def scope(config):
+        if steps is None:
+            return None
+        return {dep for step_config, dep in steps if step_config == config}
+
+    files_to_archive = list(install_dir_files(INSTALL_DIR, scope(COMPILE_CONFIG)))
     files_to_archive += HOME.glob("BUILD_*/LOGS")
     if COMPILE_CONFIG == "apple_all_static":
         for subconfig in AppleXCFramework.subConfigNames:
             base_dir = get_build_dir(subconfig)
-            files_to_archive += filter_install_dir(base_dir / "INSTALL")
+            files_to_archive += install_dir_files(
+                base_dir / "INSTALL", scope(subconfig)
+            )
             if (base_dir / "meson_cross_file.txt").exists():
                 files_to_archive.append(base_dir / "meson_cross_file.txt")
 
     if COMPILE_CONFIG.endswith("_mixed"):
         static_config = COMPILE_CONFIG.replace("_mixed", "_static")
-        files_to_archive += filter_install_dir(get_build_dir(static_config) / "INSTALL")
+        files_to_archive += install_dir_files(
+            get_build_dir(static_config) / "INSTALL", scope(static_config)
+        )
     if COMPILE_CONFIG.startswith("android_"):
-        files_to_archive += filter_install_dir(HOME / "BUILD_neutral" / "INSTALL")
+        files_to_archive += install_dir_files(
+            HOME / "BUILD_neutral" / "INSTALL", scope("neutral")
+        )
         base_dir = get_build_dir(COMPILE_CONFIG)
         if (base_dir / "meson_cross_file.txt").exists():
             files_to_archive.append(base_dir / "meson_cross_file.txt")
@@ -423,36 +496,62 @@ def make_deps_archive(target=None, name=None, full=False):
     if (BASE_DIR / "meson_cross_file.txt").exists():
         files_to_archive.append(BASE_DIR / "meson_cross_file.txt")
 
-    manifest_file = BASE_DIR / "manifest.txt"
+    # Archives may be created concurrently, each one has its own manifest file.
+    manifest_file = TMP_DIR / "{}.manifest.txt".format(archive_name)
     write_manifest(manifest_file, archive_name, target, COMPILE_CONFIG)
-    files_to_archive.append(manifest_file)
 
     relative_path = HOME
     if full:
-        files_to_archive += ARCHIVE_DIR.glob(".*_ok")
-        files_to_archive += BASE_DIR.glob("*/.*_ok")
-        # Add also static build for mixed target
-        if COMPILE_CONFIG.endswith("_mixed"):
-            static_config = COMPILE_CONFIG.replace("_mixed", "_static")
-            files_to_archive += get_build_dir(static_config).glob("*/.*_ok")
-        # Native dyn and static is needed for potential cross compilation that use native tools (icu)
-        files_to_archive += get_build_dir("native_dyn").glob("*/.*_ok")
-        files_to_archive += get_build_dir("native_static").glob("*/.*_ok")
-        files_to_archive += HOME.glob("BUILD_*android*/**/.*_ok")
-        files_to_archive += HOME.glob("BUILD_*apple-macos*/**/.*_ok")
-        files_to_archive += HOME.glob("BUILD_*apple-ios*/**/.*_ok")
-        files_to_archive += SOURCE_DIR.glob("*/.*_ok")
+        # The steps done (so kiwix-build doesn't run them again), imported by
+        # ensure_base_deps.
+        get_session(COMPILE_CONFIG).export_state(str(STATE_EXPORT_FILE))
+        files_to_archive.append(STATE_EXPORT_FILE)
         files_to_archive += SOURCE_DIR.glob("zim-testing-suite-*/*")
 
     archive_file = TMP_DIR / archive_name
-    with tarfile.open(str(archive_file), "w:gz") as tar:
-        for name in set(files_to_archive):
-            print(".{}".format(name), flush=True)
+    files_to_archive = set(files_to_archive)
+    with kbarchive.open_writer(archive_file, level=COMPRESSION_LEVEL) as tar:
+        tar.add(
+            str(manifest_file),
+            arcname=str((BASE_DIR / "manifest.txt").relative_to(relative_path)),
+        )
+        for name in files_to_archive:
             tar.add(str(name), arcname=str(name.relative_to(relative_path)))
+    manifest_file.unlink()
+    print_message(
+        "Archive {} created ({} entries).", archive_name, len(files_to_archive)
+    )
+
+    if CHUNK_STORE:
+        uploaded = chunkstore.pack(
+            get_store(CHUNK_STORE),
+            chunk_tree_name(archive_name),
+            HOME,
+            files_to_archive,
+        )
+        print_message("{} chunks uploaded to {}", uploaded, CHUNK_STORE)
 
     return archive_file
 
 
+# The name of the tree of an archive in the chunk store.
+def chunk_tree_name(archive_name):
+    return archive_name[: -len(kbarchive.EXTENSIONS[kbarchive.format_of(archive_name)])]
+
+
+# Create the deps archives of several targets at once.
+# `targets_steps` is a dict target -> builder steps of the build of its deps.
+# All the deps must have been built before. Return the archive files, in the
+# order of `targets_steps`.
+def make_deps_archives(targets_steps):
+    with ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(make_deps_archive, target=target, steps=steps)
+            for target, steps in targets_steps.items()
+        ]
+        return [future.result() for future in futures]
+
+
 def get_postfix(project):
     postfix = main_project_versions[project]
     extra = release_versions.get(project)
@@ -480,16 +579,41 @@ def sign_binary(path):
     subprocess.run(command, check=True)
 
 
-def make_archive(project, make_release):
+# Copy the files of `project` to export in a new directory and return it.
+# They keep their path relative to the base dir of EXPORT_FILES, so this
+# directory can be given as `base_dir` to the packaging functions.
+def snapshot_export_files(project):
+    try:
+        base_dir, export_files = EXPORT_FILES[project]
+    except KeyError:
+        return None
+    snapshot_dir = Path(
+        tempfile.mkdtemp(prefix="export_{}_".format(project), dir=str(TMP_DIR))
+    )
+    for export_file in export_files:
+        for f in base_dir.glob(export_file):
+            dest = snapshot_dir / f.relative_to(base_dir)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            if f.is_dir() and not f.is_symlink():
+                shutil.copytree(str(f), str(dest), symlinks=True)
+            else:
+                shutil.copy2(str(f), str(dest), follow_symlinks=False)
+    return snapshot_dir
+
+
+# `base_dir` replaces the base dir of the EXPORT_FILES of `project` (see
+# `snapshot_export_files`).
+def make_archive(project, make_release, base_dir=None):
     platform_name = get_platform_name()
     if not platform_name:
         return None
 
     try:
-        base_dir, export_files = EXPORT_FILES[project]
+        export_base_dir, export_files = EXPORT_FILES[project]
     except KeyError:
         # No binary files to export
         return None
+    base_dir = base_dir or export_base_dir
 
     if make_release:
         postfix = get_postfix(project)
@@ -514,7 +638,9 @@ def make_archive(project, make_release):
         archive_add = lambda a, f: a.write(str(f), arcname=str(f.relative_to(base_dir)))
         archive_ext = ".zip"
     else:
-        open_archive = lambda a: tarfile.open(str(a), "w:gz")
+        open_archive = lambda a: kbarchive.open_writer(
+            a, "gz", level=COMPRESSION_LEVEL or 9
+        )
         archive_add = lambda a, f: a.add(
             str(f), arcname="{}/{}".format(archive_name, str(f.relative_to(base_dir)))
         )
@@ -689,7 +815,7 @@ def trigger_docker_publish(target):
         raise exc
 
 
-def notarize_macos_build(project):
+def notarize_macos_build(project, base_dir=None):
     """sign and notarize files for macOS
 
     Expects the following environment:
@@ -702,7 +828,8 @@ def notarize_macos_build(project):
         return
 
     # currently only supports libzim use case: sign every dylib
-    base_dir, export_files = EXPORT_FILES[project]
+    export_base_dir, export_files = EXPORT_FILES[project]
+    base_dir = base_dir or export_base_dir
     filepaths = [
         base_dir.joinpath(file)
         for file in filter(lambda f: f.endswith(".dylib"), export_files)
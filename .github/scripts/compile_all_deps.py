@@ -4,19 +4,30 @@ import os
 
 from common import (
     run_kiwix_build,
-    make_deps_archive,
-    upload,
+    make_deps_archives,
+    upload_many,
     COMPILE_CONFIG,
     DEV_BRANCH,
 )
 from build_definition import select_build_targets, DEPS
 
+targets_steps = {}
 for target in select_build_targets(DEPS):
-    run_kiwix_build(target, config=COMPILE_CONFIG, build_deps_only=True)
-    archive_file = make_deps_archive(target=target)
-    if DEV_BRANCH:
-        destination = "/data/tmp/ci/dev_preview/" + DEV_BRANCH
-    else:
-        destination = "/data/tmp/ci"
-    upload(archive_file, "ci@tmp.kiwix.org:30022", destination)
+    result = run_kiwix_build(target, config=COMPILE_CONFIG, build_deps_only=True)
+    targets_steps[target] = result.steps
+
+# Each archive only contains the deps of its target, so they can all be created
+# once everything is built.
+archive_files = make_deps_archives(targets_steps)
+if DEV_BRANCH:
+    destination = "/data/tmp/ci/dev_preview/" + DEV_BRANCH
+else:
+    destination = "/data/tmp/ci"
+upload_many(
+    [
+        (archive_file, "ci@tmp.kiwix.org:30022", destination)
+        for archive_file in archive_files
+    ]
+)
+for archive_file in archive_files:
     os.remove(str(archive_file))
@@ -1,40 +1,127 @@
 #!/usr/bin/env python3
 
 import os
+import shutil
+import sqlite3
 import tarfile
+import tempfile
+import subprocess
+from pathlib import Path
 from urllib.request import urlopen
-from urllib.error import URLError
+from urllib.error import URLError, HTTPError
 
 from kiwixbuild.versions import base_deps_meta_version
+from kiwixbuild import archive, chunkstore
+from kiwixbuild.cache import get_store
 
 from common import (
     print_message,
     run_kiwix_build,
+    get_session,
     upload,
     make_deps_archive,
+    chunk_tree_name,
     HOME,
     COMPILE_CONFIG,
     OS_NAME,
     MAKE_RELEASE,
+    REMOTE_CACHE,
+    CHUNK_STORE,
+    STATE_EXPORT_FILE,
 )
 
+BASE_URL = "http://tmp.kiwix.org/ci/"
 
+
+class DigestError(Exception):
+    pass
+
+
+# What a missing, truncated or corrupt archive (or state file) may raise:
+# download errors (URLError and ConnectionResetError are OSError), a failing
+# decompressor, a bad tar or a bad exported state. The base deps are built
+# instead.
+BASE_DEPS_ERRORS = (
+    OSError,
+    EOFError,
+    DigestError,
+    tarfile.TarError,
+    subprocess.CalledProcessError,
+    ValueError,
+    sqlite3.Error,
+)
+
+
+def get_expected_digest(url):
+    try:
+        with urlopen(url + ".sha256") as resource:
+            return resource.read().decode().split()[0]
+    except HTTPError:
+        # Archive uploaded without digest file.
+        return None
+
+
+# Move the content of `src` in `dst`, merging the directories existing in both.
+def move_tree(src, dst):
+    for entry in src.iterdir():
+        dest_entry = dst / entry.name
+        if dest_entry.is_dir() and entry.is_dir() and not entry.is_symlink():
+            move_tree(entry, dest_entry)
+            entry.rmdir()
+        else:
+            os.replace(str(entry), str(dest_entry))
+
+
+# The archive is decompressed and extracted while downloaded, it is never
+# stored. Files are extracted in a temporary directory and moved in HOME only
+# once the digest of the archive is checked.
 def download_base_archive(base_name):
-    url = "http://tmp.kiwix.org/ci/{}".format(base_name)
-    file_path = str(HOME / base_name)
-    batch_size = 1024 * 1024 * 8
-    with urlopen(url) as resource, open(file_path, "wb") as file:
-        while True:
-            batch = resource.read(batch_size)
-            if not batch:
-                break
-            print(".", end="", flush=True)
-            file.write(batch)
-    return file_path
+    url = BASE_URL + base_name
+    expected_digest = get_expected_digest(url)
+    if expected_digest is None:
+        print_message("No digest for {}, it will not be checked", base_name)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=".base_deps_", dir=str(HOME)))
+    try:
+        with urlopen(url) as resource:
+            reader = archive.DigestReader(resource)
+            with archive.open_stream_reader(reader, archive.format_of(base_name)) as f:
+                archive.extract_all(f, str(tmp_dir))
+        if expected_digest is not None and reader.hexdigest() != expected_digest:
+            raise DigestError(
+                "{} has digest {}, expected {}".format(
+                    base_name, reader.hexdigest(), expected_digest
+                )
+            )
+        print_message("Extracted {} ({} bytes)", base_name, reader.size)
+        move_tree(tmp_dir, HOME)
+    finally:
+        shutil.rmtree(str(tmp_dir))
+
+
+# Only download the chunks of the base deps we don't already have.
+def fetch_from_chunk_store(base_name):
+    tree_name = chunk_tree_name(base_name)
+    print_message("Fetching {} from chunk store {}", tree_name, CHUNK_STORE)
+    try:
+        if chunkstore.fetch(get_store(CHUNK_STORE), tree_name, str(HOME)):
+            return True
+        print_message("No {} in chunk store", tree_name)
+    except (OSError, URLError, chunkstore.ChunkStoreError) as e:
+        print_message("Cannot fetch from chunk store: {}", e)
+    return False
+
+
+# Record the steps done in the base deps, kiwix-build will skip them.
+def import_build_state():
+    if not STATE_EXPORT_FILE.exists():
+        # Archive made when the steps were marked by files in their directory.
+        return
+    count = get_session(COMPILE_CONFIG).import_state(str(STATE_EXPORT_FILE))
+    print_message("{} steps imported from {}", count, STATE_EXPORT_FILE.name)
 
 
 def get_archive_name():
-    ARCHIVE_NAME_TEMPLATE = "base_deps_{os}_{config}_{version}.tar.gz"
+    ARCHIVE_NAME_TEMPLATE = "base_deps_{os}_{config}_{version}{extension}"
 
     if COMPILE_CONFIG == "flatpak":
         return "base_deps_flatpak.tar.gz"
@@ -43,24 +130,29 @@ def get_archive_name():
         os=OS_NAME,
         config=COMPILE_CONFIG,
         version=base_deps_meta_version,
+        extension=archive.EXTENSIONS[archive.INTERNAL_FORMAT],
     )
 
 
 def main():
     base_dep_archive_name = get_archive_name()
-    print_message("Getting archive {}", base_dep_archive_name)
     try:
-        local_filename = download_base_archive(base_dep_archive_name)
-        with tarfile.open(local_filename) as f:
-            f.extractall(str(HOME))
-        os.remove(str(local_filename))
-    except URLError:
+        if CHUNK_STORE and fetch_from_chunk_store(base_dep_archive_name):
+            import_build_state()
+            return
+        print_message("Getting archive {}", base_dep_archive_name)
+        download_base_archive(base_dep_archive_name)
+        import_build_state()
+    except BASE_DEPS_ERRORS as e:
+        print_message("Cannot use archive: {}", e)
         if COMPILE_CONFIG == "flatpak":
             print_message("Cannot get archive. Move on")
         else:
             print_message("Cannot get archive. Build dependencies")
             run_kiwix_build("alldependencies", config=COMPILE_CONFIG)
             archive_file = make_deps_archive(name=base_dep_archive_name, full=True)
+            # The digest file checked by `download_base_archive` is uploaded
+            # with the archive.
             upload(archive_file, "ci@tmp.kiwix.org:30022", "/data/tmp/ci")
             os.remove(str(archive_file))
 
@@ -68,5 +160,10 @@ def main():
 if __name__ == "__main__":
     if MAKE_RELEASE:
         print_message("We are building release. Don't download deps archive.")
+    elif REMOTE_CACHE and COMPILE_CONFIG != "flatpak":
+        print_message(
+            "Using remote cache {}. Dependencies are fetched when building.",
+            REMOTE_CACHE,
+        )
     else:
         main()
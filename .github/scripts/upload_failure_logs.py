@@ -1,17 +1,17 @@
 #!/usr/bin/env python3
 
-import tarfile
 from pathlib import Path
-from common import upload, OS_NAME, COMPILE_CONFIG, HOME
+from kiwixbuild import archive
+from common import upload, OS_NAME, COMPILE_CONFIG, HOME, COMPRESSION_LEVEL
 
-ARCHIVE_NAME = Path(f"fail_log_{OS_NAME}_{COMPILE_CONFIG}.tar.gz")
+ARCHIVE_NAME = Path(f"fail_log_{OS_NAME}_{COMPILE_CONFIG}.tar.xz")
 
 
 files_to_archive = []
 files_to_archive += HOME.glob("BUILD_*")
 files_to_archive += [HOME / "SOURCE", HOME / "LOGS", HOME / "TOOLCHAINS"]
 
-with tarfile.open(ARCHIVE_NAME, "w:xz") as tar:
+with archive.open_writer(ARCHIVE_NAME, level=COMPRESSION_LEVEL) as tar:
     for name in set(files_to_archive):
         tar.add(str(name))
 
@@ -0,0 +1,306 @@
+"""Upload files with sftp.
+
+The connection to a host is opened once and reused for all the files of the
+run. Several files are sent at the same time, each one on its own sftp
+channel.
+
+A file is sent as `<name>.part`, its sha256 is written in `<name>.sha256` and
+it is renamed when complete, so a file is never there without its digest.
+The sha256 of the file being sent is also written in `<name>.part.sha256`:
+an interrupted upload is resumed from the `.part` file only if it was the
+upload of the same file. A file already uploaded (same size and sha256) is
+skipped.
+
+Files uploaded without `overwrite` are made read only.
+
+With a `local_dir`, the "remote" paths are paths in this local directory
+and hosts are ignored (to test without server).
+"""
+
+import os
+import queue
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path, PurePosixPath
+
+# Number of files sent at the same time.
+UPLOAD_JOBS = 4
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(str(path), "rb") as f:
+        for data in iter(lambda: f.read(BLOCK_SIZE), b""):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+class LocalChannel:
+    """A stand-in of a paramiko `SFTPClient`, working in the directory `root`."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, path):
+        return str(self.root / str(path).lstrip("/"))
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def mkdir(self, path):
+        os.mkdir(self._path(path))
+
+    def open(self, path, mode):
+        return open(self._path(path), mode)
+
+    def rename(self, src, dst):
+        # Like sftp rename, fails if `dst` exists.
+        if os.path.exists(self._path(dst)):
+            raise OSError("{} already exists".format(dst))
+        os.rename(self._path(src), self._path(dst))
+
+    def posix_rename(self, src, dst):
+        os.replace(self._path(src), self._path(dst))
+
+    def remove(self, path):
+        os.remove(self._path(path))
+
+    def chmod(self, path, mode):
+        os.chmod(self._path(path), mode)
+
+    def close(self):
+        pass
+
+
+class Connection:
+    """The sftp channels to a host, opened on demand and reused."""
+
+    def __init__(self, open_channel, close=None):
+        self._open_channel = open_channel
+        self._close = close
+        self._free_channels = queue.LifoQueue()
+        self._channels = []
+        self._lock = threading.Lock()
+        # Remote directories known to exist.
+        self._existing_dirs = set()
+
+    def dir_exists(self, path):
+        """Whether the remote directory `path` is known to exist."""
+        with self._lock:
+            return path in self._existing_dirs
+
+    def add_existing_dirs(self, paths):
+        with self._lock:
+            self._existing_dirs.update(paths)
+
+    @contextmanager
+    def channel(self):
+        try:
+            channel = self._free_channels.get_nowait()
+        except queue.Empty:
+            channel = self._open_channel()
+            with self._lock:
+                self._channels.append(channel)
+        try:
+            yield channel
+        finally:
+            self._free_channels.put(channel)
+
+    def close(self):
+        for channel in self._channels:
+            channel.close()
+        if self._close is not None:
+            self._close()
+
+
+def _sftp_connection(host, port, user, key_file):
+    import paramiko
+
+    client = paramiko.client.SSHClient()
+    client.set_missing_host_key_policy(paramiko.client.WarningPolicy)
+    client.connect(
+        host,
+        port=port,
+        username=user,
+        key_filename=key_file,
+        look_for_keys=False,
+    )
+    # All channels share the same ssh connection.
+    return Connection(client.open_sftp, client.close)
+
+
+def _remote_size(channel, path):
+    try:
+        return channel.stat(str(path)).st_size
+    except FileNotFoundError:
+        return None
+
+
+def _remove(channel, path):
+    try:
+        channel.remove(str(path))
+    except FileNotFoundError:
+        pass
+
+
+def _remote_digest(channel, path):
+    try:
+        with channel.open(str(path), "r") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None
+    if isinstance(content, bytes):
+        content = content.decode()
+    return content.split()[0] if content.strip() else None
+
+
+class Uploader:
+    def __init__(self, local_dir=None, key_file=None, jobs=UPLOAD_JOBS, log=print):
+        self.local_dir = local_dir
+        self.key_file = key_file
+        self.jobs = jobs
+        self.log = log
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, host):
+        with self._lock:
+            if host not in self._connections:
+                if self.local_dir:
+                    connection = Connection(lambda: LocalChannel(self.local_dir))
+                else:
+                    address, port = host, 22
+                    if ":" in address:
+                        address, port = address.split(":", 1)
+                    user = None
+                    if "@" in address:
+                        user, address = address.split("@", 1)
+                    self.log("Connect to {}:{}".format(address, port))
+                    connection = _sftp_connection(
+                        address, int(port), user, self.key_file
+                    )
+                self._connections[host] = connection
+            return self._connections[host]
+
+    def _makedirs(self, connection, channel, path):
+        if connection.dir_exists(path):
+            return
+        # Look for the first existing parent from the deepest one, there is
+        # usually only one stat to do.
+        missing = []
+        for part in [path, *path.parents]:
+            if connection.dir_exists(part) or _remote_size(channel, part) is not None:
+                break
+            missing.append(part)
+        for part in reversed(missing):
+            try:
+                channel.mkdir(str(part))
+            except OSError:
+                # Created by another upload in the mean time ?
+                channel.stat(str(part))
+        connection.add_existing_dirs([path, *path.parents])
+
+    def _resume_offset(self, channel, part_file, size, sha256):
+        """The size of `part_file` if it is the start of the file to send."""
+        part_size = _remote_size(channel, part_file)
+        if not part_size or part_size > size:
+            return 0
+        if _remote_digest(channel, str(part_file) + ".sha256") != sha256:
+            # Interrupted upload of another file (or version).
+            return 0
+        return part_size
+
+    def upload(self, file, host, dest_path, overwrite=True):
+        """Upload `file` in the directory `dest_path` of `host`
+        ("[user@]host[:port]"), creating the directory if needed.
+
+        If a different file already exists, it is replaced only if
+        `overwrite` is set, else FileExistsError is raised."""
+        file = Path(file)
+        if not file.exists():
+            self.log("No {} to upload!".format(file))
+            return
+        dest_path = PurePosixPath(dest_path)
+        remote_file = dest_path / file.name
+        part_file = dest_path / (file.name + ".part")
+        part_digest_file = dest_path / (file.name + ".part.sha256")
+        digest_file = dest_path / (file.name + ".sha256")
+        size = file.stat().st_size
+        sha256 = file_sha256(file)
+
+        connection = self._connection(host)
+        with connection.channel() as channel:
+            self._makedirs(connection, channel, dest_path)
+            remote_size = _remote_size(channel, remote_file)
+            if remote_size is not None:
+                # A complete `.part` of this file: the upload replacing the
+                # remote file (of the same size) was interrupted before the
+                # rename, the digest is the one of the `.part` file. Without
+                # `overwrite`, the remote file is never replaced.
+                interrupted = (
+                    overwrite
+                    and self._resume_offset(channel, part_file, size, sha256) == size
+                )
+                if (
+                    remote_size == size
+                    and _remote_digest(channel, digest_file) == sha256
+                    and not interrupted
+                ):
+                    self.log("{} already uploaded to {}".format(file, remote_file))
+                    # Left by an interrupted upload.
+                    _remove(channel, part_file)
+                    _remove(channel, part_digest_file)
+                    return
+                if not overwrite:
+                    raise FileExistsError(
+                        "{} already exists with a different content".format(remote_file)
+                    )
+
+            offset = self._resume_offset(channel, part_file, size, sha256)
+            if offset:
+                self.log("Resume {} to {} at {}".format(file, remote_file, offset))
+            else:
+                self.log("Send {} to {}".format(file, remote_file))
+                with channel.open(str(part_digest_file), "w") as f:
+                    f.write("{}  {}\n".format(sha256, file.name))
+            if offset < size:
+                with open(str(file), "rb") as src, channel.open(
+                    str(part_file), "r+b" if offset else "wb"
+                ) as dst:
+                    if hasattr(dst, "set_pipelined"):
+                        # Don't wait for the ack of each write.
+                        dst.set_pipelined(True)
+                    src.seek(offset)
+                    dst.seek(offset)
+                    shutil.copyfileobj(src, dst, BLOCK_SIZE)
+            if _remote_size(channel, part_file) != size:
+                raise OSError("Incomplete upload of {}".format(remote_file))
+            with channel.open(str(digest_file), "w") as f:
+                f.write("{}  {}\n".format(sha256, file.name))
+            if overwrite:
+                channel.posix_rename(str(part_file), str(remote_file))
+            else:
+                channel.rename(str(part_file), str(remote_file))
+                # As scp did with the read only archives. Not done on the
+                # `.part` file, a resumed upload must be able to write it.
+                channel.chmod(str(remote_file), 0o444)
+            channel.remove(str(part_digest_file))
+
+    def upload_many(self, uploads):
+        """Do the `uploads` (tuples of `upload` arguments) in parallel.
+
+        All uploads are tried, the first error is raised at the end."""
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self.upload, *args) for args in uploads]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        for connection in self._connections.values():
+            connection.close()
+        self._connections.clear()
@@ -5,12 +5,12 @@ import argparse
 
 from .dependencies import Dependency
 from .configs import ConfigInfo
-from .builder import Builder
-from .flatpak_builder import FlatpakBuilder
-from . import _global
+from .compiler_cache import SUPPORTED_COMPILER_CACHES
+from .state import print_status
+from . import _global, buildenv
 
 
-def parse_args():
+def parse_args(args=None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "target",
@@ -38,7 +38,24 @@ def parse_args():
     )
     parser.add_argument("--libprefix", default=None)
     parser.add_argument(
-        "--config", choices=ConfigInfo.all_configs, default="native_dyn"
+        "--env",
+        action="append",
+        metavar="NAME=VALUE",
+        help=(
+            "Set the environment variable NAME to VALUE for the build commands.\n"
+            "Can be given several times."
+        ),
+    )
+    parser.add_argument(
+        "--config",
+        action="append",
+        metavar="CONFIG",
+        help=(
+            "The config to build for (default to native_dyn).\n"
+            "Can be given several times (or as a comma separated list) to build "
+            "for several configs at once. Sources and toolchains are shared and "
+            "the steps of all configs are scheduled together."
+        ),
     )
     parser.add_argument(
         "--verbose",
@@ -137,10 +154,168 @@ def parse_args():
             "Intended to be used in CI only."
         ),
     )
+    subgroup.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        metavar="N",
+        help=(
+            "Total number of jobs (compilation, tests, ...) to run at the same time "
+            "(default to the number of cpus).\n"
+            "The jobs are shared between all the running steps using a make "
+            "jobserver. ninja and meson test, which don't use it, run with the "
+            "jobs free when they start."
+        ),
+    )
+    subgroup.add_argument(
+        "--jobs-steps",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Run up to N independent build steps at the same time.\n"
+            "A step is started as soon as its dependencies are installed."
+        ),
+    )
+    subgroup.add_argument(
+        "--jobs-sources",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Prepare (download, extract and patch) up to N sources at the same time.\n"
+            "The output is still printed in the sources order."
+        ),
+    )
+    subgroup.add_argument(
+        "--mirror",
+        action="append",
+        metavar="URL",
+        help=(
+            "Try to download archives from the mirror URL (a http(s) or file url, "
+            "or a local directory) before their own urls.\n"
+            "Can be given several times, mirrors are tried in order."
+        ),
+    )
+    subgroup.add_argument(
+        "--download-chunks",
+        type=int,
+        default=1,
+        metavar="N",
+        help=(
+            "Download big archives with N parallel http range requests "
+            "(if the server supports it)."
+        ),
+    )
+    subgroup.add_argument(
+        "--system-extract",
+        action="store_true",
+        help=(
+            "Extract archives with system tools (tar, unzip or bsdtar) and "
+            "multithreaded decompressors (pigz, xz -T0, zstd -T0) when available."
+        ),
+    )
+    subgroup.add_argument(
+        "--compiler-cache",
+        choices=SUPPORTED_COMPILER_CACHES,
+        default=None,
+        help=(
+            "Run the compilers (native and cross) through ccache or sccache.\n"
+            "Hits and misses are reported for each dependency at the end of the "
+            "build."
+        ),
+    )
+    subgroup.add_argument(
+        "--cache-dir",
+        default=None,
+        metavar="DIR",
+        help=(
+            "Cache the files installed by each dependency in DIR.\n"
+            "Entries are indexed by a fingerprint of the sources, options, "
+            "environment and dependencies used to build them."
+        ),
+    )
+    subgroup.add_argument(
+        "--remote-cache",
+        default=None,
+        metavar="URL",
+        help=(
+            "Fetch the missing cache entries from URL before building.\n"
+            "URL is a http(s) url or a directory. Dependencies not found are built "
+            "locally. Implies a cache dir (default to `<working_dir>/CACHE`)."
+        ),
+    )
+    subgroup.add_argument(
+        "--push-cache",
+        action="store_true",
+        help=(
+            "Push the new cache entries to the remote cache "
+            "(http PUT or copy to the directory)."
+        ),
+    )
     subgroup.add_argument(
         "--get-build-dir", action="store_true", help="Print the output directory."
     )
-    options = parser.parse_args()
+    subgroup.add_argument(
+        "--report",
+        action="store_true",
+        help=(
+            "Don't build anything but print a report of the previous builds of "
+            "target: critical path, serial and ideal parallel time and slowest "
+            "steps of each config.\n"
+            "Durations are read from `LOGS/trace.jsonl`."
+        ),
+    )
+    subgroup.add_argument(
+        "--status",
+        action="store_true",
+        help=(
+            "Don't build anything but print the state of the steps recorded in "
+            "the working dir (status, duration, log of the failed ones) and the "
+            "files installed by each dependency."
+        ),
+    )
+    subgroup.add_argument(
+        "--export-state",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Don't build anything but export the steps done and the installed "
+            "files recorded in the working dir to the json FILE."
+        ),
+    )
+    subgroup.add_argument(
+        "--import-state",
+        default=None,
+        metavar="FILE",
+        help=(
+            "Don't build anything but import the state exported in FILE (from "
+            "another working dir with the same layout)."
+        ),
+    )
+    options = parser.parse_args(args)
+
+    configs = []
+    for value in options.config or ["native_dyn"]:
+        configs.extend(c for c in value.split(",") if c)
+    for config in configs:
+        if config not in ConfigInfo.all_configs:
+            parser.error(
+                "argument --config: invalid choice: '{}' (choose from {})".format(
+                    config, ", ".join(ConfigInfo.all_configs)
+                )
+            )
+    options.config = list(dict.fromkeys(configs))
+    env = {}
+    for item in options.env or []:
+        if "=" not in item:
+            parser.error("argument --env: expected NAME=VALUE, got '{}'".format(item))
+        name, value = item.split("=", 1)
+        env[name] = value
+    options.env = env
+    if "flatpak" in options.config and len(options.config) > 1:
+        parser.error("argument --config: flatpak cannot be built with other configs")
 
     if not options.android_arch:
         options.android_arch = ["arm", "arm64", "x86", "x86_64"]
@@ -154,13 +329,37 @@ def main():
     options = parse_args()
     options.working_dir = os.path.abspath(options.working_dir)
     _global.set_options(options)
-    neutralEnv = buildenv.NeutralEnv(options.get_build_dir)
+    if options.report and options.config == ["flatpak"]:
+        sys.exit("ERROR: --report is not supported for the flatpak config")
+    state_only = options.status or options.export_state or options.import_state
+    neutralEnv = buildenv.NeutralEnv(
+        options.get_build_dir or options.report or state_only
+    )
     _global.set_neutralEnv(neutralEnv)
-    if options.config == "flatpak":
+    if state_only:
+        if options.import_state:
+            count = neutralEnv.state.import_state(options.import_state)
+            print("{} steps imported from {}".format(count, options.import_state))
+        if options.export_state:
+            count = neutralEnv.state.export_state(options.export_state)
+            print("{} steps exported to {}".format(count, options.export_state))
+        if options.status:
+            print_status(neutralEnv.state)
+        return
+    if options.get_build_dir:
+        # No need to resolve all the targets (and import their modules).
+        for config_name in options.config:
+            print(ConfigInfo.get_config(config_name, {}).buildEnv.build_dir)
+        return
+    if options.config == ["flatpak"]:
+        from .flatpak_builder import FlatpakBuilder
+
         builder = FlatpakBuilder()
     else:
+        from .builder import Builder
+
         builder = Builder()
-    if options.get_build_dir:
-        print(ConfigInfo.get_config(options.config).buildEnv.build_dir)
+    if options.report:
+        builder.report()
     else:
         builder.run()
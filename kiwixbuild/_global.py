@@ -38,3 +38,7 @@ def get_target_step(key, default_context=None):
 
 def target_steps():
     return _target_steps
+
+
+def reset_target_steps():
+    _target_steps.clear()
@@ -0,0 +1,149 @@
+"""Drive kiwix-build from python.
+
+    from kiwixbuild.api import Session
+
+    session = Session(config="native_static", working_dir="~/kiwix")
+    for result in session.build(["libzim", "kiwix-tools"]):
+        print(result.target, result.success, result.duration)
+
+A session parses the options, detects the tools and creates the configs
+once, and reuses them for all the builds it runs. kiwix-build state is
+global, so only one session must be used at a time.
+"""
+
+import os
+import copy
+import time
+from collections import namedtuple
+
+from . import parse_args, _global, buildenv
+from .configs import ConfigInfo
+from .utils import StopBuild
+
+BuildResult = namedtuple(
+    "BuildResult",
+    ("target", "config", "success", "steps", "failed_steps", "duration"),
+)
+BuildResult.__doc__ = """The result of the build of a target.
+
+`steps` are the builder steps (config, name) of the build and `failed_steps`
+the ones which failed. `duration` is in seconds."""
+
+
+class Session:
+    """A kiwix-build session for the config `config` (a config name or a
+    list of config names).
+
+    `options` are the kiwix-build options, named as their destination in
+    `kiwix-build --help` (`working_dir`, `fast_clone`, `remote_cache`, ...).
+    `env` (the `--env` option) is a dict.
+    """
+
+    def __init__(self, config="native_dyn", **options):
+        if isinstance(config, str):
+            config = [config]
+        self.options = parse_args(["--config", ",".join(config)])
+        for name, value in options.items():
+            if not hasattr(self.options, name):
+                raise TypeError("Unknown kiwix-build option {}".format(name))
+            setattr(self.options, name, value)
+        self.options.working_dir = os.path.abspath(
+            os.path.expanduser(self.options.working_dir)
+        )
+        self.config = ",".join(self.options.config)
+        # Configs may come from another session.
+        ConfigInfo.all_running_configs.clear()
+        _global.set_options(self.options)
+        # The tools are detected only when we build something.
+        self._neutralEnv = buildenv.NeutralEnv(True)
+        self._dummy_env = True
+        _global.set_neutralEnv(self._neutralEnv)
+
+    def _activate(self, options):
+        _global.set_options(options)
+        if self._dummy_env:
+            self._neutralEnv = buildenv.NeutralEnv(False)
+            self._dummy_env = False
+        _global.set_neutralEnv(self._neutralEnv)
+
+    def get_build_dir(self, config=None):
+        """Return the build directory of `config` (default to the first config of
+        the session)."""
+        _global.set_options(self.options)
+        _global.set_neutralEnv(self._neutralEnv)
+        config = config or self.options.config[0]
+        # The configs created only to know their build dir must not be set
+        # up (toolchains, packages, ...) by the next builds.
+        running_configs = dict(ConfigInfo.all_running_configs)
+        try:
+            return ConfigInfo.get_config(config, {}).buildEnv.build_dir
+        finally:
+            ConfigInfo.all_running_configs.clear()
+            ConfigInfo.all_running_configs.update(running_configs)
+
+    def export_state(self, path):
+        """Export the state of the steps done in the working dir to the json
+        file `path`. Return the number of steps exported."""
+        return self._neutralEnv.state.export_state(path)
+
+    def import_state(self, path):
+        """Import the state exported in `path`. Return the number of steps
+        imported."""
+        return self._neutralEnv.state.import_state(path)
+
+    def build(
+        self,
+        targets,
+        deps_only=False,
+        target_only=False,
+        make_release=False,
+        make_dist=False,
+        keep_going=False,
+    ):
+        """Build the `targets` one after the other.
+
+        Return the list of BuildResult of the targets built. Unless
+        `keep_going` is set, stop at the first target which fails."""
+        if isinstance(targets, str):
+            targets = [targets]
+        results = []
+        for target in targets:
+            options = copy.copy(self.options)
+            options.target = target
+            options.build_deps_only = deps_only
+            options.build_nodeps = target_only
+            options.make_release = make_release
+            options.make_dist = make_dist
+            result = self._build(options)
+            results.append(result)
+            if not result.success and not keep_going:
+                break
+        return results
+
+    def _build(self, options):
+        self._activate(options)
+        _global.reset_target_steps()
+        start_time = time.time()
+        if options.config == ["flatpak"]:
+            from .flatpak_builder import FlatpakBuilder
+
+            builder = FlatpakBuilder()
+        else:
+            from .builder import Builder
+
+            builder = Builder()
+        try:
+            builder._run()
+            success = not builder.failed_steps
+        except StopBuild as e:
+            print(e)
+            success = False
+        steps = [s for s in _global.target_steps() if s[0] != "source"]
+        return BuildResult(
+            options.target,
+            self.config,
+            success,
+            steps,
+            list(builder.failed_steps),
+            time.time() - start_time,
+        )
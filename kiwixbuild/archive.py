@@ -0,0 +1,233 @@
+"""Write and read compressed tar archives.
+
+Compression is done by external tools when they are available, as they use
+all the cores (pigz, xz -T0, zstd -T0). Their output is a standard archive
+(pigz output is a plain gzip stream). Python is used as fallback for gzip
+and xz, zstd needs the `zstd` tool."""
+
+import os
+import shutil
+import hashlib
+import tarfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+EXTENSIONS = {
+    "gz": ".tar.gz",
+    "xz": ".tar.xz",
+    "zst": ".tar.zst",
+}
+
+DEFAULT_LEVELS = {
+    "gz": 6,
+    "xz": 6,
+    "zst": 3,
+}
+
+# Commands (in order of preference) compressing stdin to stdout.
+COMPRESSORS = {
+    "gz": [["pigz", "-c"], ["gzip", "-c"]],
+    "xz": [["xz", "-T0", "-c"]],
+    "zst": [["zstd", "-T0", "-q", "-c"]],
+}
+
+# Commands (in order of preference) decompressing a file to stdout.
+DECOMPRESSORS = {
+    "gz": [["pigz", "-dc"], ["gzip", "-dc"]],
+    "xz": [["xz", "-T0", "-dc"]],
+    "zst": [["zstd", "-T0", "-q", "-dc"]],
+}
+
+# Formats python can handle itself.
+PYTHON_FORMATS = ("gz", "xz")
+
+# The format of the archives only read by kiwix-build (caches, base deps).
+# It must be the same on all hosts, archives are shared: gzip, which python
+# can always read (and pigz compresses on all the cores).
+INTERNAL_FORMAT = "gz"
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def format_of(path):
+    """Return the format of the archive `path`, from its extension."""
+    for fmt, extension in EXTENSIONS.items():
+        if str(path).endswith(extension):
+            return fmt
+    raise ValueError("Unknown archive format for {}".format(path))
+
+
+def _find_command(commands):
+    for command in commands:
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+@contextmanager
+def _process_stream(command, **kwargs):
+    process = subprocess.Popen(command, **kwargs)
+    stream = process.stdin or process.stdout
+    try:
+        yield stream
+    finally:
+        stream.close()
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+@contextmanager
+def open_writer(path, fmt=None, level=None):
+    """Open the tar archive `path` for writing.
+
+    `fmt` defaults to the format given by the extension of `path` and `level`
+    to the default compression level of the format."""
+    fmt = fmt or format_of(path)
+    if level is None:
+        level = DEFAULT_LEVELS[fmt]
+    command = _find_command(COMPRESSORS[fmt])
+    if command == ["gzip", "-c"] and level == 0:
+        # gzip has no level 0 (no compression), python has.
+        command = None
+    if command is None and fmt not in PYTHON_FORMATS:
+        raise RuntimeError("No {} compressor found".format(fmt))
+    with open(str(path), "wb") as f:
+        if command is None:
+            if fmt == "gz":
+                kwargs = {"compresslevel": level}
+            else:
+                kwargs = {"preset": level}
+            with tarfile.open(fileobj=f, mode="w:" + fmt, **kwargs) as tar:
+                yield tar
+            return
+        command = command + ["-{}".format(level)]
+        with _process_stream(command, stdin=subprocess.PIPE, stdout=f) as stream:
+            with tarfile.open(fileobj=stream, mode="w|") as tar:
+                yield tar
+
+
+@contextmanager
+def open_reader(path):
+    """Open the tar archive `path` for reading.
+
+    zstd archives are decompressed by the `zstd` tool and can only be read
+    sequentially (as a stream)."""
+    path = str(path)
+    if format_of(path) in PYTHON_FORMATS:
+        with tarfile.open(path) as tar:
+            yield tar
+        return
+    command = _find_command(DECOMPRESSORS[format_of(path)])
+    if command is None:
+        raise RuntimeError("No decompressor found for {}".format(path))
+    with _process_stream(command + [path], stdout=subprocess.PIPE) as stream:
+        with tarfile.open(fileobj=stream, mode="r|") as tar:
+            yield tar
+
+
+class UnsafeArchiveError(tarfile.TarError):
+    pass
+
+
+def check_path(dest_dir, name):
+    """Raise UnsafeArchiveError if the member `name` would be extracted
+    outside `dest_dir` (absolute path, `..` or through a symlink)."""
+    dest_dir = os.path.realpath(dest_dir)
+    path = os.path.realpath(os.path.join(dest_dir, name))
+    if os.path.commonpath([dest_dir, path]) != dest_dir:
+        raise UnsafeArchiveError("{} is outside of {}".format(name, dest_dir))
+
+
+def _checked_members(tar, dest_dir, members, filter):
+    for member in members:
+        check_path(dest_dir, member.name)
+        if member.islnk():
+            # Hard links are relative to the archive root.
+            check_path(dest_dir, member.linkname)
+        if filter == "data":
+            if member.issym():
+                link = os.path.join(os.path.dirname(member.name), member.linkname)
+                check_path(dest_dir, link)
+            if member.isdev():
+                raise UnsafeArchiveError("{} is a device".format(member.name))
+        yield member
+
+
+def extract_all(tar, dest_dir, members=None, filter="tar"):
+    """Extract the `members` (default to all) of `tar` in `dest_dir`, refusing
+    to write anything outside `dest_dir`.
+
+    `filter` is the tarfile extraction filter: "tar" for any archive, "data"
+    to also refuse links outside `dest_dir` and special files. The members
+    are also checked by us, for python without extraction filters (and to
+    refuse absolute names instead of stripping their leading "/")."""
+    members = tar if members is None else members
+    members = _checked_members(tar, dest_dir, members, filter)
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest_dir, members=members, filter=filter)
+    else:
+        tar.extractall(dest_dir, members=members)
+
+
+class DigestReader:
+    """Wrap the file object `f`, computing the sha256 of the data read."""
+
+    def __init__(self, f):
+        self._f = f
+        self._sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._sha256.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+
+def _copy_to_process(f, process, errors):
+    try:
+        with process.stdin:
+            shutil.copyfileobj(f, process.stdin, CHUNK_SIZE)
+    except BaseException as e:
+        errors.append(e)
+
+
+@contextmanager
+def open_stream_reader(f, fmt):
+    """Open the tar archive read from the file object `f` (compressed with
+    `fmt`) as a stream.
+
+    Decompression is done by an external tool if available, while `f` is
+    read in a thread. `f` is always read until its end, even if the end of the
+    archive is reached before."""
+    command = _find_command(DECOMPRESSORS[fmt])
+    if command is None:
+        if fmt not in PYTHON_FORMATS:
+            raise RuntimeError("No {} decompressor found".format(fmt))
+        with tarfile.open(fileobj=f, mode="r|" + fmt) as tar:
+            yield tar
+        while f.read(CHUNK_SIZE):
+            pass
+        return
+    errors = []
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    feeder = threading.Thread(target=_copy_to_process, args=(f, process, errors))
+    feeder.start()
+    try:
+        with tarfile.open(fileobj=process.stdout, mode="r|") as tar:
+            yield tar
+        while process.stdout.read(CHUNK_SIZE):
+            pass
+    finally:
+        process.stdout.close()
+        feeder.join()
+        returncode = process.wait()
+    if errors:
+        raise errors[0]
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, command)
@@ -1,9 +1,15 @@
 import os, sys, shutil
 import subprocess
 import platform
-import distro
+import threading
 
 from .utils import pj, download_remote, escape_path
+from .jobserver import JobServer
+from .trace import Trace
+from .compiler_cache import set_env as compiler_cache_env
+from .cache import ArtifactCache, get_store
+from .tool_cache import ToolCache
+from .state import BuildState, STATE_DB
 from ._global import neutralEnv, option
 
 
@@ -17,10 +23,26 @@ class NeutralEnv:
         for d in (self.source_dir, self.archive_dir, self.toolchain_dir, self.log_dir):
             os.makedirs(d, exist_ok=True)
         self.detect_platform()
+        self.tool_cache = ToolCache(pj(self.working_dir, "tool_cache.json"))
+        self.state = BuildState(pj(self.working_dir, STATE_DB), self.working_dir)
+        if option("cache_dir") or option("remote_cache"):
+            cache_dir = option("cache_dir") or pj(self.working_dir, "CACHE")
+            self.artifact_cache = ArtifactCache(
+                os.path.abspath(cache_dir),
+                get_store(option("remote_cache")) if option("remote_cache") else None,
+                option("push_cache"),
+            )
+        else:
+            self.artifact_cache = None
         if dummy_run:
             # If this is for a dummy run, we will not run anything.
             # To check for command (and so, don't enforce their presence)
+            self.jobserver = None
+            self.trace = None
+            self.compiler_cache = None
             return
+        self.jobserver = JobServer(option("jobs"))
+        self.trace = Trace(pj(self.log_dir, "trace.jsonl"))
         self.ninja_command = self._detect_command(
             "ninja", default=[["ninja"], ["ninja-build"]]
         )
@@ -38,11 +60,17 @@ class NeutralEnv:
         self.qmake_command = self._detect_command(
             "qmake", required=False, default=[["qmake"], ["qmake-qt5"]]
         )
+        if option("compiler_cache"):
+            self.compiler_cache = self._detect_command(option("compiler_cache"))
+        else:
+            self.compiler_cache = None
 
     def detect_platform(self):
         _platform = platform.system()
         self.distname = _platform
         if _platform == "Linux":
+            import distro
+
             self.distname = distro.id()
             if self.distname == "ubuntu":
                 self.distname = "debian"
@@ -57,6 +85,11 @@ class NeutralEnv:
         env_key = "KBUILD_{}_COMMAND".format(name.upper())
         if env_key in os.environ:
             default = [os.environ[env_key].split()] + default
+        cache_key = self.tool_cache.make_key("command", default, options)
+        executables = [command[0] for command in default]
+        command = self.tool_cache.get(cache_key, executables)
+        if command is not None:
+            return command
         for command in default:
             try:
                 retcode = subprocess.check_call(
@@ -66,6 +99,7 @@ class NeutralEnv:
                 # Doesn't exist in PATH or isn't executable
                 continue
             if retcode == 0:
+                self.tool_cache.set(cache_key, executables, command)
                 return command
         else:
             if required:
@@ -91,6 +125,8 @@ class BuildEnv:
             os.makedirs(d, exist_ok=True)
 
         self.libprefix = option("libprefix") or self._detect_libdir()
+        # Held while a step installs in (or restores to) install_dir.
+        self.install_lock = threading.Lock()
 
     def clean_intermediate_directories(self):
         for subdir in os.listdir(self.build_dir):
@@ -99,6 +135,7 @@ class BuildEnv:
                 continue
             if os.path.isdir(subpath):
                 shutil.rmtree(subpath)
+                neutralEnv("state").forget(subpath)
             else:
                 os.remove(subpath)
 
@@ -109,6 +146,11 @@ class BuildEnv:
         if self.configInfo.libdir is not None:
             return self.configInfo.libdir
         if self._is_debianlike():
+            tool_cache = neutralEnv("tool_cache")
+            cache_key = tool_cache.make_key("dpkg-architecture")
+            archpath = tool_cache.get(cache_key, ["dpkg-architecture"])
+            if archpath is not None:
+                return "lib/" + archpath
             try:
                 pc = subprocess.Popen(
                     ["dpkg-architecture", "-qDEB_HOST_MULTIARCH"],
@@ -118,6 +160,7 @@ class BuildEnv:
                 (stdo, _) = pc.communicate()
                 if pc.returncode == 0:
                     archpath = stdo.decode().strip()
+                    tool_cache.set(cache_key, ["dpkg-architecture"], archpath)
                     return "lib/" + archpath
             except Exception:
                 pass
@@ -125,8 +168,11 @@ class BuildEnv:
             return "lib64"
         return "lib"
 
-    def get_env(self, *, cross_comp_flags, cross_compilers, cross_path):
+    def get_env(
+        self, *, cross_comp_flags, cross_compilers, cross_path, compiler_cache=True
+    ):
         env = self.configInfo.get_env()
+        env.update(option("env"))
         pkgconfig_path = pj(self.install_dir, self.libprefix, "pkgconfig")
         env["PKG_CONFIG_PATH"].append(pkgconfig_path)
 
@@ -160,10 +206,16 @@ class BuildEnv:
             ]
         )
 
+        makeflags = neutralEnv("jobserver").makeflags
+        if makeflags:
+            env["MAKEFLAGS"] = makeflags
+
         if cross_comp_flags:
             self.configInfo.set_comp_flags(env)
         if cross_compilers:
             self.configInfo.set_compiler(env)
+        if compiler_cache:
+            compiler_cache_env(env, self.configInfo)
         if cross_path:
             env["PATH"][0:0] = self.configInfo.get_bin_dir()
         return env
@@ -4,6 +4,10 @@ from .buildenv import *
 
 from .configs import ConfigInfo
 from .utils import remove_duplicates, StopBuild, colorize
+from .scheduler import run_steps
+from .report import print_report
+from .trace import read_trace
+from .compiler_cache import StepStats, print_stats as print_compiler_cache_stats
 from .dependencies import Dependency
 from .packages import PACKAGE_NAME_MAPPERS
 from ._global import (
@@ -20,18 +24,26 @@ import tarfile
 class Builder:
     def __init__(self):
         self._targets = {}
+        self.compiler_cache_stats = []
+        self.failed_steps = []
         ConfigInfo.get_config("neutral", self._targets)
 
-        config_name = option("config")
-        config = ConfigInfo.get_config(config_name, self._targets)
-        if neutralEnv("distname") not in config.compatible_hosts:
-            print(
-                (
-                    colorize("ERROR") + ": The config {} cannot be build on host {}.\n"
-                    "Select another config or change your host system."
-                ).format(config.name, neutralEnv("distname"))
-            )
-        self.targetDefs = config.add_targets(option("target"), self._targets)
+        self.targetDefs = []
+        for config_name in option("config"):
+            config = ConfigInfo.get_config(config_name, self._targets)
+            if neutralEnv("distname") not in config.compatible_hosts:
+                print(
+                    (
+                        colorize("ERROR")
+                        + ": The config {} cannot be build on host {}.\n"
+                        "Select another config or change your host system."
+                    ).format(config.name, neutralEnv("distname"))
+                )
+            self.targetDefs += config.add_targets(option("target"), self._targets)
+        # Configs created by a previous build of the same process are also
+        # set up (see `kiwixbuild.api`).
+        for config in ConfigInfo.all_running_configs.values():
+            config.setup_toolchains(self._targets)
 
     def make_dist(self):
         build_output_dir = "/path/to/build/output"  # Replace with your actual output directory
@@ -64,12 +76,14 @@ class Builder:
                 if stepClass.dont_skip:
                     add_target_step(dep, self._targets[dep])
 
-            src_targetDef = ("source", targetDef[1])
-            add_target_step(src_targetDef, self._targets[src_targetDef])
-            add_target_step(targetDef, self._targets[targetDef])
+            for targetDef in self.targetDefs:
+                src_targetDef = ("source", targetDef[1])
+                add_target_step(src_targetDef, self._targets[src_targetDef])
+                add_target_step(targetDef, self._targets[targetDef])
         else:
+            targetNames = set(targetDef[1] for targetDef in self.targetDefs)
             for dep in steps:
-                if option("build_deps_only") and dep[1] == targetDef[1]:
+                if option("build_deps_only") and dep[1] in targetNames:
                     continue
                 add_target_step(dep, self._targets[dep])
         self.instanciate_steps()
@@ -116,6 +130,27 @@ class Builder:
                 builder = get_target_step(stepDef)(stepClass, source, env)
                 add_target_step(stepDef, builder)
 
+    def fetch_cache(self):
+        cache = neutralEnv("artifact_cache")
+        if cache is None or cache.remote is None:
+            print(colorize("SKIP"))
+            return
+        keys = []
+        for stepDef in target_steps():
+            if stepDef[0] != "source":
+                key = get_target_step(stepDef).cache_key
+                if key is not None:
+                    keys.append(key)
+        print("fetch {} entries from {} :".format(len(keys), cache.remote), end=" ")
+        found = cache.fetch(keys)
+        print("{} fetched".format(len(found)))
+
+    def _is_cached(self, builderDef):
+        if option("make_dist") and builderDef[1] == option("target"):
+            return False
+        key = get_target_step(builderDef).cache_key
+        return key is not None and key in neutralEnv("artifact_cache")
+
     def prepare_sources(self):
         if option("skip_source_prepare"):
             print(colorize("SKIP"))
@@ -124,31 +159,95 @@ class Builder:
         sourceDefs = remove_duplicates(
             tDef for tDef in target_steps() if tDef[0] == "source"
         )
-        for sourceDef in sourceDefs:
-            print("prepare sources {} :".format(sourceDef[1]))
-            source = get_target_step(sourceDef)
-            source.prepare()
+        if neutralEnv("artifact_cache") is not None:
+            # No need to prepare the sources of steps restored from the cache.
+            builderDefs = [tDef for tDef in target_steps() if tDef[0] != "source"]
+            cachedNames = set(tDef[1] for tDef in builderDefs) - set(
+                tDef[1] for tDef in builderDefs if not self._is_cached(tDef)
+            )
+            sourceDefs = [sDef for sDef in sourceDefs if sDef[1] not in cachedNames]
+        # Sources are independent, so each one can be downloaded, extracted
+        # and patched without waiting for the others.
+        run_steps(
+            sourceDefs, {}, self.prepare_source, option("jobs_sources"), ordered=True
+        )
+
+    def prepare_source(self, sourceDef):
+        print("prepare sources {} :".format(sourceDef[1]))
+        source = get_target_step(sourceDef)
+        source.prepare()
+
+    def get_step_dependencies(self, stepDefs):
+        """Return, for each builder step, the builder steps it depends on."""
+        stepDefs = set(stepDefs)
+        dependencies = {}
+        for stepDef in stepDefs:
+            stepConfigName, stepName = stepDef
+            stepConfig = ConfigInfo.get_config(stepConfigName)
+            deps = []
+            if stepName not in stepConfig.toolchain_names:
+                # All steps of a config need its toolchains.
+                for tlcName in stepConfig.toolchain_names:
+                    tlc = Dependency.all_deps[tlcName]
+                    deps.append(("neutral" if tlc.neutral else stepConfigName, tlcName))
+            builder = get_target_step(stepDef)
+            for dep in builder.get_dependencies(stepConfig, True):
+                deps.append(stepConfig.get_fully_qualified_dep(dep))
+            dependencies[stepDef] = [d for d in deps if d in stepDefs and d != stepDef]
+        return dependencies
 
     def build(self):
-        builderDefs = (tDef for tDef in target_steps() if tDef[0] != "source")
-        for builderDef in builderDefs:
-            builder = get_target_step(builderDef)
-            if option("make_dist") and builderDef[1] == option("target"):
-                print("make dist {} ({}):".format(builder.name, builderDef[0]))
-                try:
-                    builder.make_dist()
-                    print("Distribution tarball and signature created successfully.")
-                except AttributeError:
-                    print(f"ERROR: The target {builder.name} does not implement make_dist().")
-                except Exception as e:
-                    print(f"ERROR while creating tarball or signature: {e}")
-                continue
-            print(f"build {builder.name} ({builderDef[0]}):")
-            add_target_step(builderDef, builder)
+        builderDefs = [tDef for tDef in target_steps() if tDef[0] != "source"]
+        run_steps(
+            builderDefs,
+            self.get_step_dependencies(builderDefs),
+            self.build_step,
+            option("jobs_steps"),
+        )
+
+    def build_step(self, builderDef):
+        builder = get_target_step(builderDef)
+        if option("make_dist") and builderDef[1] == option("target"):
+            print("make dist {} ({}):".format(builder.name, builderDef[0]))
             try:
-                builder.build()
+                builder.make_dist()
+                print("Distribution tarball and signature created successfully.")
+            except AttributeError:
+                print(f"ERROR: The target {builder.name} does not implement make_dist().")
             except Exception as e:
-                print(f"ERROR during build of {builder.name}: {e}")
+                print(f"ERROR while creating tarball or signature: {e}")
+            return
+        print(f"build {builder.name} ({builderDef[0]}):")
+        add_target_step(builderDef, builder)
+        try:
+            # The step holds a token for the (first) job of the commands it runs.
+            with neutralEnv("jobserver").token(), StepStats(builder) as stats:
+                builder.build()
+            builder.save_fingerprint()
+            self.compiler_cache_stats.append(stats)
+        except StopBuild:
+            self.failed_steps.append(builderDef)
+            raise
+        except Exception as e:
+            self.failed_steps.append(builderDef)
+            print(f"ERROR during build of {builder.name}: {e}")
+
+    def report(self):
+        if not option("dont_install_packages"):
+            # Drop the steps provided by packages, as `run` does.
+            self._get_packages()
+        self.finalize_target_steps()
+        trace_file = pj(neutralEnv("log_dir"), "trace.jsonl")
+        if not os.path.exists(trace_file):
+            print(colorize("ERROR") + ": No trace file {}".format(trace_file))
+            return
+        print("[REPORT]")
+        stepDefs = list(target_steps())
+        builderDefs = [tDef for tDef in stepDefs if tDef[0] != "source"]
+        dependencies = self.get_step_dependencies(builderDefs)
+        for builderDef in builderDefs:
+            dependencies[builderDef].append(("source", builderDef[1]))
+        print_report(stepDefs, dependencies, read_trace(trace_file))
 
     def _get_packages(self):
         packages_list = []
@@ -214,28 +313,37 @@ class Builder:
         else:
             print(colorize("SKIP") + ", No package to install.")
 
+    def _run(self):
+        """Run the whole build, raise StopBuild on error."""
+        print("[INSTALL PACKAGES]")
+        if option("dont_install_packages"):
+            print(colorize("SKIP"))
+        else:
+            self.install_packages()
+        self.finalize_target_steps()
+        print("[SETUP TOOLCHAINS]")
+        for config in ConfigInfo.all_running_configs.values():
+            config.finalize_setup()
+        print("[FETCH CACHE]")
+        self.fetch_cache()
+        print("[PREPARE]")
+        self.prepare_sources()
+        print("[BUILD]")
+        self.build()
+        if option("compiler_cache"):
+            print("[COMPILER CACHE]")
+            print_compiler_cache_stats(self.compiler_cache_stats)
+        # No error, clean intermediate file at end of build if needed.
+        print("[CLEAN]")
+        if option("clean_at_end"):
+            for config in ConfigInfo.all_running_configs.values():
+                config.clean_intermediate_directories()
+        else:
+            print(colorize("SKIP"))
+
     def run(self):
         try:
-            print("[INSTALL PACKAGES]")
-            if option("dont_install_packages"):
-                print(colorize("SKIP"))
-            else:
-                self.install_packages()
-            self.finalize_target_steps()
-            print("[SETUP TOOLCHAINS]")
-            for config in ConfigInfo.all_running_configs.values():
-                config.finalize_setup()
-            print("[PREPARE]")
-            self.prepare_sources()
-            print("[BUILD]")
-            self.build()
-            # No error, clean intermediate file at end of build if needed.
-            print("[CLEAN]")
-            if option("clean_at_end"):
-                for config in ConfigInfo.all_running_configs.values():
-                    config.clean_intermediate_directories()
-            else:
-                print(colorize("SKIP"))
+            self._run()
         except StopBuild as e:
             print(e)
             sys.exit("Stopping build due to errors")
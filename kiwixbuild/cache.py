@@ -0,0 +1,267 @@
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import pj
+from . import archive
+from .compiler_cache import COMPILER_CACHE_ENV_VARIABLES
+from .manifest import MANIFESTS_DIR
+
+# Number of entries downloaded at the same time from a remote store.
+FETCH_JOBS = 8
+
+# Environment variables changing the result of a build even if we don't set
+# them ourselves.
+BUILD_ENV_VARIABLES = (
+    "CC",
+    "CXX",
+    "CFLAGS",
+    "CXXFLAGS",
+    "CPPFLAGS",
+    "LDFLAGS",
+    "LIBS",
+    "AR",
+    "LD",
+    "RANLIB",
+    "STRIP",
+    "PKG_CONFIG_PATH",
+    "PKG_CONFIG_LIBDIR",
+    "QMAKE_CC",
+    "QMAKE_CXX",
+)
+
+# Environment variables we set but which doesn't change the build result.
+IGNORED_ENV_VARIABLES = ("MAKEFLAGS", *COMPILER_CACHE_ENV_VARIABLES)
+
+
+def env_items(env):
+    """The part of `env` relevant to identify a build.
+
+    This is what we set (or change) in the env and the build related
+    variables we inherit, not the whole (random) user environment."""
+    items = {}
+    for k, v in env.items():
+        if k in IGNORED_ENV_VARIABLES:
+            continue
+        v = str(v)
+        if k in BUILD_ENV_VARIABLES or os.environ.get(k) != v:
+            items[k] = v
+    return items
+
+
+def snapshot(path):
+    """Return the state of all files in `path`, indexed by relative path.
+
+    `ctime` is used as it changes even if an install preserves the mtime of
+    the file it (re)writes."""
+    files = {}
+    for root, dirs, filenames in os.walk(path):
+        if root == path and MANIFESTS_DIR in dirs:
+            # Not installed files, see `kiwixbuild.manifest`.
+            dirs.remove(MANIFESTS_DIR)
+        for name in filenames + [d for d in dirs if os.path.islink(pj(root, d))]:
+            file_path = pj(root, name)
+            st = os.lstat(file_path)
+            files[os.path.relpath(file_path, path)] = (
+                st.st_size,
+                st.st_mtime_ns,
+                st.st_ctime_ns,
+                st.st_ino,
+            )
+    return files
+
+
+def changed_files(before, after):
+    return sorted(k for k, v in after.items() if before.get(k) != v)
+
+
+def _tmp_file_for(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+class DirectoryStore:
+    """A remote store which is a (possibly network mounted) directory."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return self.path
+
+    def has(self, name):
+        return os.path.exists(pj(self.path, name))
+
+    def get(self, name, file_path):
+        """Copy the entry `name` in `file_path`. Return False if there is no
+        such entry."""
+        try:
+            src = open(pj(self.path, name), "rb")
+        except FileNotFoundError:
+            return False
+        f, tmp_path = _tmp_file_for(file_path)
+        try:
+            with src, f:
+                shutil.copyfileobj(src, f)
+            os.replace(tmp_path, file_path)
+        except:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def put(self, name, file_path):
+        dest_path = pj(self.path, name)
+        f, tmp_path = _tmp_file_for(dest_path)
+        try:
+            with open(file_path, "rb") as src, f:
+                shutil.copyfileobj(src, f)
+            os.replace(tmp_path, dest_path)
+        except:
+            os.remove(tmp_path)
+            raise
+
+
+class HTTPStore:
+    """A remote store accessed with http.
+
+    Entries are downloaded with `GET <url>/<name>` (any static http server
+    will do), checked with `HEAD <url>/<name>` and uploaded with
+    `PUT <url>/<name>`."""
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def __str__(self):
+        return self.url
+
+    def has(self, name):
+        request = urllib.request.Request("{}/{}".format(self.url, name), method="HEAD")
+        try:
+            urllib.request.urlopen(request).close()
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+        return True
+
+    def get(self, name, file_path):
+        try:
+            resource = urllib.request.urlopen("{}/{}".format(self.url, name))
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return False
+            raise
+        f, tmp_path = _tmp_file_for(file_path)
+        try:
+            with resource, f:
+                shutil.copyfileobj(resource, f, 1024 * 1024)
+            os.replace(tmp_path, file_path)
+        except:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def put(self, name, file_path):
+        with open(file_path, "rb") as f:
+            request = urllib.request.Request(
+                "{}/{}".format(self.url, name),
+                data=f,
+                method="PUT",
+                headers={"Content-Length": str(os.path.getsize(file_path))},
+            )
+            urllib.request.urlopen(request).close()
+
+
+def get_store(url):
+    """Return the store for `url`: a http(s) url or a (file://) directory."""
+    parsed = urllib.parse.urlparse(url)
+    if parsed.scheme in ("http", "https"):
+        return HTTPStore(url)
+    if parsed.scheme == "file":
+        return DirectoryStore(urllib.request.url2pathname(parsed.path))
+    return DirectoryStore(os.path.abspath(url))
+
+
+class ArtifactCache:
+    """A local cache of installed files, indexed by the build fingerprint.
+
+    Each entry is a tar archive (in `archive.INTERNAL_FORMAT`) of the files
+    installed by a builder step, relative to the install directory.
+    Missing entries can be fetched from a `remote` store, and new entries
+    pushed to it if `push` is set."""
+
+    def __init__(self, cache_dir, remote=None, push=False):
+        self.cache_dir = cache_dir
+        self.remote = remote
+        self.push = push
+        self.format = archive.INTERNAL_FORMAT
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_name(self, key):
+        return "{}/{}{}".format(key[:2], key, archive.EXTENSIONS[self.format])
+
+    def path(self, key):
+        return pj(self.cache_dir, *self.entry_name(key).split("/"))
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key))
+
+    def restore(self, key, install_dir):
+        """Extract the entry `key` in `install_dir`, return the restored files."""
+        files = []
+
+        def members(tar):
+            for member in tar:
+                if not member.isdir():
+                    files.append(member.name)
+                yield member
+
+        # Entries may come from a remote store, nothing must be written
+        # outside of install_dir.
+        with archive.open_reader(self.path(key)) as tar:
+            archive.extract_all(tar, install_dir, members(tar), filter="data")
+        return files
+
+    def store(self, key, install_dir, files):
+        path = self.path(key)
+        # Write in a temporary file to never have a partial entry in the cache.
+        f, tmp_path = _tmp_file_for(path)
+        f.close()
+        try:
+            with archive.open_writer(tmp_path, self.format) as tar:
+                for name in files:
+                    tar.add(pj(install_dir, name), arcname=name, recursive=False)
+            os.replace(tmp_path, path)
+        except:
+            os.remove(tmp_path)
+            raise
+        if self.remote is not None and self.push:
+            try:
+                self.remote.put(self.entry_name(key), path)
+            except (OSError, urllib.error.URLError) as e:
+                # The entry is still in the local cache, don't fail the build.
+                print("Cannot push {} to {}: {}".format(key, self.remote, e))
+
+    def _fetch(self, key):
+        try:
+            return self.remote.get(self.entry_name(key), self.path(key))
+        except (OSError, urllib.error.URLError) as e:
+            print("Cannot fetch {} from {}: {}".format(key, self.remote, e))
+            return False
+
+    def fetch(self, keys):
+        """Download the `keys` missing in the local cache from the remote store.
+
+        Return the keys found in the remote store. Keys not found are simply
+        missing in the cache (and the dependencies will be built)."""
+        if self.remote is None:
+            return []
+        keys = [k for k in set(keys) if k not in self]
+        with ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+            found = executor.map(self._fetch, keys)
+            return [k for k, f in zip(keys, found) if f]
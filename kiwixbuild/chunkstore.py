@@ -0,0 +1,358 @@
+"""Store file trees cut in content defined chunks, to download only what changed.
+
+A tree is stored in a store (see `kiwixbuild.cache.get_store`) as:
+- `chunks/<id[:2]>/<id>`: the content of the files, cut in chunks, zlib
+  compressed. `id` is the sha256 of the chunk.
+- `indexes/<name>.json`: the files of the tree, with their mode, size,
+  sha256 and chunks (or the target of the symlinks).
+
+Cut points only depend on the bytes around them, not on their offset in the
+file, so a change in a file only changes the chunks around the change.
+When a tree is fetched, its index is kept in the destination directory. The
+chunks of the files still matching it (and of the local files at the same
+paths) are reused and only the missing chunks are downloaded.
+"""
+
+import os
+import re
+import json
+import stat
+import zlib
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import pj
+from .cache import FETCH_JOBS
+from .archive import check_path, UnsafeArchiveError
+
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 1024 * 1024
+
+# Candidate cut points are the ends of runs of some common bytes. They are
+# searched by the regex engine, only the candidates are checked in python.
+_CANDIDATE = re.compile(rb"([\x00\x20\xffe])(?!\1)")
+# A candidate is a cut point if the crc32 of the `_WINDOW` bytes before it
+# has its `_CUT_MASK` bits set to 0.
+_WINDOW = 48
+_CUT_MASK = 0xFF
+
+# Where the indexes of the trees fetched in a directory are kept.
+LOCAL_INDEXES_DIR = ".chunk_indexes"
+
+
+class ChunkStoreError(Exception):
+    pass
+
+
+def _cut_point(data, start):
+    """Return the end offset of the chunk of `data` starting at `start`. It
+    only depends on the MAX_CHUNK_SIZE bytes after `start`."""
+    end = min(start + MAX_CHUNK_SIZE, len(data))
+    pos = start + MIN_CHUNK_SIZE
+    while pos < end:
+        match = _CANDIDATE.search(data, pos, end)
+        if match is None:
+            break
+        pos = match.end()
+        if not zlib.crc32(data[pos - _WINDOW : pos]) & _CUT_MASK:
+            return pos
+    return end
+
+
+def cut_points(data):
+    """Return the end offsets of the chunks of `data`."""
+    points = []
+    start = 0
+    while start < len(data):
+        start = _cut_point(data, start)
+        points.append(start)
+    return points
+
+
+def chunk_name(chunk_id):
+    return "chunks/{}/{}".format(chunk_id[:2], chunk_id)
+
+
+def index_name(name):
+    return "indexes/{}.json".format(name)
+
+
+def _local_path(root, path):
+    return pj(root, *path.split("/"))
+
+
+_CHUNK_ID = re.compile(r"[0-9a-f]{64}")
+
+
+def _check_entry(dest_dir, entry):
+    """Raise ChunkStoreError if the index `entry` would write outside
+    `dest_dir` (absolute path, `..`, through a symlink, a symlink pointing
+    outside or a bad chunk id)."""
+    path = entry["path"]
+    parts = path.split("/")
+    try:
+        if path.startswith("/") or os.path.isabs(path) or ".." in parts:
+            raise UnsafeArchiveError("{} is outside of {}".format(path, dest_dir))
+        # The file itself may be a symlink already there, check its directory.
+        check_path(dest_dir, pj(*parts[:-1]) if len(parts) > 1 else ".")
+        if "link" in entry:
+            check_path(dest_dir, os.path.join(os.path.dirname(path), entry["link"]))
+    except UnsafeArchiveError as e:
+        raise ChunkStoreError("Unsafe entry in the index: {}".format(e))
+    for chunk_id, _size in entry.get("chunks", []):
+        if not _CHUNK_ID.fullmatch(chunk_id):
+            raise ChunkStoreError("Bad chunk id {} in the index".format(chunk_id))
+
+
+def _walk(root, paths):
+    """The files and symlinks of `paths` (directories are walked), as "/"
+    separated paths relative to `root`."""
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            for dirpath, dirs, filenames in os.walk(path):
+                for name in filenames + [
+                    d for d in dirs if os.path.islink(pj(dirpath, d))
+                ]:
+                    yield os.path.relpath(pj(dirpath, name), root).replace(os.sep, "/")
+        elif os.path.lexists(path):
+            yield os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def _chunk_file(file_path, chunks):
+    """Cut the file in chunks. Add the location (file, offset, size) of the
+    chunks in `chunks`, return the file sha256 and list of (id, size)."""
+    sha256 = hashlib.sha256()
+    file_chunks = []
+    # `data` holds the bytes of the file from `offset`, read by blocks.
+    offset = 0
+    data = b""
+    with open(file_path, "rb") as f:
+        while True:
+            block = f.read(MAX_CHUNK_SIZE)
+            data += block
+            start = 0
+            # Cut as `cut_points` does on the whole file.
+            while len(data) - start >= MAX_CHUNK_SIZE or (
+                not block and start < len(data)
+            ):
+                end = _cut_point(data, start)
+                chunk = data[start:end]
+                chunk_id = hashlib.sha256(chunk).hexdigest()
+                chunks[chunk_id] = (file_path, offset + start, end - start)
+                file_chunks.append([chunk_id, end - start])
+                sha256.update(chunk)
+                start = end
+            offset += start
+            data = data[start:]
+            if not block:
+                break
+    return sha256.hexdigest(), file_chunks
+
+
+def _read_chunk(location):
+    file_path, offset, size = location
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        return f.read(size)
+
+
+def _file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for data in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def pack(store, name, root, paths=None):
+    """Store the files of `paths` (default to all of `root`) as the tree
+    `name` in `store`. Paths are relative to `root` in the tree.
+
+    Only the chunks missing in the store are uploaded. Return their number."""
+    files = []
+    chunks = {}
+    for path in sorted(set(_walk(root, paths or [root]))):
+        file_path = _local_path(root, path)
+        st = os.lstat(file_path)
+        if stat.S_ISLNK(st.st_mode):
+            files.append({"path": path, "link": os.readlink(file_path)})
+            continue
+        sha256, file_chunks = _chunk_file(file_path, chunks)
+        files.append(
+            {
+                "path": path,
+                "mode": stat.S_IMODE(st.st_mode),
+                "size": st.st_size,
+                "sha256": sha256,
+                "chunks": file_chunks,
+            }
+        )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+
+        def upload(chunk_id):
+            if store.has(chunk_name(chunk_id)):
+                return False
+            chunk_path = pj(tmp_dir, chunk_id)
+            with open(chunk_path, "wb") as f:
+                f.write(zlib.compress(_read_chunk(chunks[chunk_id])))
+            store.put(chunk_name(chunk_id), chunk_path)
+            os.remove(chunk_path)
+            return True
+
+        with ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+            uploaded = sum(executor.map(upload, chunks))
+
+        # The index is uploaded last, a tree is never available without all
+        # its chunks.
+        index_path = pj(tmp_dir, "index.json")
+        with open(index_path, "w") as f:
+            json.dump({"name": name, "files": files}, f)
+        store.put(index_name(name), index_path)
+    return uploaded
+
+
+def _is_up_to_date(dest_dir, entry, digests):
+    file_path = _local_path(dest_dir, entry["path"])
+    if "link" in entry:
+        return os.path.islink(file_path) and os.readlink(file_path) == entry["link"]
+    if os.path.islink(file_path) or not os.path.isfile(file_path):
+        return False
+    if os.path.getsize(file_path) != entry["size"]:
+        return False
+    if file_path not in digests:
+        digests[file_path] = _file_sha256(file_path)
+    return digests[file_path] == entry["sha256"]
+
+
+def _local_chunks(dest_dir, files, digests):
+    """The chunks available in `dest_dir`: the ones of the files matching the
+    indexes kept in `dest_dir` and the ones of the local versions of `files`."""
+    chunks = {}
+    indexes_dir = pj(dest_dir, LOCAL_INDEXES_DIR)
+    try:
+        index_files = os.listdir(indexes_dir)
+    except FileNotFoundError:
+        index_files = []
+    indexed = set()
+    for index_file in index_files:
+        with open(pj(indexes_dir, index_file), "r") as f:
+            index = json.load(f)
+        for entry in index["files"]:
+            if "link" in entry or not _is_up_to_date(dest_dir, entry, digests):
+                continue
+            file_path = _local_path(dest_dir, entry["path"])
+            indexed.add(file_path)
+            offset = 0
+            for chunk_id, size in entry["chunks"]:
+                chunks[chunk_id] = (file_path, offset, size)
+                offset += size
+    for entry in files:
+        file_path = _local_path(dest_dir, entry["path"])
+        if "link" in entry or file_path in indexed:
+            continue
+        if os.path.isfile(file_path) and not os.path.islink(file_path):
+            _chunk_file(file_path, chunks)
+    return chunks
+
+
+def fetch(store, name, dest_dir):
+    """Update `dest_dir` with the tree `name` of `store`.
+
+    Files already up to date are not touched and only the chunks not
+    available locally are downloaded. The files of the tree previously
+    fetched which are not in it anymore are removed, other files of
+    `dest_dir` are kept. Return False if there is no tree `name` in the
+    store.
+
+    ChunkStoreError is raised, before anything is written, if an entry of
+    the index would write outside `dest_dir`."""
+    os.makedirs(dest_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(prefix=".chunks_", dir=dest_dir) as tmp_dir:
+        index_path = pj(tmp_dir, "index.json")
+        if not store.get(index_name(name), index_path):
+            return False
+        with open(index_path, "r") as f:
+            files = json.load(f)["files"]
+        local_index_path = pj(dest_dir, LOCAL_INDEXES_DIR, name + ".json")
+        try:
+            with open(local_index_path, "r") as f:
+                previous_files = json.load(f)["files"]
+        except FileNotFoundError:
+            previous_files = []
+        for entry in files + previous_files:
+            _check_entry(dest_dir, entry)
+
+        digests = {}
+        to_update = [e for e in files if not _is_up_to_date(dest_dir, e, digests)]
+        chunks = _local_chunks(dest_dir, to_update, digests)
+        missing = {
+            chunk_id
+            for entry in to_update
+            for chunk_id, _size in entry.get("chunks", [])
+            if chunk_id not in chunks
+        }
+
+        def download(chunk_id):
+            chunk_path = pj(tmp_dir, chunk_id)
+            if not store.get(chunk_name(chunk_id), chunk_path):
+                raise ChunkStoreError(
+                    "Chunk {} of {} is missing".format(chunk_id, name)
+                )
+            return chunk_id, chunk_path
+
+        with ThreadPoolExecutor(max_workers=FETCH_JOBS) as executor:
+            downloaded = dict(executor.map(download, missing))
+        print(
+            "{}: {} files to update, {} chunks downloaded".format(
+                name, len(to_update), len(downloaded)
+            )
+        )
+
+        # All the files are assembled before any is replaced, as chunks are
+        # read from the current local files.
+        assembled = []
+        for entry in to_update:
+            if "link" in entry:
+                continue
+            new_path = pj(tmp_dir, "file_{}".format(len(assembled)))
+            sha256 = hashlib.sha256()
+            with open(new_path, "wb") as f:
+                for chunk_id, _size in entry["chunks"]:
+                    if chunk_id in downloaded:
+                        with open(downloaded[chunk_id], "rb") as chunk_file:
+                            data = zlib.decompress(chunk_file.read())
+                    else:
+                        data = _read_chunk(chunks[chunk_id])
+                    sha256.update(data)
+                    f.write(data)
+            if sha256.hexdigest() != entry["sha256"]:
+                raise ChunkStoreError("Corrupted file {}".format(entry["path"]))
+            os.chmod(new_path, entry["mode"])
+            assembled.append((new_path, entry))
+
+        for new_path, entry in assembled:
+            file_path = _local_path(dest_dir, entry["path"])
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if os.path.islink(file_path):
+                os.remove(file_path)
+            os.replace(new_path, file_path)
+        for entry in to_update:
+            if "link" in entry:
+                file_path = _local_path(dest_dir, entry["path"])
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                if os.path.lexists(file_path):
+                    os.remove(file_path)
+                os.symlink(entry["link"], file_path)
+
+        paths = {entry["path"] for entry in files}
+        for entry in previous_files:
+            file_path = _local_path(dest_dir, entry["path"])
+            if entry["path"] not in paths and os.path.lexists(file_path):
+                os.remove(file_path)
+
+        os.makedirs(pj(dest_dir, LOCAL_INDEXES_DIR), exist_ok=True)
+        os.replace(index_path, local_index_path)
+    return True
@@ -0,0 +1,131 @@
+import os
+import json
+import subprocess
+
+from ._global import neutralEnv, option
+
+SUPPORTED_COMPILER_CACHES = ("ccache", "sccache")
+
+# Variables we set for the compiler cache. They don't change what is built.
+COMPILER_CACHE_ENV_VARIABLES = (
+    "CCACHE_BASEDIR",
+    "CCACHE_NOHASHDIR",
+    "CCACHE_STATSLOG",
+    "SCCACHE_BASEDIRS",
+)
+
+
+def get_launcher():
+    """The command to prefix the compilers with, None if not using a cache."""
+    return neutralEnv("compiler_cache")
+
+
+def wrap_compiler(compiler):
+    """Return `compiler` (a command line string) run through the cache."""
+    launcher = get_launcher()
+    if not launcher or not compiler:
+        return compiler
+    if compiler.split()[0] in SUPPORTED_COMPILER_CACHES:
+        # Already wrapped
+        return compiler
+    return " ".join([*launcher, compiler])
+
+
+def set_env(env, configInfo):
+    launcher = get_launcher()
+    if not launcher or not configInfo.compiler_cache_supported:
+        return
+    for name, default in (("CC", "cc"), ("CXX", "c++")):
+        env[name] = wrap_compiler(env[name] or default)
+    # Hash paths relatively to the working dir, so the same sources built in
+    # different directories share the cache entries.
+    env["CCACHE_BASEDIR"] = option("working_dir")
+    env["CCACHE_NOHASHDIR"] = "1"
+    env["SCCACHE_BASEDIRS"] = option("working_dir")
+
+
+def statslog_path(builder):
+    return os.path.join(
+        builder.buildEnv.log_dir, "ccache_stats_{}.log".format(builder.name)
+    )
+
+
+def read_statslog(path):
+    """Count the hits and misses in a ccache stats log file."""
+    hits = misses = 0
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                if "hit" in line:
+                    hits += 1
+                elif "miss" in line:
+                    misses += 1
+    except FileNotFoundError:
+        pass
+    return hits, misses
+
+
+def sccache_stats():
+    """Return the total hits and misses of the sccache server."""
+    try:
+        output = subprocess.check_output(
+            [*get_launcher(), "--show-stats", "--stats-format=json"],
+            stderr=subprocess.DEVNULL,
+        )
+        stats = json.loads(output)["stats"]
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError):
+        return 0, 0
+    hits = sum(stats.get("cache_hits", {}).get("counts", {}).values())
+    misses = sum(stats.get("cache_misses", {}).get("counts", {}).values())
+    return hits, misses
+
+
+class StepStats:
+    """Measure the compiler cache hits and misses of a build step.
+
+    ccache writes a stats log per step. sccache has only global statistics,
+    they are read before and after the step (and so they include the
+    compilations of steps running at the same time)."""
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.hits = self.misses = 0
+
+    def __enter__(self):
+        if option("compiler_cache") == "ccache":
+            path = statslog_path(self.builder)
+            if os.path.exists(path):
+                os.remove(path)
+        elif option("compiler_cache") == "sccache":
+            self._start = sccache_stats()
+        return self
+
+    def __exit__(self, *exc_info):
+        if option("compiler_cache") == "ccache":
+            self.hits, self.misses = read_statslog(statslog_path(self.builder))
+        elif option("compiler_cache") == "sccache":
+            hits, misses = sccache_stats()
+            self.hits = hits - self._start[0]
+            self.misses = misses - self._start[1]
+
+
+def print_stats(all_stats):
+    """Print the hits and misses of each step in `all_stats`."""
+    all_stats = [s for s in all_stats if s.hits or s.misses]
+    if not all_stats:
+        print("No compilation")
+        return
+    for stats in all_stats:
+        total = stats.hits + stats.misses
+        print(
+            "  {} ({}) : {} hits, {} misses ({:.0%})".format(
+                stats.builder.name,
+                stats.builder.buildEnv.configInfo.name,
+                stats.hits,
+                stats.misses,
+                stats.hits / total,
+            )
+        )
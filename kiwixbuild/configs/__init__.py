@@ -1,3 +1,3 @@
 from .base import *
 
-from . import android, armhf, musl, flatpak, i586, ios, native, neutral, wasm
+# The configs modules are imported on demand, see `kiwixbuild.registry`.
@@ -4,6 +4,8 @@ import subprocess
 from kiwixbuild.dependencies import Dependency
 from kiwixbuild.utils import pj, remove_duplicates, DefaultEnv
 from kiwixbuild.buildenv import BuildEnv
+from kiwixbuild.compiler_cache import get_launcher
+from kiwixbuild.registry import LazyRegistry, CONFIGS_INDEX
 from kiwixbuild._global import neutralEnv, option, target_steps
 
 _SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -20,12 +22,14 @@ class _MetaConfig(type):
 
 
 class ConfigInfo(metaclass=_MetaConfig):
-    all_configs = {}
+    all_configs = LazyRegistry("kiwixbuild.configs", CONFIGS_INDEX)
     all_running_configs = {}
     toolchain_names = []
     configure_options = []
     mixed = False
     libdir = None
+    # Can the compilers be run through a compiler cache (ccache, ...) ?
+    compiler_cache_supported = True
 
     @property
     def arch_name(self):
@@ -104,7 +108,16 @@ class ConfigInfo(metaclass=_MetaConfig):
         template_file = pj(TEMPLATES_DIR, name)
         with open(template_file, "r") as f:
             template = f.read()
-        content = template.format(**self.get_cross_config())
+        cross_config = self.get_cross_config()
+        launcher = get_launcher()
+        if launcher and name.startswith("meson") and self.compiler_cache_supported:
+            # Meson wants the compiler cache as the first element of the
+            # compiler command.
+            binaries = dict(cross_config["binaries"])
+            for k in ("CC", "CXX"):
+                binaries[k] = [*launcher, binaries[k]]
+            cross_config = dict(cross_config, binaries=binaries)
+        content = template.format(**cross_config)
         with open(crossfile, "w") as outfile:
             outfile.write(content)
         return crossfile
@@ -14,6 +14,8 @@ class WasmConfigInfo(ConfigInfo):
     toolchain_names = ["emsdk"]
     compatible_hosts = ["fedora", "debian"]
     exe_wrapper_def = ""
+    # emcc is not a compiler ccache knows.
+    compiler_cache_supported = False
 
     def get_cross_config(self):
         return {
@@ -1,32 +1,3 @@
 from .base import *
-from . import (
-    all_dependencies,
-    boostregex,
-    tc_android_ndk,
-    aria2,
-    tc_armhf,
-    tc_musl,
-    docoptcpp,
-    tc_emsdk,
-    tc_flatpak,
-    gumbo,
-    icu4c,
-    ios_fat_lib,
-    mustache,
-    kiwix_desktop,
-    kiwix_tools,
-    libcurl,
-    libkiwix,
-    libmagic,
-    libmicrohttpd,
-    libzim,
-    lzma,
-    qt,
-    pugixml,
-    uuid,
-    xapian,
-    zim_tools,
-    zim_testing_suite,
-    zlib,
-    zstd,
-)
+
+# The dependencies modules are imported on demand, see `kiwixbuild.registry`.
@@ -108,19 +108,20 @@ class AppleXCFramework(Dependency):
             run_command(command, self.buildEnv.build_dir, context)
 
         def build(self):
-            xcf_libs = []
-            self.command("remove_if_exists", self._remove_if_exists)
-            xcf_libs += self.command("merge_libs", self._merge_libs)
-            xcf_libs += self.command(
-                "make_macos_fat",
-                self.make_fat_with,
-                self.macos_subconfigs,
-                "macOS_fat",
-            )
-            xcf_libs += self.command(
-                "make_simulator_fat",
-                self.make_fat_with,
-                self.iossimulator_subconfigs,
-                "iOS-simulator_fat",
-            )
-            self.command("build_xcframework", self._build_xcframework, xcf_libs)
+            with self._recorded_install():
+                xcf_libs = []
+                self.command("remove_if_exists", self._remove_if_exists)
+                xcf_libs += self.command("merge_libs", self._merge_libs)
+                xcf_libs += self.command(
+                    "make_macos_fat",
+                    self.make_fat_with,
+                    self.macos_subconfigs,
+                    "macOS_fat",
+                )
+                xcf_libs += self.command(
+                    "make_simulator_fat",
+                    self.make_fat_with,
+                    self.iossimulator_subconfigs,
+                    "iOS-simulator_fat",
+                )
+                self.command("build_xcframework", self._build_xcframework, xcf_libs)
@@ -3,6 +3,8 @@ import os
 import shutil
 import time
 import platform
+import hashlib
+from contextlib import contextmanager
 
 from kiwixbuild.utils import (
     pj,
@@ -14,9 +16,23 @@ from kiwixbuild.utils import (
     run_command,
     colorize,
     copy_tree,
+    fingerprint,
 )
+from kiwixbuild.cache import env_items, snapshot, changed_files
+from kiwixbuild.manifest import (
+    write_manifest,
+    read_manifest,
+    manifest_files,
+    owned_files,
+    merge_stage,
+    remove_files,
+)
+from kiwixbuild.trace import record_command
+from kiwixbuild.state import step_name
+from kiwixbuild.compiler_cache import get_launcher, statslog_path
 from kiwixbuild.versions import main_project_versions, base_deps_versions
-from kiwixbuild._global import neutralEnv, option, get_target_step
+from kiwixbuild.registry import LazyRegistry, DEPENDENCIES_INDEX
+from kiwixbuild._global import neutralEnv, option, get_target_step, target_steps
 
 SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
@@ -31,7 +47,7 @@ class _MetaDependency(type):
 
 
 class Dependency(metaclass=_MetaDependency):
-    all_deps = {}
+    all_deps = LazyRegistry("kiwixbuild.dependencies", DEPENDENCIES_INDEX)
     force_build = False
     force_native_build = False
     dont_skip = False
@@ -79,6 +95,18 @@ class Source:
     def _log_dir(self):
         return neutralEnv("log_dir")
 
+    @property
+    def fingerprint(self):
+        """A hash identifying the prepared sources, None if we cannot know it."""
+        return None
+
+    def _patches_sha256(self):
+        patches = []
+        for p in getattr(self, "patches", []):
+            with open(pj(SCRIPT_DIR, "patches", p), "rb") as f:
+                patches.append((p, hashlib.sha256(f.read()).hexdigest()))
+        return patches
+
     def _patch(self, context):
         context.try_skip(self.source_path)
         for p in self.patches:
@@ -90,16 +118,21 @@ class Source:
         print("  {} {} : ".format(name, self.name), end="", flush=True)
         log = pj(self._log_dir, "cmd_{}_{}.log".format(name, self.name))
         context = Context(name, log, True)
+        status = "error"
+        start_time = time.time()
+        thread_start_time = time.thread_time()
         try:
-            start_time = time.time()
             ret = function(*args, context=context)
             context._finalise()
             duration = time.time() - start_time
+            status = "ok"
             print(colorize("OK"), "({:.1f}s)".format(duration))
             return ret
         except WarningMessage as e:
+            status = "warning"
             print(e)
         except SkipCommand as e:
+            status = "skip"
             print(e)
         except subprocess.CalledProcessError:
             print(colorize("ERROR"))
@@ -112,12 +145,28 @@ class Source:
         except:
             print(colorize("ERROR"))
             raise
+        finally:
+            if status == "error":
+                context._record_failure()
+            record_command(
+                "source",
+                self.name,
+                name,
+                context,
+                start_time,
+                thread_start_time,
+                status,
+            )
 
 
 class NoopSource(Source):
     def prepare(self):
         pass
 
+    @property
+    def fingerprint(self):
+        return fingerprint("noop", self.name)
+
 
 class ReleaseDownload(Source):
     archive_top_dir = None
@@ -130,6 +179,19 @@ class ReleaseDownload(Source):
     def extract_path(self):
         return pj(neutralEnv("source_dir"), self.source_dir)
 
+    @property
+    def fingerprint(self):
+        archives = [(a.name, a.sha256) for a in self.archives]
+        if not all(sha256 for _, sha256 in archives):
+            # We cannot identify an archive without its sha256
+            return None
+        return fingerprint(
+            self.full_name,
+            archives,
+            self.archive_top_dir,
+            self._patches_sha256(),
+        )
+
     def _download(self, context):
         context.try_skip(neutralEnv("archive_dir"), self.full_name)
         archive_iter = iter(self.archives)
@@ -148,6 +210,7 @@ class ReleaseDownload(Source):
         context.try_skip(self.extract_path)
         if os.path.exists(self.extract_path):
             shutil.rmtree(self.extract_path)
+            neutralEnv("state").forget(self.extract_path)
         for archive in self.archives:
             extract_archive(
                 pj(neutralEnv("archive_dir"), archive.name),
@@ -235,16 +298,70 @@ class GitClone(Source):
             self.command("gitupdate", self._git_update)
         if hasattr(self, "_post_prepare_script"):
             self.command("post_prepare_script", self._post_prepare_script)
+        self._prepared = True
+
+    def _git_output(self, *args):
+        return subprocess.check_output(
+            [*neutralEnv("git_command"), *args],
+            cwd=self.git_path,
+            stderr=subprocess.DEVNULL,
+        )
+
+    @property
+    def fingerprint(self):
+        """The HEAD commit and the content of the modified and untracked files.
+
+        None until the clone has been prepared (HEAD may still move)."""
+        prepared = getattr(self, "_prepared", False) or option("skip_source_prepare")
+        if not prepared or not os.path.isdir(self.git_path):
+            return None
+        try:
+            head = self._git_output("rev-parse", "HEAD").decode().strip()
+            status = self._git_output(
+                "status", "--porcelain", "-z", "--no-renames", "--untracked-files=all"
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        changes = []
+        for entry in status.split(b"\0"):
+            if not entry:
+                continue
+            path = entry[3:].decode(errors="surrogateescape")
+            file_path = pj(self.git_path, path)
+            if os.path.isfile(file_path):
+                with open(file_path, "rb") as f:
+                    content = hashlib.sha256(f.read()).hexdigest()
+            else:
+                content = None
+            changes.append((entry[:2].decode(), path, content))
+        return fingerprint(self.full_name, head, sorted(changes))
 
 
 class Builder:
     subsource_dir = None
     dependencies = []
+    # Does `_install` honor DESTDIR (and so can install in a staging dir) ?
+    staged_install = False
+    # Builder attributes describing how the dependency is built.
+    fingerprint_attributes = (
+        "configure_options",
+        "all_configure_options",
+        "configure_env",
+        "configure_script",
+        "make_targets",
+        "make_install_targets",
+        "qmake_targets",
+        "build_type",
+        "strip_options",
+        "library_type",
+        "test_options",
+    )
 
     def __init__(self, target, source, buildEnv):
         self.target = target
         self.source = source
         self.buildEnv = buildEnv
+        self._destdir = None
 
     @classmethod
     def get_dependencies(cls, configInfo, allDeps):
@@ -269,22 +386,147 @@ class Builder:
     def _log_dir(self):
         return self.buildEnv.log_dir
 
+    @property
+    def cacheable(self):
+        return True
+
+    @property
+    def cache_key(self):
+        """The key of the step in the artifact cache, None if not cached."""
+        if neutralEnv("artifact_cache") is None or not self.cacheable:
+            return None
+        return self.fingerprint
+
+    def _used_by_cross_build(self):
+        """Is our build tree (not only the installed files) used by cross build
+        of the same dependency (`--with-cross-build`, native tools, ...) ?"""
+        if self.buildEnv.configInfo.build != "native":
+            return False
+        for stepDef in target_steps():
+            stepConfig, stepName = stepDef
+            if stepName != self.name or stepConfig == "source":
+                continue
+            step = get_target_step(stepDef)
+            if isinstance(step, Builder) and step.buildEnv.configInfo.build != "native":
+                return True
+        return False
+
+    def _get_fingerprint_attributes(self):
+        attributes = {}
+        for name in self.fingerprint_attributes:
+            value = getattr(self, name, None)
+            if value is not None and not isinstance(value, (str, list, tuple, dict)):
+                value = list(value)
+            attributes[name] = value
+        return attributes
+
+    @property
+    def fingerprint(self):
+        """A hash of everything used to build the dependency.
+
+        This is the source fingerprint, the options, the env, the cross files
+        and the fingerprints of the dependencies.
+        None if we cannot compute it (a source or a dependency without
+        fingerprint)."""
+        try:
+            return self._fingerprint
+        except AttributeError:
+            pass
+        # Not memoized until it can be computed: the sources may not be
+        # prepared yet.
+        source_fingerprint = self.source.fingerprint
+        if source_fingerprint is None:
+            return None
+        configInfo = self.buildEnv.configInfo
+        deps_fingerprints = []
+        for dep in self.get_dependencies(configInfo, True):
+            depDef = configInfo.get_fully_qualified_dep(dep)
+            if depDef == (configInfo.name, self.name):
+                continue
+            try:
+                dep_builder = get_target_step(depDef)
+            except KeyError:
+                # Installed by a package
+                deps_fingerprints.append(("package", depDef))
+                continue
+            dep_fingerprint = dep_builder.fingerprint
+            if dep_fingerprint is None:
+                return None
+            deps_fingerprints.append((depDef, dep_fingerprint))
+        cross_files = []
+        for cross_file in (
+            self.buildEnv.meson_crossfile,
+            self.buildEnv.cmake_crossfile,
+        ):
+            if cross_file:
+                with open(cross_file, "r") as f:
+                    cross_files.append(f.read())
+        env = self.get_env(cross_comp_flags=True, cross_compilers=True, cross_path=True)
+        self._fingerprint = fingerprint(
+            self.target.full_name(),
+            "{}.{}".format(type(self).__module__, type(self).__qualname__),
+            configInfo.name,
+            self.buildEnv.install_dir,
+            source_fingerprint,
+            self._get_fingerprint_attributes(),
+            env_items(env),
+            cross_files,
+            deps_fingerprints,
+        )
+        return self._fingerprint
+
+    @property
+    def force_build(self):
+        """Should we rerun all the commands of a `force_build` target ?
+
+        Only if something changed (in the sources or in the dependencies)
+        since the last successful build, or if we cannot know it."""
+        try:
+            return self._force_build
+        except AttributeError:
+            pass
+        self._force_build = False
+        if self.target.force_build:
+            current = self.fingerprint
+            previous = neutralEnv("state").fingerprint(self.build_path, "build")
+            self._force_build = current is None or current != previous
+        return self._force_build
+
+    def save_fingerprint(self):
+        """Record the fingerprint of a successful build."""
+        if not self.target.force_build:
+            return
+        current = self.fingerprint
+        if current is None:
+            return
+        neutralEnv("state").record(
+            self.build_path, "build", "done", fingerprint=current
+        )
+
     def command(self, name, function, *args):
         print("  {} {} : ".format(name, self.name), end="", flush=True)
         log = pj(self._log_dir, "cmd_{}_{}.log".format(name, self.name))
         context = Context(name, log, self.target.force_native_build)
-        if self.target.force_build:
+        if self.force_build:
             context.no_skip = True
+        status = "error"
+        start_time = time.time()
+        thread_start_time = time.thread_time()
         try:
-            start_time = time.time()
             ret = function(*args, context=context)
+            if self.cache_key or self.target.force_build:
+                # Already computed, only recorded with the step.
+                context.fingerprint = self.fingerprint
             context._finalise()
             duration = time.time() - start_time
+            status = "ok"
             print(colorize("OK"), "({:.1f}s)".format(duration))
             return ret
         except SkipCommand as e:
+            status = "skip"
             print(e)
         except WarningMessage as e:
+            status = "warning"
             print(e)
         except subprocess.CalledProcessError:
             print(colorize("ERROR"))
@@ -297,8 +539,24 @@ class Builder:
         except:
             print(colorize("ERROR"))
             raise
+        finally:
+            if status == "error":
+                context._record_failure()
+            record_command(
+                self.buildEnv.configInfo.name,
+                self.name,
+                name,
+                context,
+                start_time,
+                thread_start_time,
+                status,
+            )
 
     def build(self):
+        cache_key = self.cache_key
+        if cache_key and cache_key in neutralEnv("artifact_cache"):
+            self.command("restore_cache", self._restore_cache, cache_key)
+            return
         if hasattr(self, "_pre_build_script"):
             self.command("pre_build_script", self._pre_build_script)
         self.command("configure", self._configure)
@@ -307,9 +565,95 @@ class Builder:
         self.command("compile", self._compile)
         if hasattr(self, "_test"):
             self.command("test", self._test)
-        self.command("install", self._install)
+        if self.staged_install and platform.system() != "Windows":
+            installed_files = self.command("install", self._staged_install)
+        else:
+            with self._recorded_install() as installed_files:
+                self.command("install", self._install)
         if hasattr(self, "_post_build_script"):
             self.command("post_build_script", self._post_build_script)
+        # Nothing installed means that install has been skipped. We don't know
+        # what was installed before, so we cannot cache it.
+        if cache_key and installed_files:
+            self.command("store_cache", self._store_cache, cache_key, installed_files)
+
+    @property
+    def _stage_dir(self):
+        return pj(self.build_path, "_stage")
+
+    def _write_manifest(self, files):
+        write_manifest(
+            self.buildEnv.install_dir, self.name, self.target.full_name(), files
+        )
+        neutralEnv("state").record_artifacts(
+            self.buildEnv.install_dir, self.name, self.target.full_name(), files
+        )
+
+    @contextmanager
+    def _recorded_install(self):
+        """Record the files installed in the install dir by the commands run
+        in the block (which install in place, not in a staging dir).
+
+        Yield the list of installed files, filled at the end of the block."""
+        # We detect what we install by comparing the install dir before and
+        # after. No other step may install at the same time.
+        installed_files = []
+        with self.buildEnv.install_lock:
+            before = snapshot(self.buildEnv.install_dir)
+            yield installed_files
+            installed_files.extend(
+                changed_files(before, snapshot(self.buildEnv.install_dir))
+            )
+            if installed_files:
+                self._write_manifest(installed_files)
+
+    def _staged_install(self, context):
+        """Install in a private staging dir (DESTDIR), then merge the staged
+        files in the install dir.
+
+        Files of the previous install not installed anymore (and not owned by
+        another dependency) are removed. Return the installed files."""
+        if os.path.exists(self._stage_dir):
+            shutil.rmtree(self._stage_dir)
+        self._destdir = self._stage_dir
+        try:
+            self._install(context)
+        finally:
+            self._destdir = None
+        install_dir = self.buildEnv.install_dir
+        with self.buildEnv.install_lock:
+            previous = read_manifest(install_dir, self.name)
+            installed_files = merge_stage(self._stage_dir, install_dir)
+            if previous is not None:
+                stale_files = (
+                    set(manifest_files(previous))
+                    - set(installed_files)
+                    - owned_files(install_dir, exclude=self.name)
+                )
+                remove_files(install_dir, stale_files)
+            self._write_manifest(installed_files)
+        if os.path.exists(self._stage_dir):
+            # Not created if nothing has been installed.
+            shutil.rmtree(self._stage_dir)
+        return installed_files
+
+    def _restore_cache(self, cache_key, context):
+        context.try_skip(self.build_path, cache_key)
+        with self.buildEnv.install_lock:
+            files = neutralEnv("artifact_cache").restore(
+                cache_key, self.buildEnv.install_dir
+            )
+            self._write_manifest(files)
+
+    def _store_cache(self, cache_key, installed_files, context):
+        neutralEnv("artifact_cache").store(
+            cache_key, self.buildEnv.install_dir, installed_files
+        )
+        # What is installed is what is in the cache. Don't restore it next time.
+        context.autoskip_step = (
+            self.build_path,
+            step_name("restore_cache", cache_key),
+        )
 
     def make_dist(self):
         if hasattr(self, "_pre_build_script"):
@@ -327,12 +671,19 @@ class Builder:
         if getattr(self, "configure_options", ""):
             module["config-opts"] = list(self.configure_options)
 
-    def get_env(self, *, cross_comp_flags, cross_compilers, cross_path):
+    def get_env(
+        self, *, cross_comp_flags, cross_compilers, cross_path, compiler_cache=True
+    ):
         env = self.buildEnv.get_env(
             cross_comp_flags=cross_comp_flags,
             cross_compilers=cross_compilers,
             cross_path=cross_path,
+            compiler_cache=compiler_cache,
         )
+        if option("compiler_cache") == "ccache":
+            env["CCACHE_STATSLOG"] = statslog_path(self)
+        if self._destdir:
+            env["DESTDIR"] = self._destdir
         for dep in self.get_dependencies(self.buildEnv.configInfo, False):
             try:
                 builder = get_target_step(dep, self.buildEnv.configInfo.name)
@@ -377,10 +728,10 @@ class TcCopyBuilder(Builder):
 
 
 class MakeBuilder(Builder):
+    staged_install = True
     configure_options = []
     dynamic_configure_options = ["--enable-shared", "--disable-static"]
     static_configure_options = ["--enable-static", "--disable-shared"]
-    make_options = ["-j4"]
     install_options = []
     configure_script = "configure"
     configure_env = {
@@ -390,6 +741,14 @@ class MakeBuilder(Builder):
     make_targets = []
     flatpak_buildsystem = None
 
+    @property
+    def make_options(self):
+        if neutralEnv("jobserver").makeflags:
+            # Make takes its jobs from our jobserver (see `MAKEFLAGS`).
+            # An explicit `-j` would make it create its own jobserver.
+            return []
+        return [f"-j{option('jobs')}"]
+
     @property
     def make_install_targets(self):
         if self.buildEnv.configInfo.build in ("iOS", "wasm"):
@@ -397,6 +756,12 @@ class MakeBuilder(Builder):
         else:
             yield "install-strip"
 
+    @property
+    def destdir_options(self):
+        # On the command line to override a `DESTDIR =` in the Makefile.
+        if self._destdir:
+            yield f"DESTDIR={self._destdir}"
+
     @property
     def all_configure_options(self):
         yield from self.configure_options
@@ -449,6 +814,7 @@ class MakeBuilder(Builder):
             *neutralEnv("make_command"),
             *self.make_install_targets,
             *self.make_options,
+            *self.destdir_options,
         ]
         env = self.get_env(cross_comp_flags=True, cross_compilers=True, cross_path=True)
         run_command(command, self.build_path, context, env=env)
@@ -476,13 +842,27 @@ class CMakeBuilder(MakeBuilder):
             f"-DCMAKE_INSTALL_LIBDIR={self.buildEnv.libprefix}",
             self.source_path,
             *cross_options,
+            *self.compiler_cache_options,
         ]
+        # CMake takes the whole `CC` as the compiler, we give it the compiler
+        # cache as launcher.
         env = self.get_env(
-            cross_comp_flags=True, cross_compilers=False, cross_path=True
+            cross_comp_flags=True,
+            cross_compilers=False,
+            cross_path=True,
+            compiler_cache=False,
         )
         self.set_configure_env(env)
         run_command(command, self.build_path, context, env=env)
 
+    @property
+    def compiler_cache_options(self):
+        launcher = get_launcher()
+        if launcher and self.buildEnv.configInfo.compiler_cache_supported:
+            launcher = ";".join(launcher)
+            yield f"-DCMAKE_C_COMPILER_LAUNCHER={launcher}"
+            yield f"-DCMAKE_CXX_COMPILER_LAUNCHER={launcher}"
+
     def set_flatpak_buildsystem(self, module):
         super().set_flatpak_buildsystem(module)
         module["buildir"] = True
@@ -492,6 +872,12 @@ class QMakeBuilder(MakeBuilder):
     qmake_targets = []
     flatpak_buildsystem = "qmake"
 
+    @property
+    def destdir_options(self):
+        # qmake Makefiles use INSTALL_ROOT instead of DESTDIR.
+        if self._destdir:
+            yield f"INSTALL_ROOT={self._destdir}"
+
     @property
     def make_options(self):
         if platform.system() == "Windows":
@@ -505,6 +891,16 @@ class QMakeBuilder(MakeBuilder):
         if "QMAKE_CXX" in os.environ:
             yield f"QMAKE_CXX={os.environ['QMAKE_CXX']}"
 
+    @property
+    def compiler_cache_options(self):
+        launcher = get_launcher()
+        if launcher and self.buildEnv.configInfo.compiler_cache_supported:
+            # Prefix the compilers set by the qmake spec (after it is read).
+            launcher = " ".join(launcher)
+            yield "-after"
+            yield f"QMAKE_CC={launcher} $$QMAKE_CC"
+            yield f"QMAKE_CXX={launcher} $$QMAKE_CXX"
+
     def _configure(self, context):
         context.try_skip(self.build_path)
         command = [
@@ -512,6 +908,7 @@ class QMakeBuilder(MakeBuilder):
             *self.configure_options,
             *self.env_options,
             self.source_path,
+            *self.compiler_cache_options,
         ]
         env = self.get_env(
             cross_comp_flags=True, cross_compilers=False, cross_path=True
@@ -532,6 +929,8 @@ class QMakeBuilder(MakeBuilder):
 
 
 class MesonBuilder(Builder):
+    # `meson install` uses DESTDIR from the env.
+    staged_install = True
     configure_options = []
     test_options = []
     flatpak_buildsystem = "meson"
@@ -552,11 +951,15 @@ class MesonBuilder(Builder):
     def library_type(self):
         return "static" if self.buildEnv.configInfo.static else "shared"
 
+    def _configure_fingerprint(self, command, env):
+        cross_file = None
+        if self.buildEnv.meson_crossfile:
+            with open(self.buildEnv.meson_crossfile, "r") as f:
+                cross_file = f.read()
+        return fingerprint(command, cross_file, env_items(env))
+
     def _configure(self, context):
         context.try_skip(self.build_path)
-        if os.path.exists(self.build_path):
-            shutil.rmtree(self.build_path)
-        os.makedirs(self.build_path)
         cross_options = []
         if not self.target.force_native_build and self.buildEnv.meson_crossfile:
             cross_options += ["--cross-file", self.buildEnv.meson_crossfile]
@@ -576,15 +979,53 @@ class MesonBuilder(Builder):
         env = self.get_env(
             cross_comp_flags=False, cross_compilers=False, cross_path=True
         )
-        run_command(command, self.source_path, context, env=env)
+        configure_fingerprint = self._configure_fingerprint(command, env)
+        fingerprint_file = pj(self.build_path, ".configure_fingerprint")
+        try:
+            with open(fingerprint_file, "r") as f:
+                previous = f.read().strip()
+        except OSError:
+            previous = None
+        reconfigured = False
+        if previous == configure_fingerprint and os.path.exists(
+            pj(self.build_path, "meson-private", "coredata.dat")
+        ):
+            # Same configuration, keep the build state for an incremental build.
+            try:
+                run_command(
+                    [*command, "--reconfigure"], self.source_path, context, env=env
+                )
+                reconfigured = True
+            except subprocess.CalledProcessError:
+                # Build dir from another meson version, ...
+                pass
+        if not reconfigured:
+            if os.path.exists(self.build_path):
+                shutil.rmtree(self.build_path)
+                neutralEnv("state").forget(self.build_path)
+            os.makedirs(self.build_path)
+            run_command(command, self.source_path, context, env=env)
+        with open(fingerprint_file, "w") as f:
+            f.write(configure_fingerprint)
+
+    @contextmanager
+    def _jobs(self):
+        """The number of jobs a command not using the jobserver (ninja, meson
+        test) can run: the job of the step and the jobs free now.
+
+        A job is left for each other step which may run, so they can start."""
+        wanted = max(0, option("jobs") - option("jobs_steps"))
+        with neutralEnv("jobserver").free_tokens(wanted) as free:
+            yield 1 + free
 
     def _compile(self, context):
         context.try_skip(self.build_path)
-        command = [*neutralEnv("ninja_command"), "-v"]
         env = self.get_env(
             cross_comp_flags=False, cross_compilers=False, cross_path=True
         )
-        run_command(command, self.build_path, context, env=env)
+        with self._jobs() as jobs:
+            command = [*neutralEnv("ninja_command"), "-v", "-j", str(jobs)]
+            run_command(command, self.build_path, context, env=env)
 
     def _test(self, context):
         context.try_skip(self.build_path)
@@ -593,19 +1034,27 @@ class MesonBuilder(Builder):
             and not self.buildEnv.configInfo.static
         ):
             raise SkipCommand()
-        command = [*neutralEnv("mesontest_command"), "--verbose", *self.test_options]
         env = self.get_env(
             cross_comp_flags=False, cross_compilers=False, cross_path=True
         )
-        run_command(command, self.build_path, context, env=env)
+        with self._jobs() as jobs:
+            command = [
+                *neutralEnv("mesontest_command"),
+                "--verbose",
+                "--num-processes",
+                str(jobs),
+                *self.test_options,
+            ]
+            run_command(command, self.build_path, context, env=env)
 
     def _install(self, context):
         context.try_skip(self.build_path)
-        command = [*neutralEnv("ninja_command"), "-v", "install"]
         env = self.get_env(
             cross_comp_flags=False, cross_compilers=False, cross_path=True
         )
-        run_command(command, self.build_path, context, env=env)
+        with self._jobs() as jobs:
+            command = [*neutralEnv("ninja_command"), "-v", "-j", str(jobs), "install"]
+            run_command(command, self.build_path, context, env=env)
 
     def _make_dist(self, context):
         command = [*neutralEnv("ninja_command"), "-v", "dist"]
@@ -16,7 +16,8 @@ class BoostRegex(Dependency):
 
     class Builder(BaseBuilder):
         def build(self):
-            self.command("copy_headers", self._copy_headers)
+            with self._recorded_install():
+                self.command("copy_headers", self._copy_headers)
 
         def _copy_headers(self, context):
             context.try_skip(self.build_path)
@@ -24,4 +25,4 @@ class BoostRegex(Dependency):
                 pj(self.source_path, "include", "boost"),
                 pj(self.buildEnv.install_dir, "include", "boost"),
                 dirs_exist_ok=True,
-            )
\ No newline at end of file
+            )
@@ -8,7 +8,6 @@ from .base import (
 from kiwixbuild.utils import pj, SkipCommand, Remotefile, extract_archive
 from kiwixbuild._global import get_target_step, neutralEnv
 import os, shutil
-import fileinput
 import platform
 
 if platform.system() == "Windows":
@@ -25,9 +24,10 @@ if platform.system() == "Windows":
 
         class Builder(BaseBuilder):
             def build(self):
-                self.command("copy_headers", self._copy_headers)
-                self.command("copy_bins", self._copy_bin)
-                self.command("generate_pkg_config", self._generate_pkg_config)
+                with self._recorded_install():
+                    self.command("copy_headers", self._copy_headers)
+                    self.command("copy_bins", self._copy_bin)
+                    self.command("generate_pkg_config", self._generate_pkg_config)
 
             def _copy_headers(self, context):
                 context.try_skip(self.build_path)
@@ -122,6 +122,7 @@ else:
                 context.try_skip(self.extract_path)
                 if os.path.exists(self.extract_path):
                     shutil.rmtree(self.extract_path)
+                    neutralEnv("state").forget(self.extract_path)
                 extract_archive(
                     pj(neutralEnv("archive_dir"), self.archive_src.name),
                     neutralEnv("source_dir"),
@@ -153,6 +154,11 @@ else:
                 plt = "native_static" if configInfo.static else "native_dyn"
                 return [(plt, "icu4c")]
 
+            @property
+            def cacheable(self):
+                # The cross builds use our build tree (`--with-cross-build`).
+                return not self._used_by_cross_build()
+
             @property
             def configure_options(self):
                 yield "--disable-samples"
@@ -182,10 +188,13 @@ else:
                 if self.buildEnv.configInfo.build != "wasm":
                     context.skip()
                 context.try_skip(self.build_path)
-                for line in fileinput.input(
-                    pj(self.build_path, "Makefile"), inplace=True
-                ):
-                    if line == "#DATASUBDIR = data\n":
-                        print("DATASUBDIR = data")
-                    else:
-                        print(line, end="")
+                # Do not use `fileinput` inplace mode here, it redirects the
+                # (global) stdout and so the output of steps running in parallel.
+                makefile = pj(self.build_path, "Makefile")
+                with open(makefile, "r") as f:
+                    lines = f.readlines()
+                with open(makefile, "w") as f:
+                    for line in lines:
+                        if line == "#DATASUBDIR = data\n":
+                            line = "DATASUBDIR = data\n"
+                        f.write(line)
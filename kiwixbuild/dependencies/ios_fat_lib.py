@@ -46,5 +46,6 @@ class IOSFatLib(Dependency):
                 run_command(command, self.buildEnv.install_dir, context)
 
         def build(self):
-            self.command("copy_headers", self._copy_headers)
-            self.command("merge_libs", self._merge_libs)
+            with self._recorded_install():
+                self.command("copy_headers", self._copy_headers)
+                self.command("merge_libs", self._merge_libs)
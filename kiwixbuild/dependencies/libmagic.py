@@ -36,12 +36,17 @@ class LibMagic(Dependency):
                 return [("native_static", "libmagic")]
             return []
 
+        @property
+        def cacheable(self):
+            # The cross builds use our build tree.
+            return not self._used_by_cross_build()
+
         def _compile(self, context):
             configInfo = self.buildEnv.configInfo
             if configInfo.build == "native":
                 return super()._compile(context)
             context.try_skip(self.build_path)
-            command = ["make", "-j4", *self.make_targets, *self.make_options]
+            command = ["make", *self.make_targets, *self.make_options]
             env = self.buildEnv.get_env(
                 cross_comp_flags=True, cross_compilers=True, cross_path=True
             )
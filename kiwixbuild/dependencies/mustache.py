@@ -16,7 +16,8 @@ class Mustache(Dependency):
 
     class Builder(BaseBuilder):
         def build(self):
-            self.command("copy_header", self._copy_header)
+            with self._recorded_install():
+                self.command("copy_header", self._copy_header)
 
         def _copy_header(self, context):
             context.try_skip(self.build_path)
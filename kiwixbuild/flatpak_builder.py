@@ -88,6 +88,11 @@ class FlatpakBuilder:
                 ).format(self.config.name, neutralEnv("distname"))
             )
         self.targetDefs = self.config.add_targets(option("target"), self._targets)
+        self.failed_steps = []
+        # Configs created by a previous build of the same process are also
+        # set up (see `kiwixbuild.api`).
+        for config in ConfigInfo.all_running_configs.values():
+            config.setup_toolchains(self._targets)
 
     def finalize_target_steps(self):
         steps = []
@@ -166,6 +171,9 @@ class FlatpakBuilder:
                             "sha256": archive.sha256,
                             "url": archive.url,
                         }
+                        mirrors = [m for m in archive.mirrors if "://" in m]
+                        if mirrors:
+                            src["mirror-urls"] = mirrors
                         if hasattr(source, "flatpak_dest"):
                             src["dest"] = source.flatpak_dest
                         module_sources.append(src)
@@ -284,38 +292,42 @@ class FlatpakBuilder:
         for dep in to_drop:
             del self._targets[dep]
 
+    def _run(self):
+        """Run the whole build, raise StopBuild on error."""
+        # This is a small hack, we don't need the list of packages to
+        # install in a flatpak sdk, but _get_packages() will drop the
+        # dependencies we already have in the sdk.
+        self._get_packages()
+        self.finalize_target_steps()
+        print("[SETUP TOOLCHAINS]")
+        for config in ConfigInfo.all_running_configs.values():
+            config.finalize_setup()
+        for cfgName in ConfigInfo.all_running_configs:
+            cfg = ConfigInfo.all_configs[cfgName]
+            for tlcName in cfg.toolchain_names:
+                tlc = Dependency.all_deps[tlcName]
+                builderDef = (cfgName, tlcName)
+                builder = get_target_step(builderDef)
+                print("build {} ({}):".format(builder.name, cfgName))
+                add_target_step(builderDef, builder)
+                builder.build()
+        print("[GENERATE FLATPAK MANIFEST]")
+        self.configure()
+        self.copy_patches()
+        print("[BUILD FLATBACK]")
+        self.build()
+        print("[BUNDLE]")
+        self.bundle()
+        # No error, clean intermediate file at end of build if needed.
+        print("[CLEAN]")
+        if option("clean_at_end"):
+            for config in ConfigInfo.all_running_configs.values():
+                config.clean_intermediate_directories()
+        else:
+            print("SKIP")
+
     def run(self):
         try:
-            # This is a small hack, we don't need the list of packages to
-            # install in a flatpak sdk, but _get_packages() will drop the
-            # dependencies we already have in the sdk.
-            self._get_packages()
-            self.finalize_target_steps()
-            print("[SETUP TOOLCHAINS]")
-            for config in ConfigInfo.all_running_configs.values():
-                config.finalize_setup()
-            for cfgName in ConfigInfo.all_running_configs:
-                cfg = ConfigInfo.all_configs[cfgName]
-                for tlcName in cfg.toolchain_names:
-                    tlc = Dependency.all_deps[tlcName]
-                    builderDef = (cfgName, tlcName)
-                    builder = get_target_step(builderDef)
-                    print("build {} ({}):".format(builder.name, cfgName))
-                    add_target_step(builderDef, builder)
-                    builder.build()
-            print("[GENERATE FLATPAK MANIFEST]")
-            self.configure()
-            self.copy_patches()
-            print("[BUILD FLATBACK]")
-            self.build()
-            print("[BUNDLE]")
-            self.bundle()
-            # No error, clean intermediate file at end of build if needed.
-            print("[CLEAN]")
-            if option("clean_at_end"):
-                for config in ConfigInfo.all_running_configs.values():
-                    config.clean_intermediate_directories()
-            else:
-                print("SKIP")
+            self._run()
         except StopBuild:
             sys.exit("Stopping build due to errors")
@@ -0,0 +1,90 @@
+import os
+import select
+import threading
+from contextlib import contextmanager
+
+
+class JobServer:
+    """A GNU make jobserver owned by kiwix-build.
+
+    The jobserver holds `jobs` tokens shared by all the commands we run.
+    Each running build step takes one token (the "implicit" token of the
+    make it runs), make (and sub-makes) take the other ones to run more jobs
+    in parallel. This way, the total number of jobs never goes over `jobs`,
+    whatever the number of steps running at the same time.
+
+    Commands running their jobs themselves (ninja, meson test) don't know
+    the jobserver. They take the tokens free when they start (`free_tokens`)
+    and are run with as many jobs.
+
+    The jobserver protocol needs to pass file descriptors to the children.
+    On system without it (Windows), only the number of running steps is
+    limited."""
+
+    def __init__(self, jobs):
+        self.jobs = max(1, jobs)
+        if os.name == "posix":
+            self._read_fd, self._write_fd = os.pipe()
+            os.write(self._write_fd, b"+" * self.jobs)
+            self._semaphore = None
+        else:
+            self._read_fd = self._write_fd = None
+            self._semaphore = threading.Semaphore(self.jobs)
+
+    @property
+    def fds(self):
+        if self._read_fd is None:
+            return ()
+        return (self._read_fd, self._write_fd)
+
+    @property
+    def makeflags(self):
+        if self._read_fd is None:
+            return None
+        fds = "{},{}".format(self._read_fd, self._write_fd)
+        # `--jobserver-fds` is for make < 4.2
+        return "-j --jobserver-fds={0} --jobserver-auth={0}".format(fds)
+
+    @contextmanager
+    def token(self):
+        if self._semaphore is not None:
+            with self._semaphore:
+                yield
+            return
+        token = os.read(self._read_fd, 1)
+        try:
+            yield
+        finally:
+            os.write(self._write_fd, token)
+
+    def _try_take(self):
+        if self._semaphore is not None:
+            return self._semaphore.acquire(blocking=False)
+        # Another process may take the token between the select and the read,
+        # we then wait for the next one released.
+        if not select.select([self._read_fd], [], [], 0)[0]:
+            return False
+        return os.read(self._read_fd, 1)
+
+    def _release(self, token):
+        if self._semaphore is not None:
+            self._semaphore.release()
+        else:
+            os.write(self._write_fd, token)
+
+    @contextmanager
+    def free_tokens(self, wanted):
+        """Take up to `wanted` tokens, only among the ones free now.
+
+        Yield the number of tokens taken, they are released at the end."""
+        tokens = []
+        try:
+            while len(tokens) < wanted:
+                token = self._try_take()
+                if not token:
+                    break
+                tokens.append(token)
+            yield len(tokens)
+        finally:
+            for token in tokens:
+                self._release(token)
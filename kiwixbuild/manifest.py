@@ -0,0 +1,142 @@
+import os
+import json
+import hashlib
+
+from .utils import pj, colorize
+
+# Directory (in the install dir) of the manifests of the installed dependencies.
+MANIFESTS_DIR = ".manifests"
+
+
+def manifest_path(install_dir, name):
+    return pj(install_dir, MANIFESTS_DIR, "{}.json".format(name))
+
+
+def _file_entry(install_dir, path):
+    full_path = pj(install_dir, path)
+    if os.path.islink(full_path):
+        return {"path": path, "link": os.readlink(full_path)}
+    sha256 = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return {
+        "path": path,
+        "size": os.path.getsize(full_path),
+        "sha256": sha256.hexdigest(),
+    }
+
+
+def write_manifest(install_dir, name, full_name, files):
+    """Record that the dependency `name` installed `files` (relative to
+    `install_dir`)."""
+    manifest = {
+        "name": name,
+        "full_name": full_name,
+        "files": [
+            _file_entry(install_dir, path)
+            for path in sorted(files)
+            if os.path.lexists(pj(install_dir, path))
+        ],
+    }
+    path = manifest_path(install_dir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def read_manifest(install_dir, name):
+    """Return the manifest of `name`, None if it has not been recorded."""
+    try:
+        with open(manifest_path(install_dir, name), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def manifest_files(manifest):
+    return [entry["path"] for entry in manifest["files"]]
+
+
+def owned_files(install_dir, exclude=None):
+    """Return the files listed in all the manifests but the one of `exclude`."""
+    files = set()
+    try:
+        names = os.listdir(pj(install_dir, MANIFESTS_DIR))
+    except FileNotFoundError:
+        return files
+    for manifest_name in names:
+        name, ext = os.path.splitext(manifest_name)
+        if ext != ".json" or name == exclude:
+            continue
+        manifest = read_manifest(install_dir, name)
+        if manifest is not None:
+            files.update(manifest_files(manifest))
+    return files
+
+
+def staged_root(stage_dir, install_dir):
+    """Where the files of `install_dir` are put when installed with
+    `DESTDIR=stage_dir`."""
+    return pj(stage_dir, os.path.splitdrive(install_dir)[1].lstrip(os.sep))
+
+
+def merge_stage(stage_dir, install_dir):
+    """Move the files installed in `stage_dir` (as DESTDIR) into `install_dir`.
+
+    Only renames are done, each file replaces its previous version
+    atomically. Return the list of merged files, relative to `install_dir`."""
+    root = staged_root(stage_dir, install_dir)
+    files = []
+    for dirpath, dirs, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        # Symlinks to directories are moved as symlinks.
+        for name in filenames + [d for d in dirs if os.path.islink(pj(dirpath, d))]:
+            path = os.path.normpath(pj(rel_dir, name))
+            dest = pj(install_dir, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            if os.path.isdir(dest) and not os.path.islink(dest):
+                # A directory replaced by a symlink.
+                os.rmdir(dest)
+            os.replace(pj(dirpath, name), dest)
+            files.append(path)
+    outside = _staged_files(stage_dir)
+    if outside:
+        # Installed with an absolute path not under the prefix (DESTDIR
+        # ignored or hardcoded path). They are not merged.
+        names = ", ".join(outside[:5]) + (", ..." if len(outside) > 5 else "")
+        print(
+            colorize("WARNING"),
+            ": {} files installed outside of {} are ignored: {}".format(
+                len(outside), install_dir, names
+            ),
+        )
+    return files
+
+
+def _staged_files(stage_dir):
+    """Return the files left in `stage_dir`, relative to it."""
+    files = []
+    for dirpath, dirs, filenames in os.walk(stage_dir):
+        for name in filenames + [d for d in dirs if os.path.islink(pj(dirpath, d))]:
+            files.append(os.path.relpath(pj(dirpath, name), stage_dir))
+    return sorted(files)
+
+
+def remove_files(install_dir, files):
+    """Remove `files` from `install_dir` and the directories left empty."""
+    for path in files:
+        full_path = pj(install_dir, path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            continue
+        parent = os.path.dirname(full_path)
+        while parent != install_dir and parent.startswith(install_dir):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
@@ -0,0 +1,127 @@
+import importlib
+
+# The module (in kiwixbuild.dependencies) defining each dependency.
+# Dependencies are registered when their module is imported, this index lets
+# us know all the names without importing everything.
+# Checked by `scripts/import_benchmark.py`.
+DEPENDENCIES_INDEX = {
+    "alldependencies": "all_dependencies",
+    "apple_xcframework": "apple_xcframework",
+    "aria2": "aria2",
+    "boostregex": "boostregex",
+    "docoptcpp": "docoptcpp",
+    "gumbo": "gumbo",
+    "icu4c": "icu4c",
+    "_ios_fat_lib": "ios_fat_lib",
+    "kiwix-desktop": "kiwix_desktop",
+    "kiwix-tools": "kiwix_tools",
+    "libcurl": "libcurl",
+    "libkiwix": "libkiwix",
+    "libmagic": "libmagic",
+    "libmicrohttpd": "libmicrohttpd",
+    "libzim": "libzim",
+    "lzma": "lzma",
+    "mustache": "mustache",
+    "pugixml": "pugixml",
+    "qt": "qt",
+    "qtwebengine": "qt",
+    "android-ndk": "tc_android_ndk",
+    "armv6": "tc_armhf",
+    "armv8": "tc_armhf",
+    "aarch64": "tc_armhf",
+    "emsdk": "tc_emsdk",
+    "org.kde": "tc_flatpak",
+    "io.qt.qtwebengine": "tc_flatpak",
+    "aarch64_musl": "tc_musl",
+    "x86-64_musl": "tc_musl",
+    "uuid": "uuid",
+    "xapian-core": "xapian",
+    "zim-testing-suite": "zim_testing_suite",
+    "zim-tools": "zim_tools",
+    "zlib": "zlib",
+    "zstd": "zstd",
+}
+
+# The module (in kiwixbuild.configs) defining each config.
+CONFIGS_INDEX = {
+    "android": "android",
+    "android_arm": "android",
+    "android_arm64": "android",
+    "android_x86": "android",
+    "android_x86_64": "android",
+    "armv6_dyn": "armhf",
+    "armv6_static": "armhf",
+    "armv6_mixed": "armhf",
+    "armv8_dyn": "armhf",
+    "armv8_static": "armhf",
+    "armv8_mixed": "armhf",
+    "aarch64_dyn": "armhf",
+    "aarch64_static": "armhf",
+    "aarch64_mixed": "armhf",
+    "flatpak": "flatpak",
+    "i586_dyn": "i586",
+    "i586_static": "i586",
+    "iOS_arm64": "ios",
+    "iOSSimulator_x86_64": "ios",
+    "iOSSimulator_arm64": "ios",
+    "macOS_arm64_static": "ios",
+    "macOS_arm64_mixed": "ios",
+    "macOS_x86_64": "ios",
+    "iOS_multi": "ios",
+    "apple_all_static": "ios",
+    "aarch64_musl_dyn": "musl",
+    "aarch64_musl_static": "musl",
+    "aarch64_musl_mixed": "musl",
+    "x86-64_musl_dyn": "musl",
+    "x86-64_musl_static": "musl",
+    "x86-64_musl_mixed": "musl",
+    "native_dyn": "native",
+    "native_static": "native",
+    "native_mixed": "native",
+    "neutral": "neutral",
+    "wasm": "wasm",
+}
+
+
+class LazyRegistry:
+    """A name -> class mapping importing the classes on first access.
+
+    Classes register themselves (`registry[name] = cls`) when their module is
+    imported. `index` gives the module (in `package`) of each name."""
+
+    def __init__(self, package, index):
+        self._package = package
+        self._index = index
+        self._classes = {}
+
+    def __setitem__(self, name, cls):
+        self._classes[name] = cls
+
+    def __getitem__(self, name):
+        if name not in self._classes and name in self._index:
+            importlib.import_module("{}.{}".format(self._package, self._index[name]))
+        return self._classes[name]
+
+    def __contains__(self, name):
+        return name in self._index or name in self._classes
+
+    def keys(self):
+        return list(dict.fromkeys([*self._index, *self._classes]))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def load_all(self):
+        for module in dict.fromkeys(self._index.values()):
+            importlib.import_module("{}.{}".format(self._package, module))
+
+    def items(self):
+        self.load_all()
+        return self._classes.items()
+
+    def values(self):
+        self.load_all()
+        return self._classes.values()
@@ -0,0 +1,93 @@
+from collections import OrderedDict
+
+from .utils import colorize
+
+
+def step_durations(records):
+    """Return the duration of the commands of each step, indexed by step.
+
+    For each step, only the commands of the last run which did something
+    (not only skipped commands) are used."""
+    durations = {}
+    runs = {}
+    for record in records:
+        if record["status"] not in ("ok", "warning"):
+            continue
+        step = (record["config"], record["name"])
+        if runs.get(step) != record["run"]:
+            runs[step] = record["run"]
+            durations[step] = OrderedDict()
+        durations[step][record["command"]] = record["duration"]
+    return durations
+
+
+def critical_path(steps, dependencies, durations):
+    """Return the longest chain of dependent steps and its duration.
+
+    `steps` must be in a topological order."""
+    finish = {}
+    previous = {}
+    for step in steps:
+        start, prev = 0, None
+        for dep in dependencies.get(step, []):
+            if finish.get(dep, 0) > start:
+                start, prev = finish[dep], dep
+        finish[step] = start + durations.get(step, 0)
+        previous[step] = prev
+    if not finish:
+        return [], 0
+    step = max(finish, key=finish.get)
+    total = finish[step]
+    path = []
+    while step is not None:
+        path.append(step)
+        step = previous[step]
+    return path[::-1], total
+
+
+def _format_step(step, duration, commands):
+    details = ", ".join(
+        "{} {:.1f}s".format(c, d)
+        for c, d in sorted(commands.items(), key=lambda i: -i[1])[:3]
+    )
+    return "  {:>8.1f}s  {} ({}) : {}".format(duration, step[1], step[0], details)
+
+
+def print_report(steps, dependencies, records, slowest=5):
+    """Print the report of the steps `steps` using the trace `records`.
+
+    `dependencies[step]` is the list of steps `step` depends on."""
+    commands = step_durations(records)
+    durations = {s: sum(commands.get(s, {}).values()) for s in steps}
+    missing = [s for s in steps if s not in commands]
+    path, parallel_time = critical_path(steps, dependencies, durations)
+    serial_time = sum(durations.values())
+
+    print("Serial time : {:.1f}s".format(serial_time))
+    print(
+        "Ideal parallel time : {:.1f}s (x{:.2f})".format(
+            parallel_time, serial_time / parallel_time if parallel_time else 1
+        )
+    )
+    if missing:
+        print(
+            colorize("WARNING")
+            + ": No record for {} steps : {}".format(
+                len(missing), ", ".join("{1} ({0})".format(*s) for s in missing)
+            )
+        )
+
+    print("Critical path :")
+    for step in path:
+        print(_format_step(step, durations[step], commands.get(step, {})))
+
+    configs = OrderedDict()
+    for step in steps:
+        configs.setdefault(step[0], []).append(step)
+    for config, config_steps in configs.items():
+        print("Slowest steps of {} :".format(config))
+        config_steps = sorted(config_steps, key=lambda s: -durations[s])
+        for step in config_steps[:slowest]:
+            if not durations[step]:
+                break
+            print(_format_step(step, durations[step], commands.get(step, {})))
@@ -0,0 +1,133 @@
+import sys
+import threading
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ThreadedStdout:
+    """A stdout wrapper buffering what each worker thread prints.
+
+    Threads which have not started a capture write directly to the wrapped
+    stream."""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    @property
+    def capturing(self):
+        return getattr(self._local, "buffer", None) is not None
+
+    def start_capture(self):
+        self._local.buffer = StringIO()
+
+    def stop_capture(self):
+        output = self._local.buffer.getvalue()
+        self._local.buffer = None
+        return output
+
+    def write(self, text):
+        if self.capturing:
+            return self._local.buffer.write(text)
+        return self._stream.write(text)
+
+    def flush(self):
+        if not self.capturing:
+            self._stream.flush()
+
+    def write_through(self, text):
+        self._stream.write(text)
+        self._stream.flush()
+
+
+def run_steps(steps, dependencies, function, jobs, ordered=False):
+    """Call `function(step)` for all `steps`, running at most `jobs` at a time.
+
+    A step is started only once all the steps listed in `dependencies[step]`
+    are done. `steps` must be given in a valid (topological) order, it is the
+    order used to run them when `jobs` is 1.
+
+    In parallel mode, what a step prints is buffered and written at once
+    when the step ends (in `steps` order if `ordered`).
+    On the first error, no new step is started and the exception is
+    re-raised once the running steps are finished."""
+    steps = list(steps)
+    if jobs <= 1:
+        for step in steps:
+            function(step)
+        return
+
+    all_steps = set(steps)
+    dependencies = {
+        step: [d for d in dependencies.get(step, []) if d in all_steps and d != step]
+        for step in steps
+    }
+    stdout = ThreadedStdout(sys.stdout)
+
+    def run(step):
+        stdout.start_capture()
+        try:
+            function(step)
+        except BaseException as e:
+            return stdout.stop_capture(), e
+        return stdout.stop_capture(), None
+
+    pending = list(steps)
+    done = set()
+    running = {}
+    outputs = {}
+    next_to_print = 0
+    error = None
+
+    def print_outputs():
+        nonlocal next_to_print
+        if not ordered:
+            for step in list(outputs):
+                stdout.write_through(outputs.pop(step))
+            return
+        while next_to_print < len(steps) and steps[next_to_print] in outputs:
+            stdout.write_through(outputs.pop(steps[next_to_print]))
+            next_to_print += 1
+
+    sys.stdout = stdout
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                if error is None:
+                    for step in list(pending):
+                        if len(running) >= jobs:
+                            break
+                        if all(d in done for d in dependencies[step]):
+                            pending.remove(step)
+                            running[executor.submit(run, step)] = step
+                if not running:
+                    if error is None:
+                        error = RuntimeError(
+                            "Cannot schedule steps {}".format(
+                                ", ".join(str(s) for s in pending)
+                            )
+                        )
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    output, exception = future.result()
+                    outputs[step] = output
+                    if exception is None:
+                        done.add(step)
+                    elif error is None:
+                        error = exception
+                print_outputs()
+    finally:
+        sys.stdout = stdout._stream
+        # Steps not run (because of an error) leave a hole in the ordered
+        # output. Print what remains anyway.
+        for step in steps:
+            if step in outputs:
+                sys.stdout.write(outputs.pop(step))
+        sys.stdout.flush()
+    if error is not None:
+        raise error
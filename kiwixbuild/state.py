@@ -0,0 +1,315 @@
+"""The state of the build steps of a working dir, in a sqlite database.
+
+A step is a command run in a directory (`configure` in a build dir,
+`download_<name>` in the archive dir, ...). It is recorded with its status,
+the fingerprint of what it built, its timings and its log file. A step done
+is skipped by the next builds (unless they are forced).
+
+The files installed by each dependency are also recorded. They are the
+files of its manifest in the install dir (see `kiwixbuild.manifest`), the
+record is dropped once the manifest is gone (install dir removed, ...).
+
+Paths in the working dir are recorded relatively to it, so the state can be
+exported with the working dir (CI archives) and imported somewhere else.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+
+# The database, in the working dir.
+STATE_DB = "build_state.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS steps (
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    fingerprint TEXT,
+    start_time REAL,
+    end_time REAL,
+    log_file TEXT,
+    PRIMARY KEY (path, name)
+);
+CREATE TABLE IF NOT EXISTS artifacts (
+    install_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    full_name TEXT,
+    files TEXT NOT NULL,
+    PRIMARY KEY (install_dir, name)
+);
+"""
+
+_STEP_COLUMNS = (
+    "path",
+    "name",
+    "status",
+    "fingerprint",
+    "start_time",
+    "end_time",
+    "log_file",
+)
+_ARTIFACT_COLUMNS = ("install_dir", "name", "full_name", "files")
+
+
+def step_name(command, extra_name=""):
+    if extra_name:
+        return "{}_{}".format(command, extra_name)
+    return command
+
+
+def _valid_rows(rows, columns):
+    """Whether `rows` are exported rows of a table with `columns`."""
+    return isinstance(rows, list) and all(
+        isinstance(row, list) and len(row) == len(columns) and isinstance(row[0], str)
+        for row in rows
+    )
+
+
+def marker_file(path, name):
+    """The file marking the step as done, used before the state database."""
+    return os.path.join(path, ".{}_ok".format(name))
+
+
+class BuildState:
+    """The state of the steps of the working dir `root`, saved in `path`.
+
+    The database is only opened when needed. It can be used from several
+    threads and several kiwix-build may use it at the same time, each
+    change is a transaction."""
+
+    def __init__(self, path, root):
+        self.path = path
+        self.root = os.path.abspath(root)
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        if self._db is None:
+            db = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            db.row_factory = sqlite3.Row
+            db.executescript(_SCHEMA)
+            self._db = db
+        return self._db
+
+    def _execute(self, query, *params):
+        with self._lock:
+            db = self._connection()
+            with db:
+                return db.execute(query, params).fetchall()
+
+    def _key(self, path):
+        """`path` as recorded: relative to the root if it is in it."""
+        path = os.path.abspath(path)
+        try:
+            relpath = os.path.relpath(path, self.root)
+        except ValueError:
+            # Not on the same drive (Windows)
+            relpath = os.pardir
+        if relpath.split(os.sep)[0] == os.pardir:
+            relpath = path
+        return relpath.replace(os.sep, "/")
+
+    def _path(self, key):
+        return os.path.normpath(os.path.join(self.root, key))
+
+    def is_done(self, path, name):
+        rows = self._execute(
+            "SELECT status FROM steps WHERE path = ? AND name = ?",
+            self._key(path),
+            name,
+        )
+        return bool(rows) and rows[0]["status"] == "done"
+
+    def record(
+        self,
+        path,
+        name,
+        status,
+        fingerprint=None,
+        start_time=None,
+        end_time=None,
+        log_file=None,
+    ):
+        """Record the `status` ("done" or "failed") of the step `name` run
+        in `path`."""
+        end_time = end_time or time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)",
+            self._key(path),
+            name,
+            status,
+            fingerprint,
+            start_time or end_time,
+            end_time,
+            log_file and self._key(log_file),
+        )
+
+    def fingerprint(self, path, name):
+        """The fingerprint recorded with the step done, None if there is none."""
+        rows = self._execute(
+            "SELECT fingerprint FROM steps "
+            "WHERE path = ? AND name = ? AND status = 'done'",
+            self._key(path),
+            name,
+        )
+        return rows[0]["fingerprint"] if rows else None
+
+    def forget(self, path):
+        """Forget the steps run in `path` and its subdirectories (removed), and
+        the artifacts installed there."""
+        key = self._key(path)
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute(
+                    "DELETE FROM steps WHERE path = ? OR substr(path, 1, ?) = ?",
+                    (key, len(key) + 1, key + "/"),
+                )
+                db.execute(
+                    "DELETE FROM artifacts"
+                    " WHERE install_dir = ? OR substr(install_dir, 1, ?) = ?",
+                    (key, len(key) + 1, key + "/"),
+                )
+
+    def steps(self):
+        """All the recorded steps (as dicts), by path and start time."""
+        rows = self._execute("SELECT * FROM steps ORDER BY path, start_time")
+        steps = []
+        for row in rows:
+            step = dict(row)
+            step["path"] = self._path(step["path"])
+            if step["log_file"]:
+                step["log_file"] = self._path(step["log_file"])
+            steps.append(step)
+        return steps
+
+    def record_artifacts(self, install_dir, name, full_name, files):
+        """Record that the dependency `name` installed `files` (relative to
+        `install_dir`)."""
+        self._execute(
+            "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)",
+            self._key(install_dir),
+            name,
+            full_name,
+            json.dumps(sorted(files)),
+        )
+
+    def _forget_removed_artifacts(self):
+        """Forget the artifacts whose manifest has been removed."""
+        # Imported here, kiwixbuild.manifest imports (through kiwixbuild.utils)
+        # this module.
+        from kiwixbuild.manifest import manifest_path
+
+        for row in self._execute("SELECT install_dir, name FROM artifacts"):
+            path = manifest_path(self._path(row["install_dir"]), row["name"])
+            if not os.path.exists(path):
+                self._execute(
+                    "DELETE FROM artifacts WHERE install_dir = ? AND name = ?",
+                    row["install_dir"],
+                    row["name"],
+                )
+
+    def artifacts(self, install_dir=None):
+        """The recorded artifacts (as dicts) of `install_dir` (default to all)."""
+        self._forget_removed_artifacts()
+        query = "SELECT * FROM artifacts"
+        params = []
+        if install_dir is not None:
+            query += " WHERE install_dir = ?"
+            params.append(self._key(install_dir))
+        artifacts = []
+        for row in self._execute(query + " ORDER BY install_dir, name", *params):
+            artifact = dict(row)
+            artifact["install_dir"] = self._path(artifact["install_dir"])
+            artifact["files"] = json.loads(artifact["files"])
+            artifacts.append(artifact)
+        return artifacts
+
+    def export_state(self, file):
+        """Write the steps done and the artifacts in the json `file`."""
+        self._forget_removed_artifacts()
+        with self._lock:
+            db = self._connection()
+            with db:
+                steps = db.execute(
+                    "SELECT * FROM steps WHERE status = 'done' ORDER BY path, name"
+                ).fetchall()
+                artifacts = db.execute(
+                    "SELECT * FROM artifacts ORDER BY install_dir, name"
+                ).fetchall()
+        state = {
+            "steps": [[row[c] for c in _STEP_COLUMNS] for row in steps],
+            "artifacts": [[row[c] for c in _ARTIFACT_COLUMNS] for row in artifacts],
+        }
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(file)), suffix=".tmp"
+        )
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, indent=1)
+        os.replace(tmp_path, file)
+        return len(steps)
+
+    def import_state(self, file):
+        """Add the steps and artifacts of the json `file` (written by
+        `export_state`), replacing the ones already recorded.
+
+        The directories of the steps are created, as a step is not done
+        anymore once its directory is removed."""
+        with open(file, "r") as f:
+            state = json.load(f)
+        if not (
+            isinstance(state, dict)
+            and _valid_rows(state.get("steps"), _STEP_COLUMNS)
+            and _valid_rows(state.get("artifacts"), _ARTIFACT_COLUMNS)
+        ):
+            raise ValueError("{} is not an exported build state".format(file))
+        for row in state["steps"]:
+            os.makedirs(self._path(row[0]), exist_ok=True)
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    state["steps"],
+                )
+                db.executemany(
+                    "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)",
+                    state["artifacts"],
+                )
+        return len(state["steps"])
+
+
+def print_status(state):
+    """Print the recorded steps, by directory, and the installed artifacts."""
+    steps = state.steps()
+    if not steps:
+        print("No step recorded in {}".format(state.path))
+        return
+    current_path = None
+    for step in steps:
+        if step["path"] != current_path:
+            current_path = step["path"]
+            print(current_path)
+        line = "  {:<30} {:<6} {:>8.1f}s  {}".format(
+            step["name"],
+            step["status"],
+            step["end_time"] - step["start_time"],
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(step["end_time"])),
+        )
+        if step["status"] != "done" and step["log_file"]:
+            line += "  (log: {})".format(step["log_file"])
+        print(line)
+    current_dir = None
+    for artifact in state.artifacts():
+        if artifact["install_dir"] != current_dir:
+            current_dir = artifact["install_dir"]
+            print("[INSTALLED] {}".format(current_dir))
+        print(
+            "  {:<30} {} files".format(
+                artifact["full_name"] or artifact["name"], len(artifact["files"])
+            )
+        )
@@ -0,0 +1,66 @@
+import os
+import json
+import shutil
+import tempfile
+
+
+def executables_state(names):
+    """The path and identity (inode, size, mtime) of the executables `names`
+    found in PATH (None for the ones not found)."""
+    state = []
+    for name in names:
+        path = shutil.which(name)
+        if path is None:
+            state.append(None)
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            state.append(None)
+            continue
+        state.append([path, st.st_ino, st.st_size, st.st_mtime_ns])
+    return state
+
+
+class ToolCache:
+    """Results of the detection of the tools, saved in `path`.
+
+    Running a tool to detect it takes time. A result is reused if it has
+    been detected with the same environment (`key`) and the executables it
+    depends on are still the same files, which is a lot cheaper to check."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    @staticmethod
+    def make_key(*parts):
+        return json.dumps([*parts, os.environ.get("PATH", "")])
+
+    def get(self, key, executables):
+        """Return the value stored for `key`, None if there is none or if
+        one of the `executables` changed."""
+        entry = self._entries.get(key)
+        if entry is None or entry["executables"] != executables_state(executables):
+            return None
+        return entry["value"]
+
+    def set(self, key, executables, value):
+        self._entries[key] = {
+            "executables": executables_state(executables),
+            "value": value,
+        }
+        # Several kiwix-build may run at the same time, never write a
+        # partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._entries, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            # This is only a cache.
+            os.remove(tmp_path)
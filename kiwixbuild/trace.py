@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import time
+import threading
+
+from ._global import neutralEnv
+
+
+class ResourceUsage:
+    """Resources used by the processes run by a command.
+
+    `maxrss` is in bytes, `read_bytes` and `write_bytes` are computed from the
+    number of block operations (512 bytes) so they only count real disk io."""
+
+    def __init__(self):
+        self.user = 0.0
+        self.sys = 0.0
+        self.maxrss = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.measured = False
+
+    def add(self, rusage):
+        self.measured = True
+        self.user += rusage.ru_utime
+        self.sys += rusage.ru_stime
+        # ru_maxrss is in KiB, except on macOS where it is in bytes.
+        maxrss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        self.maxrss = max(self.maxrss, maxrss)
+        self.read_bytes += rusage.ru_inblock * 512
+        self.write_bytes += rusage.ru_oublock * 512
+
+    def as_dict(self):
+        if not self.measured:
+            return dict.fromkeys(
+                ("user", "sys", "maxrss", "read_bytes", "write_bytes"), None
+            )
+        return {
+            "user": round(self.user, 3),
+            "sys": round(self.sys, 3),
+            "maxrss": self.maxrss,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
+
+
+class Trace:
+    """Record of all the commands run, written as json lines in `path`.
+
+    Each line is a json object with the fields:
+    - run: Identifier of the kiwix-build invocation.
+    - config: The config name ("source" for source commands).
+    - name: The dependency name.
+    - command: The command name (download, configure, compile, ...).
+    - start: Start time (seconds since epoch).
+    - duration: Wall time in seconds.
+    - status: "ok", "skip", "warning" or "error".
+    - python_cpu: CPU time spent in kiwix-build itself (extraction, ...).
+    - user, sys, maxrss, read_bytes, write_bytes: Resources used by the
+      processes run by the command (None if not measurable on the system).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.run_id = "{}-{}".format(time.strftime("%Y%m%dT%H%M%S"), os.getpid())
+        self.records = []
+        self._lock = threading.Lock()
+
+    def record(self, **record):
+        record["run"] = self.run_id
+        line = json.dumps(record, sort_keys=True)
+        with self._lock:
+            self.records.append(record)
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+
+
+def record_command(config, name, command, context, start, thread_start, status):
+    trace = neutralEnv("trace")
+    if trace is None:
+        return
+    trace.record(
+        config=config,
+        name=name,
+        command=command,
+        start=round(start, 3),
+        duration=round(time.time() - start, 3),
+        status=status,
+        python_cpu=round(time.thread_time() - thread_start, 3),
+        **context.usage.as_dict()
+    )
+
+
+def read_trace(path):
+    """Return all the records of the trace file `path`."""
+    records = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
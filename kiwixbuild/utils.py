@@ -6,12 +6,21 @@ import shutil
 import os, stat, sys
 import urllib.request
 import urllib.error
+import urllib.parse
+import pathlib
 import ssl
 import subprocess
 import re
+import copy
+import json
+import time
 from collections import namedtuple, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from kiwixbuild._global import neutralEnv, option
+from kiwixbuild.trace import ResourceUsage
+from kiwixbuild.state import step_name, marker_file
+from kiwixbuild.archive import check_path, extract_all
 
 
 def pj(*args):
@@ -102,14 +111,42 @@ def remove_duplicates(iterable, key_function=None):
         yield elem
 
 
-def get_sha256(path):
+# Size of the buffers used to read, download and hash files.
+BATCH_SIZE = 1024 * 1024
+
+
+def _read_sha256_sidecar(path):
+    """Return the sha256 stored in the `<path>.sha256` sidecar file, if the
+    file has not changed (same size and mtime) since it was written."""
+    try:
+        with open(path + ".sha256", "r") as f:
+            sidecar = json.load(f)
+        st = os.stat(path)
+    except (OSError, ValueError):
+        return None
+    if (sidecar.get("size"), sidecar.get("mtime_ns")) != (st.st_size, st.st_mtime_ns):
+        return None
+    return sidecar.get("sha256")
+
+
+def _write_sha256_sidecar(path, sha256):
+    st = os.stat(path)
+    sidecar = {"sha256": sha256, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    try:
+        with open(path + ".sha256", "w") as f:
+            json.dump(sidecar, f)
+    except OSError:
+        # Read only archive dir, ... The sidecar only avoids hashing again.
+        pass
+
+
+def _hash_file(path):
     progress_chars = "/-\\|"
     current = 0
-    batch_size = 1024 * 8
     sha256 = hashlib.sha256()
     with open(path, "br") as f:
         while True:
-            batch = f.read(batch_size)
+            batch = f.read(BATCH_SIZE)
             if not batch:
                 break
             sha256.update(batch)
@@ -118,6 +155,20 @@ def get_sha256(path):
     return sha256.hexdigest()
 
 
+def get_sha256(path):
+    sha256 = _read_sha256_sidecar(path)
+    if sha256 is None:
+        sha256 = _hash_file(path)
+        _write_sha256_sidecar(path, sha256)
+    return sha256
+
+
+def fingerprint(*parts):
+    """A stable hash of `parts` (json serializable values)."""
+    data = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
 def colorize(text, color=None):
     if color is None:
         color = text
@@ -125,6 +176,9 @@ def colorize(text, color=None):
 
 
 def print_progress(progress):
+    # Progress rewrites the current line, this has no sense in a captured output.
+    if getattr(sys.stdout, "capturing", False):
+        return
     if option("show_progress"):
         text = "{}\033[{}D".format(progress, len(progress))
         print(text, end="")
@@ -148,50 +202,196 @@ def copy_tree(src, dst, post_copy_function=None):
                 post_copy_function(dstfile)
 
 
-def download_remote(what, where):
-    file_path = pj(where, what.name)
-    if os.path.exists(file_path):
-        if what.sha256 == get_sha256(file_path):
-            raise SkipCommand()
-        os.remove(file_path)
-
+def _urlopen(request):
     if option("no_cert_check"):
         context = ssl.create_default_context()
         context.check_hostname = False
         context.verify_mode = ssl.CERT_NONE
     else:
         context = None
-    batch_size = 1024 * 8
-    extra_args = {"context": context} if sys.version_info >= (3, 4, 3) else {}
-    progress_chars = "/-\\|"
+    return urllib.request.urlopen(request, context=context)
+
+
+def _download_url(url, part_path):
+    """Download `url` in `part_path` and return the sha256 of the content.
+
+    If `part_path` already exists (interrupted download), the download is
+    resumed from its end with a http range request (if the server allows it).
+    The content is hashed while it is written."""
+    sha256 = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_path):
+        with open(part_path, "rb") as f:
+            while True:
+                batch = f.read(BATCH_SIZE)
+                if not batch:
+                    break
+                sha256.update(batch)
+                offset += len(batch)
+    request = urllib.request.Request(url)
+    if offset:
+        request.add_header("Range", "bytes={}-".format(offset))
     try:
-        with urllib.request.urlopen(what.url, **extra_args) as resource, open(
-            file_path, "wb"
-        ) as file:
-            tsize = resource.info().get("Content-Length", None)
-            if tsize is not None:
-                tsize = int(tsize)
-            current = 0
+        resource = _urlopen(request)
+    except urllib.error.HTTPError as e:
+        if e.code != 416 or not offset:
+            raise
+        # Range not satisfiable: the part file is already complete.
+        return sha256.hexdigest()
+    with resource:
+        if offset and resource.status != 206:
+            # The server doesn't support range, restart from the beginning.
+            sha256 = hashlib.sha256()
+            offset = 0
+        tsize = resource.info().get("Content-Length", None)
+        if tsize is not None:
+            tsize = int(tsize) + offset
+        progress_chars = "/-\\|"
+        current = offset
+        spinner = 0
+        with open(part_path, "ab" if offset else "wb") as file:
             while True:
-                batch = resource.read(batch_size)
+                batch = resource.read(BATCH_SIZE)
                 if not batch:
                     break
+                sha256.update(batch)
+                file.write(batch)
                 if tsize:
-                    current += batch_size
+                    current += len(batch)
                     print_progress("{:.2%}".format(current / tsize))
                 else:
-                    print_progress(progress_chars[current])
-                    current = (current + 1) % 4
-                file.write(batch)
-    except urllib.error.URLError as e:
-        print("Cannot download url {}:\n{}".format(what.url, e.reason))
-        raise StopBuild()
+                    print_progress(progress_chars[spinner])
+                    spinner = (spinner + 1) % 4
+    return sha256.hexdigest()
+
+
+# Don't split downloads of files smaller than this in chunks.
+MIN_CHUNKED_SIZE = 32 * 1024 * 1024
+
+
+def _download_url_chunks(url, chunks_path, chunks):
+    """Download `url` in `chunks_path` with `chunks` range requests in
+    parallel and return the sha256 of the content.
+
+    Return None if the server doesn't support range requests or if the file
+    is too small to be worth it."""
+    with _urlopen(urllib.request.Request(url, method="HEAD")) as resource:
+        size = int(resource.info().get("Content-Length", 0))
+        if resource.info().get("Accept-Ranges") != "bytes":
+            return None
+    if size < MIN_CHUNKED_SIZE:
+        return None
+    chunk_size = -(-size // chunks)
+    with open(chunks_path, "wb") as f:
+        f.truncate(size)
+
+    def download_chunk(start):
+        end = min(start + chunk_size, size) - 1
+        request = urllib.request.Request(url)
+        request.add_header("Range", "bytes={}-{}".format(start, end))
+        with _urlopen(request) as resource, open(chunks_path, "r+b") as f:
+            if resource.status != 206:
+                raise urllib.error.URLError("Range request not supported")
+            f.seek(start)
+            remaining = end + 1 - start
+            while remaining:
+                batch = resource.read(min(BATCH_SIZE, remaining))
+                if not batch:
+                    raise urllib.error.URLError("Incomplete chunk")
+                f.write(batch)
+                remaining -= len(batch)
+
+    with ThreadPoolExecutor(max_workers=chunks) as executor:
+        list(executor.map(download_chunk, range(0, size, chunk_size)))
+    return _hash_file(chunks_path)
+
+
+def _chunks_path(part_path):
+    return part_path + ".chunks"
+
+
+def _download(url, part_path, chunked=True):
+    chunks = option("download_chunks") if chunked else 1
+    if chunks > 1 and urllib.parse.urlparse(url).scheme in ("http", "https"):
+        # A chunked download has holes until it is finished, it cannot be
+        # resumed as a part file.
+        chunks_path = _chunks_path(part_path)
+        try:
+            sha256 = _download_url_chunks(url, chunks_path, chunks)
+        except:
+            if os.path.exists(chunks_path):
+                os.remove(chunks_path)
+            raise
+        if sha256 is not None:
+            os.replace(chunks_path, part_path)
+            return sha256
+    return _download_url(url, part_path)
+
+
+def _to_url(location, name=None):
+    """Convert `location` (an url or a local path) to an url.
+    If `name` is given, `location` is a mirror (directory) containing `name`."""
+    if len(urllib.parse.urlparse(location).scheme) > 1:
+        # A one letter scheme is a Windows drive.
+        if name is None:
+            return location
+        return "{}/{}".format(location.rstrip("/"), urllib.parse.quote(name))
+    path = os.path.abspath(location)
+    if name is not None:
+        path = pj(path, name)
+    return pathlib.Path(path).as_uri()
+
+
+def _download_checked(url, part_path, expected_sha256, retry=True):
+    """Download `url` in `part_path`, return its sha256 or None if the
+    download failed or doesn't match `expected_sha256`.
+
+    A resumed or chunked download may not match because of the part file
+    (left by another version, ...) or of the server (range ignored or
+    mangled). It is tried once again from the beginning, in one piece."""
+    partial = os.path.exists(part_path) or option("download_chunks") > 1
+    try:
+        sha256 = _download(url, part_path, chunked=retry)
+    except OSError as e:
+        # Keep the part file, the download will be resumed (from this
+        # mirror or the next one).
+        print("Cannot download url {}:\n{}".format(url, getattr(e, "reason", e)))
+        return None
+    if expected_sha256 and expected_sha256 != sha256:
+        print("Sha 256 of {} doesn't correspond".format(url))
+        for path in (part_path, _chunks_path(part_path)):
+            if os.path.exists(path):
+                os.remove(path)
+        if partial and retry:
+            print("Download {} again from the beginning".format(url))
+            return _download_checked(url, part_path, expected_sha256, retry=False)
+        return None
+    return sha256
+
+
+def download_remote(what, where):
+    file_path = pj(where, what.name)
+    if os.path.exists(file_path):
+        if what.sha256 == get_sha256(file_path):
+            raise SkipCommand()
+        os.remove(file_path)
+
+    # Global mirrors first (they are local or near mirrors), then the
+    # archive url and its own mirrors.
+    urls = [_to_url(m, what.name) for m in option("mirror") or []]
+    urls += [_to_url(u) for u in (what.url, *what.mirrors)]
+    part_path = file_path + ".part"
+    for url in remove_duplicates(urls):
+        sha256 = _download_checked(url, part_path, what.sha256)
+        if sha256 is not None:
+            break
+    else:
+        raise StopBuild("Cannot download {}".format(what.name))
 
     if not what.sha256:
         print("Sha256 for {} not set, do no verify download".format(what.name))
-    elif what.sha256 != get_sha256(file_path):
-        os.remove(file_path)
-        raise StopBuild("Sha 256 doesn't correspond")
+    os.replace(part_path, file_path)
+    _write_sha256_sidecar(file_path, sha256)
 
 
 class BaseCommandResult(Exception):
@@ -218,11 +418,16 @@ class StopBuild(BaseCommandResult):
     pass
 
 
-class Remotefile(namedtuple("Remotefile", ("name", "sha256", "url"))):
-    def __new__(cls, name, sha256, url=None):
+class Remotefile(namedtuple("Remotefile", ("name", "sha256", "url", "mirrors"))):
+    """A file to download from `url`.
+
+    `mirrors` is a list of other urls (or local paths) of the same file,
+    tried in order if `url` fails."""
+
+    def __new__(cls, name, sha256, url=None, mirrors=()):
         if url is None:
             url = REMOTE_PREFIX + name
-        return super().__new__(cls, name, sha256, url)
+        return super().__new__(cls, name, sha256, url, tuple(mirrors))
 
 
 class Context:
@@ -230,97 +435,303 @@ class Context:
         self.command_name = command_name
         self.log_file = log_file
         self.force_native_build = force_native_build
-        self.autoskip_file = None
+        # The (path, name) of the step recorded as done in the build state.
+        self.autoskip_step = None
         self.no_skip = False
+        self.fingerprint = None
+        self.start_time = time.time()
+        self.usage = ResourceUsage()
 
     def skip(self, msg=""):
         raise SkipCommand(msg)
 
     def try_skip(self, path, extra_name=""):
-        if self.no_skip:
-            return
-        if extra_name:
-            extra_name = "_{}".format(extra_name)
-        self.autoskip_file = pj(path, ".{}{}_ok".format(self.command_name, extra_name))
-        if os.path.exists(self.autoskip_file):
+        self.autoskip_step = (path, step_name(self.command_name, extra_name))
+        # Even if we don't skip, we record the command is done to be able to
+        # skip it next time.
+        if not self.no_skip and self._is_done(*self.autoskip_step):
             raise SkipCommand()
 
+    @staticmethod
+    def _is_done(path, name):
+        state = neutralEnv("state")
+        if state.is_done(path, name):
+            if os.path.isdir(path):
+                return True
+            # Removed (by hand, ...) since the step was done.
+            state.forget(path)
+            return False
+        marker = marker_file(path, name)
+        if os.path.exists(marker):
+            # Done by a previous kiwix-build (or in an old deps archive).
+            state.record(path, name, "done")
+            os.remove(marker)
+            return True
+        return False
+
     def _finalise(self):
-        if self.autoskip_file is not None:
-            os.makedirs(os.path.dirname(self.autoskip_file), exist_ok=True)
-            with open(self.autoskip_file, "w"):
-                pass
+        if self.autoskip_step is not None:
+            path, name = self.autoskip_step
+            # The step is not done anymore once its directory is removed.
+            os.makedirs(path, exist_ok=True)
+            neutralEnv("state").record(
+                path,
+                name,
+                "done",
+                fingerprint=self.fingerprint,
+                start_time=self.start_time,
+                log_file=self.log_file,
+            )
+
+    def _record_failure(self):
+        if self.autoskip_step is not None:
+            path, name = self.autoskip_step
+            neutralEnv("state").record(
+                path,
+                name,
+                "failed",
+                start_time=self.start_time,
+                log_file=self.log_file,
+            )
+
+
+def _strip_topdir(name, topdir):
+    """Return `name` relative to `topdir`, None if `name` is not in `topdir`."""
+    prefix = topdir + "/"
+    if not name.startswith(prefix):
+        return None
+    return name[len(prefix) :]
+
+
+def _zip_topdir(members):
+    """The only top level directory of a zip archive, None if there is not
+    exactly one."""
+    topdir = None
+    for info in members:
+        if not info.filename.endswith("/"):
+            continue
+        _name = info.filename[:-1]
+        if not os.path.dirname(_name):
+            if topdir:
+                # Two topdirs in the same archive.
+                return None
+            topdir = _name
+    return topdir
+
+
+def _extract_zip(archive, dest_dir, topdir):
+    """Extract the members of `archive` in `topdir` directly in `dest_dir`
+    (all members if `topdir` is None)."""
+    for info in archive.infolist():
+        name = info.filename
+        if topdir:
+            name = _strip_topdir(name, topdir)
+            if not name:
+                continue
+        # Never write outside dest_dir (`..` or absolute names)
+        check_path(dest_dir, name)
+        target = pj(dest_dir, name)
+        if name.endswith("/"):
+            os.makedirs(target, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with archive.open(info) as src, open(target, "wb") as dst:
+            shutil.copyfileobj(src, dst, BATCH_SIZE)
+        perm = (info.external_attr >> 16) & 0x1FF
+        if perm:
+            os.chmod(target, perm)
+
+
+def _tar_members(archive, topdir):
+    """Iterate on the members of `archive` in `topdir`, renamed relatively
+    to `topdir`."""
+    for member in archive:
+        name = _strip_topdir(member.name, topdir)
+        if not name:
+            continue
+        member = copy.copy(member)
+        member.name = name
+        if member.islnk():
+            # Hard links are relative to the archive root.
+            member.linkname = _strip_topdir(member.linkname, topdir) or member.linkname
+        yield member
+
+
+def _move_tree(src, dst):
+    """Move `src` to `dst`, merging it with `dst` if it already exists.
+
+    Only renames are done, no file is copied."""
+    if not os.path.lexists(dst):
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.replace(src, dst)
+        return
+    if os.path.isdir(src) and not os.path.islink(src):
+        if os.path.isdir(dst) and not os.path.islink(dst):
+            for entry in os.listdir(src):
+                _move_tree(pj(src, entry), pj(dst, entry))
+            os.rmdir(src)
+            return
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    else:
+        os.remove(dst)
+    os.replace(src, dst)
+
+
+def _remove_tree(path):
+    # Be sure that all directories are writable to allow their suppression.
+    for root, dirs, _files in os.walk(path):
+        for d in dirs:
+            os.chmod(pj(root, d), stat.S_IWRITE | stat.S_IREAD | stat.S_IEXEC)
+    shutil.rmtree(path)
+
+
+# Decompressors (in order of preference) for each tar archive extension.
+# The multithreaded ones first.
+TAR_DECOMPRESSORS = {
+    (".tar.gz", ".tgz"): [["pigz", "-dc"], ["gzip", "-dc"]],
+    (".tar.xz", ".txz"): [["xz", "-T0", "-dc"]],
+    (".tar.zst", ".tzst"): [["zstd", "-T0", "-dc"]],
+    (".tar.bz2", ".tbz2"): [["lbzip2", "-dc"], ["pbzip2", "-dc"], ["bzip2", "-dc"]],
+}
+
+
+def _system_extract_command(archive_path):
+    """Return the commands (a pipeline) to extract `archive_path` in the
+    current directory with system tools, None if tools are missing."""
+    if archive_path.endswith(".zip"):
+        if shutil.which("unzip"):
+            return [["unzip", "-q", "-o", archive_path]]
+        if shutil.which("bsdtar"):
+            return [["bsdtar", "-xf", archive_path]]
+        return None
+    if not shutil.which("tar"):
+        return None
+    for extensions, decompressors in TAR_DECOMPRESSORS.items():
+        if archive_path.endswith(extensions):
+            for decompressor in decompressors:
+                if shutil.which(decompressor[0]):
+                    return [decompressor + [archive_path], ["tar", "-xf", "-"]]
+            return None
+    return [["tar", "-xf", archive_path]]
+
+
+def _system_extract(archive_path, dest_dir):
+    """Extract `archive_path` in `dest_dir` with system tools.
+
+    Return False if the tools are not available or fail."""
+    commands = _system_extract_command(archive_path)
+    if commands is None:
+        return False
+    processes = []
+    stdin = None
+    for command in commands:
+        last = command is commands[-1]
+        process = subprocess.Popen(
+            command,
+            cwd=dest_dir,
+            stdin=stdin,
+            stdout=subprocess.DEVNULL if last else subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        if stdin is not None:
+            # Let the previous process receive SIGPIPE if the next one ends.
+            stdin.close()
+        stdin = process.stdout
+        processes.append(process)
+    return all(process.wait() == 0 for process in processes)
 
 
 def extract_archive(archive_path, dest_dir, topdir=None, name=None):
+    """Extract the archive `archive_path` in `dest_dir/name`.
+
+    Only the content of the directory `topdir` of the archive is extracted.
+    If `topdir` is not given and the archive has only one top directory,
+    it is used as `topdir` (tar archives don't need to have an entry for
+    it, members in a single top directory are enough). `name` defaults to
+    `topdir`.
+    Members which would be written outside of `dest_dir/name` (`..`,
+    absolute names, links) are refused.
+    If `dest_dir/name` already exists, the content of the archive is merged
+    in it."""
+    os.makedirs(dest_dir, exist_ok=True)
     is_zip_archive = archive_path.endswith(".zip")
-    archive = None
+    use_system_tools = option("system_extract")
+    if is_zip_archive and not use_system_tools:
+        # The zip index is at the end of the archive, we can know the topdir
+        # without decompressing anything and extract directly at the right
+        # place.
+        with zipfile.ZipFile(archive_path) as archive:
+            topdir = topdir or _zip_topdir(archive.infolist())
+            target = pj(dest_dir, name or topdir) if (name or topdir) else dest_dir
+            if not topdir and name:
+                os.makedirs(target)
+            _extract_zip(archive, target, topdir)
+        return
+    if topdir and not use_system_tools:
+        # Stream the archive, members are written directly at their final
+        # place.
+        with tarfile.open(archive_path, "r|*") as archive:
+            extract_all(
+                archive, pj(dest_dir, name or topdir), _tar_members(archive, topdir)
+            )
+        return
+
+    # Extract in a temporary directory (on the same filesystem) and move the
+    # content at its final place. Nothing is copied.
+    tmpdir = tempfile.mkdtemp(prefix=os.path.basename(archive_path), dir=dest_dir)
     try:
-        if is_zip_archive:
-            archive = zipfile.ZipFile(archive_path)
-            members = archive.infolist()
-            getname = lambda info: info.filename
-            isdir = lambda info: info.filename.endswith("/")
-        else:
-            archive = tarfile.open(archive_path)
-            members = archive.getmembers()
-            getname = lambda info: getattr(info, "name")
-            isdir = lambda info: info.isdir()
+        if not use_system_tools or not _system_extract(archive_path, tmpdir):
+            if use_system_tools:
+                # Tools missing or failing, fallback to python
+                _remove_tree(tmpdir)
+                os.makedirs(tmpdir)
+            if is_zip_archive:
+                with zipfile.ZipFile(archive_path) as archive:
+                    _extract_zip(archive, tmpdir, None)
+            else:
+                with tarfile.open(archive_path, "r|*") as archive:
+                    extract_all(archive, tmpdir)
         if not topdir:
-            for d in (m for m in members if isdir(m)):
-                _name = getname(d)
-                if _name.endswith("/"):
-                    _name = _name[:-1]
-                if not os.path.dirname(_name):
-                    if topdir:
-                        # There is already a top dir.
-                        # Two topdirs in the same archive.
-                        # Extract all
-                        topdir = None
-                        break
-                    topdir = _name
-        if topdir:
-            members_to_extract = [
-                m for m in members if getname(m).startswith(topdir + "/")
+            topdirs = [
+                d
+                for d in os.listdir(tmpdir)
+                if os.path.isdir(pj(tmpdir, d)) and not os.path.islink(pj(tmpdir, d))
             ]
-            os.makedirs(dest_dir, exist_ok=True)
-            with tempfile.TemporaryDirectory(
-                prefix=os.path.basename(archive_path), dir=dest_dir
-            ) as tmpdir:
-                if is_zip_archive:
-                    _members_to_extract = [getname(m) for m in members_to_extract]
-                else:
-                    _members_to_extract = members_to_extract
-                archive.extractall(path=tmpdir, members=_members_to_extract)
-                if is_zip_archive:
-                    for member in members_to_extract:
-                        if isdir(member):
-                            continue
-                        perm = (member.external_attr >> 16) & 0x1FF
-                        if perm:
-                            os.chmod(pj(tmpdir, getname(member)), perm)
-                name = name or topdir
-                shutil.copytree(
-                    pj(tmpdir, topdir),
-                    pj(dest_dir, name),
-                    symlinks=True,
-                    dirs_exist_ok=True,
-                )
-                # Be sure that all directory in tmpdir are writable to allow correct suppersion of it
-                for root, dirs, _files in os.walk(tmpdir):
-                    for d in dirs:
-                        os.chmod(
-                            pj(root, d), stat.S_IWRITE | stat.S_IREAD | stat.S_IEXEC
-                        )
-
+            if len(topdirs) == 1:
+                topdir = topdirs[0]
+        if topdir:
+            if os.path.isdir(pj(tmpdir, topdir)):
+                _move_tree(pj(tmpdir, topdir), pj(dest_dir, name or topdir))
         else:
             if name:
                 dest_dir = pj(dest_dir, name)
                 os.makedirs(dest_dir)
-            archive.extractall(path=dest_dir)
+            for entry in os.listdir(tmpdir):
+                _move_tree(pj(tmpdir, entry), pj(dest_dir, entry))
     finally:
-        if archive is not None:
-            archive.close()
+        _remove_tree(tmpdir)
+
+
+def _wait_with_usage(process, context):
+    """Wait for `process` using `wait4` to get the resources used by the
+    process (and its own children)."""
+    last_progress = time.monotonic()
+    delay = 0.001
+    while True:
+        pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.1)
+        if time.monotonic() - last_progress >= 30:
+            last_progress = time.monotonic()
+            print(".", end="", flush=True)
+    context.usage.add(rusage)
+    if os.WIFSIGNALED(status):
+        process.returncode = -os.WTERMSIG(status)
+    else:
+        process.returncode = os.WEXITSTATUS(status)
 
 
 def run_command(command, cwd, context, *, env=None, input=None):
@@ -343,6 +754,9 @@ def run_command(command, cwd, context, *, env=None, input=None):
         kwargs = dict()
         if input:
             kwargs["stdin"] = subprocess.PIPE
+        jobserver = neutralEnv("jobserver")
+        if jobserver and jobserver.fds:
+            kwargs["pass_fds"] = jobserver.fds
         process = subprocess.Popen(
             command,
             cwd=cwd,
@@ -353,7 +767,9 @@ def run_command(command, cwd, context, *, env=None, input=None):
         )
         if input:
             input = input.encode()
-        while True:
+        if input is None and hasattr(os, "wait4"):
+            _wait_with_usage(process, context)
+        while process.returncode is None:
             try:
                 if input is None:
                     process.wait(timeout=30)
@@ -365,8 +781,6 @@ def run_command(command, cwd, context, *, env=None, input=None):
                 # to not communicate again).
                 input = None
                 print(".", end="", flush=True)
-            else:
-                break
         if process.returncode:
             raise subprocess.CalledProcessError(process.returncode, command)
     finally:
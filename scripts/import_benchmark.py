@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+"""Check that kiwix-build starts fast.
+
+- The registry index (`kiwixbuild/registry.py`) must match the classes
+  actually registered by the dependencies and configs modules.
+- `import kiwixbuild` must not import the dependencies and configs modules
+  (nor distro).
+- The time of `import kiwixbuild` and of `kiwix-build --get-build-dir` are
+  measured (best of `--runs`) and must be under `--max-import-ms` and
+  `--max-build-dir-ms`.
+
+Exit with a non zero code if any check fails.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+CHECK_MODULES_CODE = """
+import sys
+import kiwixbuild
+lazy = [
+    m for m in sys.modules
+    if m == "distro"
+    or (m.startswith(("kiwixbuild.dependencies.", "kiwixbuild.configs."))
+        and not m.endswith(".base"))
+]
+print(" ".join(sorted(lazy)))
+"""
+
+
+def check_index():
+    from kiwixbuild.registry import DEPENDENCIES_INDEX, CONFIGS_INDEX
+    from kiwixbuild.dependencies import Dependency
+    from kiwixbuild.configs import ConfigInfo
+
+    errors = []
+    for registry, index, package in (
+        (Dependency.all_deps, DEPENDENCIES_INDEX, "kiwixbuild.dependencies"),
+        (ConfigInfo.all_configs, CONFIGS_INDEX, "kiwixbuild.configs"),
+    ):
+        registered = dict(registry.items())
+        for name, cls in registered.items():
+            module = "{}.{}".format(package, index.get(name))
+            if cls.__module__ != module:
+                errors.append(
+                    "{} is defined in {}, index says {}".format(
+                        name, cls.__module__, module
+                    )
+                )
+        for name in index:
+            if name not in registered:
+                errors.append("{} is in the index but not registered".format(name))
+    return errors
+
+
+def best_time(command, runs, cwd=None):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+        duration = time.perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-import-ms", type=float, default=250)
+    parser.add_argument("--max-build-dir-ms", type=float, default=400)
+    options = parser.parse_args()
+
+    failed = False
+    for error in check_index():
+        print("ERROR: {}".format(error))
+        failed = True
+
+    output = subprocess.check_output(
+        [sys.executable, "-c", CHECK_MODULES_CODE], cwd=ROOT_DIR, text=True
+    ).strip()
+    if output:
+        print("ERROR: `import kiwixbuild` imports {}".format(output))
+        failed = True
+
+    import_ms = best_time(
+        [sys.executable, "-c", "import kiwixbuild"], options.runs, cwd=ROOT_DIR
+    )
+    print("import kiwixbuild : {:.0f}ms".format(import_ms))
+    if import_ms > options.max_import_ms:
+        print("ERROR: import is slower than {}ms".format(options.max_import_ms))
+        failed = True
+
+    with tempfile.TemporaryDirectory() as working_dir:
+        command = [
+            sys.executable,
+            "-m",
+            "kiwixbuild",
+            "--config",
+            "native_static",
+            "--get-build-dir",
+            "--working-dir",
+            working_dir,
+        ]
+        # The first run fills the tool detection cache.
+        subprocess.run(command, cwd=ROOT_DIR, check=True, stdout=subprocess.DEVNULL)
+        build_dir_ms = best_time(command, options.runs, cwd=ROOT_DIR)
+    print("kiwix-build --get-build-dir : {:.0f}ms".format(build_dir_ms))
+    if build_dir_ms > options.max_build_dir_ms:
+        print(
+            "ERROR: --get-build-dir is slower than {}ms".format(
+                options.max_build_dir_ms
+            )
+        )
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import os
+import threading
+import functools
+import http.server
+
+import pytest
+
+from kiwixbuild.cache import DirectoryStore, HTTPStore
+
+
+class StoreHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve a directory with GET (and range requests) and HEAD, and store
+    the PUT files in it."""
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        range_header = self.headers.get("Range")
+        if range_header is None or not os.path.isfile(path):
+            return super().do_GET()
+        with open(path, "rb") as f:
+            data = f.read()
+        start, end = range_header[len("bytes=") :].split("-")
+        start = int(start)
+        end = int(end) if end else len(data) - 1
+        if start >= len(data):
+            self.send_error(416)
+            return
+        body = data[start : end + 1]
+        self.send_response(206)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "Content-Range", "bytes {}-{}/{}".format(start, end, len(data))
+        )
+        self.end_headers()
+        self.wfile.write(body)
+
+    def end_headers(self):
+        self.send_header("Accept-Ranges", "bytes")
+        super().end_headers()
+
+    def do_PUT(self):
+        path = self.translate_path(self.path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        length = int(self.headers["Content-Length"])
+        with open(path, "wb") as f:
+            f.write(self.rfile.read(length))
+        self.send_response(201)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_dir(tmp_path):
+    """A directory served by a local http server, return (dir, url)."""
+    served_dir = tmp_path / "served"
+    served_dir.mkdir()
+    handler = functools.partial(StoreHandler, directory=str(served_dir))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served_dir, "http://127.0.0.1:{}/store".format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["directory", "http"])
+def store(request, tmp_path):
+    """An empty store, a directory or served by a local http server."""
+    if request.param == "directory":
+        return DirectoryStore(str(tmp_path / "store"))
+    return HTTPStore(request.getfixturevalue("http_dir")[1])
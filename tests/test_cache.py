@@ -0,0 +1,43 @@
+from kiwixbuild.cache import DirectoryStore, HTTPStore, get_store
+
+
+def test_get_store(tmp_path):
+    assert isinstance(get_store("http://example.org/cache"), HTTPStore)
+    store = get_store(tmp_path.as_uri())
+    assert isinstance(store, DirectoryStore)
+    assert store.path == str(tmp_path)
+    assert get_store("relative").path.endswith("relative")
+
+
+def test_round_trip(store, tmp_path):
+    src = tmp_path / "src"
+    src.write_bytes(b"content" * 100000)
+    assert not store.has("ab/entry.tar.gz")
+
+    store.put("ab/entry.tar.gz", str(src))
+    assert store.has("ab/entry.tar.gz")
+
+    dest = tmp_path / "dest" / "entry.tar.gz"
+    assert store.get("ab/entry.tar.gz", str(dest))
+    assert dest.read_bytes() == src.read_bytes()
+    # Only the file itself, no tmp file left.
+    assert [p.name for p in dest.parent.iterdir()] == ["entry.tar.gz"]
+
+
+def test_replace(store, tmp_path):
+    src = tmp_path / "src"
+    src.write_bytes(b"first")
+    store.put("entry", str(src))
+    src.write_bytes(b"second")
+    store.put("entry", str(src))
+
+    dest = tmp_path / "dest"
+    assert store.get("entry", str(dest))
+    assert dest.read_bytes() == b"second"
+
+
+def test_missing(store, tmp_path):
+    dest = tmp_path / "dest" / "entry"
+    assert not store.has("missing")
+    assert not store.get("missing", str(dest))
+    assert not dest.exists()
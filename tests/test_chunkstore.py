@@ -0,0 +1,222 @@
+import os
+import json
+import random
+import hashlib
+
+import pytest
+
+from kiwixbuild import chunkstore
+from kiwixbuild.cache import DirectoryStore
+
+
+def random_bytes(size, seed):
+    return random.Random(seed).randbytes(size)
+
+
+def make_tree(root, files):
+    for path, content in files.items():
+        full_path = root / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        full_path.write_bytes(content)
+
+
+def read_tree(root):
+    """The files of `root` (but the kept indexes) and their content."""
+    files = {}
+    for dirpath, dirs, filenames in os.walk(str(root)):
+        if chunkstore.LOCAL_INDEXES_DIR in dirs:
+            dirs.remove(chunkstore.LOCAL_INDEXES_DIR)
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            key = os.path.relpath(path, str(root)).replace(os.sep, "/")
+            if os.path.islink(path):
+                files[key] = ("link", os.readlink(path))
+            else:
+                with open(path, "rb") as f:
+                    files[key] = f.read()
+    return files
+
+
+def count_chunks(store):
+    return sum(len(files) for _, _, files in os.walk(os.path.join(store, "chunks")))
+
+
+def test_cut_points():
+    data = random_bytes(5 * 1024 * 1024, 0)
+    points = chunkstore.cut_points(data)
+    assert points[-1] == len(data)
+    sizes = [end - start for start, end in zip([0] + points, points)]
+    assert all(size <= chunkstore.MAX_CHUNK_SIZE for size in sizes)
+    assert all(size >= chunkstore.MIN_CHUNK_SIZE for size in sizes[:-1])
+    # Cut points don't depend on the offset in the file.
+    shifted = chunkstore.cut_points(b"prefix" + data)
+    assert set(p + 6 for p in points[1:]) & set(shifted)
+
+
+def test_round_trip(store, tmp_path):
+    src = tmp_path / "src"
+    make_tree(
+        src,
+        {
+            "bin/tool": random_bytes(3 * 1024 * 1024, 1),
+            "lib/libfoo.a": random_bytes(200 * 1024, 2),
+            "include/foo.h": b"int foo();\n",
+            "empty": b"",
+        },
+    )
+    os.chmod(str(src / "bin" / "tool"), 0o755)
+    os.symlink("libfoo.a", str(src / "lib" / "libfoo.link.a"))
+
+    assert chunkstore.pack(store, "tree", str(src)) > 0
+    dest = tmp_path / "dest"
+    assert chunkstore.fetch(store, "tree", str(dest))
+
+    assert read_tree(dest) == read_tree(src)
+    assert os.stat(str(dest / "bin" / "tool")).st_mode & 0o777 == 0o755
+
+
+def test_pack_only_new_chunks(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    make_tree(src, {"big": random_bytes(4 * 1024 * 1024, 3)})
+    first = chunkstore.pack(store, "v1", str(src))
+    assert first == count_chunks(store.path)
+    assert chunkstore.pack(store, "v1bis", str(src)) == 0
+
+    data = bytearray((src / "big").read_bytes())
+    data[2 * 1024 * 1024 : 2 * 1024 * 1024 + 10] = b"x" * 10
+    (src / "big").write_bytes(bytes(data))
+    assert 0 < chunkstore.pack(store, "v2", str(src)) < first
+
+
+def test_incremental_fetch(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    big = bytearray(random_bytes(4 * 1024 * 1024, 4))
+    make_tree(src, {"big": bytes(big), "same": b"unchanged"})
+    chunkstore.pack(store, "tree", str(src))
+    dest = tmp_path / "dest"
+    chunkstore.fetch(store, "tree", str(dest))
+    same_stat = os.stat(str(dest / "same"))
+
+    big[1024 * 1024 : 1024 * 1024 + 10] = b"y" * 10
+    make_tree(src, {"big": bytes(big)})
+    chunkstore.pack(store, "tree", str(src))
+
+    # The chunks still in the local files are not downloaded.
+    downloaded = []
+    get = store.get
+
+    def counting_get(name, file_path):
+        downloaded.append(name)
+        return get(name, file_path)
+
+    store.get = counting_get
+    assert chunkstore.fetch(store, "tree", str(dest))
+    chunks = [name for name in downloaded if name.startswith("chunks/")]
+    assert 0 < len(chunks) < len(chunkstore.cut_points(bytes(big)))
+
+    assert read_tree(dest) == read_tree(src)
+    # Up to date files are not rewritten.
+    assert os.stat(str(dest / "same")).st_ino == same_stat.st_ino
+
+
+def test_fetch_removed_file(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    make_tree(src, {"kept": b"kept", "removed": b"removed", "sub/removed": b"x"})
+    os.symlink("kept", str(src / "removed_link"))
+    chunkstore.pack(store, "tree", str(src))
+    dest = tmp_path / "dest"
+    chunkstore.fetch(store, "tree", str(dest))
+    (dest / "local").write_bytes(b"not in the tree")
+
+    for path in ("removed", "sub/removed", "removed_link"):
+        os.remove(str(src / path))
+    chunkstore.pack(store, "tree", str(src))
+    assert chunkstore.fetch(store, "tree", str(dest))
+
+    # The files of the previous tree are removed, not the other local files.
+    assert read_tree(dest) == {"kept": b"kept", "local": b"not in the tree"}
+
+
+def test_fetch_missing(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    assert not chunkstore.fetch(store, "missing", str(tmp_path / "dest"))
+
+
+def test_fetch_missing_chunk(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    make_tree(src, {"file": random_bytes(1024, 5)})
+    chunkstore.pack(store, "tree", str(src))
+    for dirpath, _, filenames in os.walk(os.path.join(store.path, "chunks")):
+        for name in filenames:
+            os.remove(os.path.join(dirpath, name))
+
+    dest = tmp_path / "dest"
+    with pytest.raises(chunkstore.ChunkStoreError):
+        chunkstore.fetch(store, "tree", str(dest))
+    assert not (dest / "file").exists()
+
+
+@pytest.mark.parametrize(
+    "entry",
+    [
+        {"path": "../escaped"},
+        {"path": "/tmp/absolute"},
+        {"path": "sub/../../escaped"},
+        {"path": "link_out", "link": "/etc"},
+        {"path": "sub/link_out", "link": "../../escaped"},
+        {"path": "bad_chunk", "chunks": [["../../escaped", 1]]},
+    ],
+)
+def test_fetch_malicious_index(tmp_path, entry):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    make_tree(src, {"file": b"content"})
+    chunkstore.pack(store, "tree", str(src))
+    index_path = tmp_path / "store" / "indexes" / "tree.json"
+    index = json.loads(index_path.read_text())
+    if "link" not in entry:
+        entry = dict(index["files"][0], **entry)
+    index["files"].append(entry)
+    index_path.write_text(json.dumps(index))
+
+    dest = tmp_path / "work" / "dest"
+    with pytest.raises(chunkstore.ChunkStoreError):
+        chunkstore.fetch(store, "tree", str(dest))
+    assert sorted(os.listdir(str(tmp_path / "work"))) == ["dest"]
+    assert read_tree(dest) == {}
+
+
+def test_fetch_through_symlink_dir(tmp_path):
+    store = DirectoryStore(str(tmp_path / "store"))
+    src = tmp_path / "src"
+    make_tree(src, {"file": b"content"})
+    chunkstore.pack(store, "tree", str(src))
+    index_path = tmp_path / "store" / "indexes" / "tree.json"
+    index = json.loads(index_path.read_text())
+    index["files"][0]["path"] = "outside/file"
+    index_path.write_text(json.dumps(index))
+
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    (tmp_path / "other").mkdir()
+    os.symlink(str(tmp_path / "other"), str(dest / "outside"))
+    with pytest.raises(chunkstore.ChunkStoreError):
+        chunkstore.fetch(store, "tree", str(dest))
+    assert os.listdir(str(tmp_path / "other")) == []
+
+
+def test_chunk_file_by_blocks(tmp_path):
+    data = random_bytes(3 * chunkstore.MAX_CHUNK_SIZE + 17, 6)
+    path = tmp_path / "file"
+    path.write_bytes(data)
+    sha256, file_chunks = chunkstore._chunk_file(str(path), {})
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    starts = [0] + chunkstore.cut_points(data)
+    assert file_chunks == [
+        [hashlib.sha256(data[start:end]).hexdigest(), end - start]
+        for start, end in zip(starts, starts[1:])
+    ]
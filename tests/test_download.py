@@ -0,0 +1,118 @@
+import os
+import hashlib
+import argparse
+
+import pytest
+
+from kiwixbuild import _global, utils
+from kiwixbuild.utils import Remotefile, StopBuild, download_remote
+
+
+@pytest.fixture(autouse=True)
+def options():
+    _global.set_options(
+        argparse.Namespace(
+            mirror=[],
+            download_chunks=1,
+            show_progress=False,
+            no_cert_check=False,
+        )
+    )
+    yield
+    _global.set_options(None)
+
+
+@pytest.fixture
+def dest(tmp_path):
+    path = tmp_path / "dest"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def served(http_dir):
+    """A file served by the http server, return its (Remotefile, content)."""
+    served_dir, url = http_dir
+    content = os.urandom(1024 * 1024)
+    (served_dir / "store").mkdir()
+    (served_dir / "store" / "archive.tar.gz").write_bytes(content)
+    remote = Remotefile(
+        "archive.tar.gz",
+        hashlib.sha256(content).hexdigest(),
+        url + "/archive.tar.gz",
+    )
+    return remote, content
+
+
+def test_download(served, dest):
+    remote, content = served
+    download_remote(remote, str(dest))
+    assert (dest / "archive.tar.gz").read_bytes() == content
+    assert not (dest / "archive.tar.gz.part").exists()
+
+
+def test_resume(served, dest):
+    remote, content = served
+    (dest / "archive.tar.gz.part").write_bytes(content[:1000])
+    download_remote(remote, str(dest))
+    assert (dest / "archive.tar.gz").read_bytes() == content
+
+
+def test_resume_stale_part(served, dest, capsys):
+    remote, content = served
+    # Left by the download of another version.
+    (dest / "archive.tar.gz.part").write_bytes(os.urandom(1000))
+    download_remote(remote, str(dest))
+    assert (dest / "archive.tar.gz").read_bytes() == content
+    assert "again from the beginning" in capsys.readouterr().out
+
+
+def test_bad_sha256(served, dest):
+    remote, _content = served
+    remote = remote._replace(sha256="0" * 64)
+    (dest / "archive.tar.gz.part").write_bytes(b"x" * 1000)
+    with pytest.raises(StopBuild):
+        download_remote(remote, str(dest))
+    assert os.listdir(str(dest)) == []
+
+
+@pytest.fixture
+def chunked(monkeypatch):
+    monkeypatch.setattr(utils, "MIN_CHUNKED_SIZE", 0)
+    _global.set_options(
+        argparse.Namespace(
+            mirror=[],
+            download_chunks=4,
+            show_progress=False,
+            no_cert_check=False,
+        )
+    )
+
+
+def test_chunked_download(served, dest, chunked):
+    remote, content = served
+    download_remote(remote, str(dest))
+    assert (dest / "archive.tar.gz").read_bytes() == content
+    assert sorted(os.listdir(str(dest))) == ["archive.tar.gz", "archive.tar.gz.sha256"]
+
+
+def test_chunked_download_corrupted(served, dest, chunked, monkeypatch, capsys):
+    remote, content = served
+    download_url_chunks = utils._download_url_chunks
+    calls = []
+
+    def corrupted_download(url, chunks_path, chunks):
+        calls.append(url)
+        download_url_chunks(url, chunks_path, chunks)
+        with open(chunks_path, "r+b") as f:
+            f.seek(300000)
+            f.write(b"corrupted")
+        return utils._hash_file(chunks_path)
+
+    monkeypatch.setattr(utils, "_download_url_chunks", corrupted_download)
+    download_remote(remote, str(dest))
+    # Downloaded again in one piece.
+    assert len(calls) == 1
+    assert "again from the beginning" in capsys.readouterr().out
+    assert (dest / "archive.tar.gz").read_bytes() == content
+    assert sorted(os.listdir(str(dest))) == ["archive.tar.gz", "archive.tar.gz.sha256"]
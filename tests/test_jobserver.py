@@ -0,0 +1,145 @@
+import os
+import sys
+import argparse
+import threading
+import subprocess
+
+import pytest
+
+from kiwixbuild import _global
+from kiwixbuild.jobserver import JobServer
+from kiwixbuild.dependencies.base import MakeBuilder
+
+
+def free(jobserver):
+    with jobserver.free_tokens(jobserver.jobs + 1) as count:
+        return count
+
+
+@pytest.fixture(params=["posix", "nt"])
+def jobserver(request, monkeypatch):
+    """A jobserver of 3 jobs, using a pipe or (as on Windows) a semaphore."""
+    if request.param == "posix" and os.name != "posix":
+        pytest.skip("No jobserver pipe on this system")
+    with monkeypatch.context() as m:
+        m.setattr(os, "name", request.param)
+        jobserver = JobServer(3)
+    return jobserver
+
+
+def test_token(jobserver):
+    assert free(jobserver) == 3
+    with jobserver.token():
+        assert free(jobserver) == 2
+        with jobserver.token():
+            assert free(jobserver) == 1
+        assert free(jobserver) == 2
+    assert free(jobserver) == 3
+
+
+def test_token_released_on_error(jobserver):
+    with pytest.raises(ValueError):
+        with jobserver.token():
+            raise ValueError()
+    assert free(jobserver) == 3
+
+
+def test_token_wait(jobserver):
+    events = []
+    with jobserver.free_tokens(2) as count:
+        assert count == 2
+        with jobserver.token():
+
+            def take():
+                with jobserver.token():
+                    events.append("taken")
+
+            thread = threading.Thread(target=take)
+            thread.start()
+            thread.join(0.1)
+            assert events == []
+            events.append("released")
+    thread.join()
+    assert events == ["released", "taken"]
+
+
+def test_free_tokens(jobserver):
+    with jobserver.free_tokens(0) as count:
+        assert count == 0
+    with jobserver.token():
+        with jobserver.free_tokens(1) as count:
+            assert count == 1
+            assert free(jobserver) == 1
+        # Only the free tokens are taken.
+        with jobserver.free_tokens(5) as count:
+            assert count == 2
+            assert free(jobserver) == 0
+    assert free(jobserver) == 3
+
+
+def test_free_tokens_released_on_error(jobserver):
+    with pytest.raises(ValueError):
+        with jobserver.free_tokens(2):
+            raise ValueError()
+    assert free(jobserver) == 3
+
+
+def test_at_least_one_job():
+    assert JobServer(0).jobs == 1
+    assert free(JobServer(0)) == 1
+
+
+def test_no_makeflags_without_pipe(monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(os, "name", "nt")
+        jobserver = JobServer(3)
+    assert jobserver.fds == ()
+    assert jobserver.makeflags is None
+
+
+CHILD = """
+import os, select
+auth = [f for f in os.environ["MAKEFLAGS"].split() if f.startswith("--jobserver-auth=")]
+read_fd, write_fd = map(int, auth[0].split("=")[1].split(","))
+tokens = b""
+while select.select([read_fd], [], [], 0)[0]:
+    tokens += os.read(read_fd, 1)
+print(len(tokens))
+os.write(write_fd, tokens)
+"""
+
+
+@pytest.mark.skipif(os.name != "posix", reason="No jobserver pipe on this system")
+def test_makeflags():
+    jobserver = JobServer(3)
+    flags = jobserver.makeflags.split()
+    fds = "{},{}".format(*jobserver.fds)
+    assert flags == ["-j", f"--jobserver-fds={fds}", f"--jobserver-auth={fds}"]
+    # A child takes the free tokens from the pipe given by MAKEFLAGS, as a
+    # sub-make does.
+    with jobserver.token():
+        output = subprocess.check_output(
+            [sys.executable, "-c", CHILD],
+            env={**os.environ, "MAKEFLAGS": jobserver.makeflags},
+            pass_fds=jobserver.fds,
+        )
+    assert output.strip() == b"2"
+    assert free(jobserver) == 3
+
+
+@pytest.mark.parametrize("pipe", [True, False])
+def test_make_options(monkeypatch, pipe):
+    with monkeypatch.context() as m:
+        if not pipe:
+            m.setattr(os, "name", "nt")
+        jobserver = JobServer(3)
+    _global.set_options(argparse.Namespace(jobs=3))
+    _global.set_neutralEnv(argparse.Namespace(jobserver=jobserver))
+    try:
+        # With a jobserver, make must not get a `-j` (which would make it
+        # create its own jobserver).
+        options = MakeBuilder.make_options.fget(None)
+    finally:
+        _global.set_neutralEnv(None)
+        _global.set_options(None)
+    assert options == ([] if pipe and os.name == "posix" else ["-j3"])
@@ -0,0 +1,207 @@
+import os
+import threading
+from pathlib import Path
+
+import pytest
+
+from kiwixbuild.dependencies.base import Builder
+from kiwixbuild.manifest import (
+    merge_stage,
+    owned_files,
+    read_manifest,
+    remove_files,
+    staged_root,
+    manifest_files,
+    write_manifest,
+)
+
+
+def make_tree(root, files):
+    """Create `files` ({path: content}) in `root`, a content starting with
+    "->" is the target of a symlink."""
+    for path, content in files.items():
+        full_path = root / path
+        full_path.parent.mkdir(parents=True, exist_ok=True)
+        if content.startswith("->"):
+            os.symlink(content[2:], full_path)
+        else:
+            full_path.write_text(content)
+
+
+def read_tree(root):
+    tree = {}
+    for dirpath, dirs, filenames in os.walk(root):
+        for name in filenames + [
+            d for d in dirs if os.path.islink(os.path.join(dirpath, d))
+        ]:
+            full_path = os.path.join(dirpath, name)
+            path = os.path.relpath(full_path, root)
+            if os.path.islink(full_path):
+                tree[path] = "->" + os.readlink(full_path)
+            else:
+                with open(full_path) as f:
+                    tree[path] = f.read()
+    return tree
+
+
+@pytest.fixture
+def install_dir(tmp_path):
+    path = tmp_path / "install"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def stage_dir(tmp_path):
+    return tmp_path / "stage"
+
+
+def stage(stage_dir, install_dir, files):
+    """Create `files` as installed with `DESTDIR=stage_dir`."""
+    make_tree(Path(staged_root(str(stage_dir), str(install_dir))), files)
+
+
+def test_staged_root(tmp_path):
+    root = staged_root(str(tmp_path / "stage"), "/usr/local")
+    assert root == str(tmp_path / "stage" / "usr" / "local")
+
+
+def test_merge_stage(stage_dir, install_dir):
+    make_tree(install_dir, {"lib/libold.so": "old", "lib/libfoo.so": "previous"})
+    # An (empty) directory replaced by a symlink.
+    (install_dir / "include" / "foo").mkdir(parents=True)
+    stage(
+        stage_dir,
+        install_dir,
+        {
+            "lib/libfoo.so.1": "foo",
+            "lib/libfoo.so": "->libfoo.so.1",
+            "include/foo-1/foo.h": "header",
+            "include/foo": "->foo-1",
+            "share/doc/foo/README": "readme",
+        },
+    )
+
+    files = merge_stage(str(stage_dir), str(install_dir))
+    assert sorted(files) == [
+        "include/foo",
+        "include/foo-1/foo.h",
+        "lib/libfoo.so",
+        "lib/libfoo.so.1",
+        "share/doc/foo/README",
+    ]
+    assert read_tree(install_dir) == {
+        "lib/libold.so": "old",
+        "lib/libfoo.so.1": "foo",
+        "lib/libfoo.so": "->libfoo.so.1",
+        "include/foo-1/foo.h": "header",
+        "include/foo": "->foo-1",
+        "share/doc/foo/README": "readme",
+    }
+    assert read_tree(stage_dir) == {}
+
+
+def test_merge_stage_outside_prefix(stage_dir, install_dir, capsys):
+    stage(stage_dir, install_dir, {"bin/foo": "foo"})
+    make_tree(stage_dir, {"etc/foo.conf": "conf"})
+    assert merge_stage(str(stage_dir), str(install_dir)) == ["bin/foo"]
+    assert read_tree(install_dir) == {"bin/foo": "foo"}
+    assert "1 files installed outside of" in capsys.readouterr().out
+    assert read_tree(stage_dir) == {"etc/foo.conf": "conf"}
+
+
+def test_merge_empty_stage(stage_dir, install_dir, capsys):
+    # Nothing installed, the stage dir has not been created.
+    assert merge_stage(str(stage_dir), str(install_dir)) == []
+    assert capsys.readouterr().out == ""
+
+
+def test_manifest(install_dir):
+    make_tree(install_dir, {"lib/libfoo.so.1": "foo", "lib/libfoo.so": "->libfoo.so.1"})
+    assert read_manifest(str(install_dir), "foo") is None
+    write_manifest(
+        str(install_dir),
+        "foo",
+        "foo-1.0",
+        ["lib/libfoo.so.1", "lib/libfoo.so", "lib/removed"],
+    )
+    manifest = read_manifest(str(install_dir), "foo")
+    assert manifest["full_name"] == "foo-1.0"
+    assert manifest_files(manifest) == ["lib/libfoo.so", "lib/libfoo.so.1"]
+    link, library = manifest["files"]
+    assert link["link"] == "libfoo.so.1"
+    assert library["size"] == 3
+    assert library["sha256"] == (
+        "2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae"
+    )
+
+
+def test_owned_files(install_dir):
+    assert owned_files(str(install_dir)) == set()
+    make_tree(install_dir, {"a": "a", "b": "b", "c": "c"})
+    write_manifest(str(install_dir), "foo", "foo-1", ["a", "b"])
+    write_manifest(str(install_dir), "bar", "bar-1", ["b", "c"])
+    assert owned_files(str(install_dir)) == {"a", "b", "c"}
+    assert owned_files(str(install_dir), exclude="foo") == {"b", "c"}
+
+
+def test_remove_files(install_dir):
+    make_tree(
+        install_dir,
+        {
+            "lib/pkgconfig/foo.pc": "foo",
+            "include/foo/foo.h": "foo",
+            "include/bar.h": "bar",
+            "README": "readme",
+        },
+    )
+    remove_files(
+        str(install_dir),
+        ["lib/pkgconfig/foo.pc", "include/foo/foo.h", "README", "missing/file"],
+    )
+    assert read_tree(install_dir) == {"include/bar.h": "bar"}
+    assert sorted(os.listdir(install_dir)) == ["include"]
+
+
+class StubBuilder:
+    """Just what `_staged_install` needs of a builder."""
+
+    _staged_install = Builder._staged_install
+
+    def __init__(self, name, install_dir, stage_dir):
+        self.name = name
+        self.buildEnv = type(
+            "BuildEnv",
+            (),
+            {"install_dir": install_dir, "install_lock": threading.Lock()},
+        )
+        self._stage_dir = stage_dir
+        self.files = {}
+
+    def _install(self, context):
+        stage(self._stage_dir, self.buildEnv.install_dir, self.files)
+
+    def _write_manifest(self, files):
+        write_manifest(self.buildEnv.install_dir, self.name, self.name + "-1", files)
+
+
+def test_staged_install_removes_stale_files(stage_dir, install_dir):
+    foo = StubBuilder("foo", str(install_dir), stage_dir)
+    bar = StubBuilder("bar", str(install_dir), stage_dir)
+    foo.files = {
+        "lib/libfoo.so": "foo",
+        "lib/foo/plugin.so": "plugin",
+        "share/common": "foo",
+    }
+    bar.files = {"share/common": "bar"}
+    foo._staged_install(None)
+    bar._staged_install(None)
+    assert not stage_dir.exists()
+
+    # The plugin is not installed anymore. "share/common" is now installed
+    # only by bar.
+    foo.files = {"lib/libfoo.so": "new foo"}
+    assert foo._staged_install(None) == ["lib/libfoo.so"]
+    assert read_tree(install_dir / "lib") == {"libfoo.so": "new foo"}
+    assert read_tree(install_dir / "share") == {"common": "bar"}
+    assert manifest_files(read_manifest(str(install_dir), "foo")) == ["lib/libfoo.so"]
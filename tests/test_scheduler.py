@@ -0,0 +1,217 @@
+import sys
+import time
+import argparse
+import threading
+
+import pytest
+
+from kiwixbuild import _global
+from kiwixbuild.builder import Builder
+from kiwixbuild.jobserver import JobServer
+from kiwixbuild.scheduler import ThreadedStdout, run_steps
+from kiwixbuild.utils import StopBuild
+
+
+class Recorder:
+    """A stub step function recording when the steps start and end."""
+
+    def __init__(self, failing=(), exception=StopBuild, delays=None):
+        self.failing = failing
+        self.exception = exception
+        self.delays = delays or {}
+        self.started = []
+        self.ended = []
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, step):
+        with self._lock:
+            self.started.append(step)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        print(f"start {step}")
+        time.sleep(self.delays.get(step, 0.01))
+        print(f"end {step}")
+        with self._lock:
+            self.running -= 1
+            self.ended.append(step)
+        if step in self.failing:
+            raise self.exception(f"{step} failed")
+
+
+STEPS = ["a", "b", "c", "d", "e"]
+DEPENDENCIES = {"b": ["a"], "c": ["a"], "d": ["b", "c"], "e": []}
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_dependencies_order(jobs):
+    function = Recorder()
+    run_steps(STEPS, DEPENDENCIES, function, jobs)
+    assert sorted(function.ended) == STEPS
+    for step, dependencies in DEPENDENCIES.items():
+        for dependency in dependencies:
+            assert function.ended.index(dependency) < function.started.index(step)
+
+
+def test_jobs_limit():
+    function = Recorder()
+    run_steps(STEPS, {}, function, 2)
+    assert sorted(function.ended) == STEPS
+    assert function.max_running == 2
+
+
+def test_ignore_unknown_dependencies():
+    function = Recorder()
+    run_steps(["a", "b"], {"a": ["a", "not_a_step"], "b": ["a"]}, function, 2)
+    assert function.ended == ["a", "b"]
+
+
+def test_cyclic_dependencies():
+    function = Recorder()
+    with pytest.raises(RuntimeError, match="Cannot schedule steps b, c"):
+        run_steps(["a", "b", "c"], {"b": ["c"], "c": ["b"]}, function, 2)
+    assert function.ended == ["a"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_failure_stops_the_build(jobs):
+    function = Recorder(failing=["a"])
+    with pytest.raises(StopBuild, match="a failed"):
+        run_steps(STEPS, DEPENDENCIES, function, jobs)
+    # Nothing is started after the failure. In parallel, "e" doesn't depend
+    # on "a" and is already running: it is finished.
+    assert "b" not in function.started
+    assert "c" not in function.started
+    assert "d" not in function.started
+    assert function.running == 0
+
+
+def test_first_failure_raised():
+    function = Recorder(failing=["a", "e"], exception=ValueError, delays={"a": 0.1})
+    with pytest.raises(ValueError, match="e failed"):
+        run_steps(["a", "e"], {}, function, 2)
+    assert function.ended == ["e", "a"]
+
+
+@pytest.mark.parametrize("exception", [StopBuild, KeyboardInterrupt])
+def test_stdout_restored(exception):
+    stdout = sys.stdout
+    function = Recorder(failing=["b"], exception=exception)
+    with pytest.raises(exception):
+        run_steps(STEPS, DEPENDENCIES, function, 2)
+    assert sys.stdout is stdout
+
+
+def test_output_not_mixed(capsys):
+    run_steps(STEPS, {}, Recorder(), 5)
+    lines = capsys.readouterr().out.splitlines()
+    assert sorted(lines) == sorted(f"{w} {s}" for s in STEPS for w in ("start", "end"))
+    for step in STEPS:
+        start = lines.index(f"start {step}")
+        assert lines[start + 1] == f"end {step}"
+
+
+def test_output_ordered(capsys):
+    # The first steps end last.
+    delays = {step: 0.05 * (len(STEPS) - i) for i, step in enumerate(STEPS)}
+    run_steps(STEPS, {}, Recorder(delays=delays), 5, ordered=True)
+    expected = [f"{w} {s}" for s in STEPS for w in ("start", "end")]
+    assert capsys.readouterr().out.splitlines() == expected
+
+
+def test_output_of_failed_steps(capsys):
+    with pytest.raises(StopBuild):
+        run_steps(STEPS, DEPENDENCIES, Recorder(failing=["a"]), 2, ordered=True)
+    out = capsys.readouterr().out.splitlines()
+    assert out[:2] == ["start a", "end a"]
+    assert "end e" in out
+
+
+def test_threaded_stdout(capsys):
+    stdout = ThreadedStdout(sys.stdout)
+    outputs = {}
+
+    def capture(name):
+        stdout.start_capture()
+        assert stdout.capturing
+        stdout.write(f"from {name}\n")
+        stdout.flush()
+        outputs[name] = stdout.stop_capture()
+
+    threads = [threading.Thread(target=capture, args=(n,)) for n in ("t1", "t2")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not stdout.capturing
+    stdout.write("not captured\n")
+    stdout.write_through("written through\n")
+    assert outputs == {"t1": "from t1\n", "t2": "from t2\n"}
+    assert capsys.readouterr().out == "not captured\nwritten through\n"
+
+
+class StubStep:
+    def __init__(self, name, exception=None):
+        self.name = name
+        self.exception = exception
+        self.built = False
+
+    def build(self):
+        self.built = True
+        if self.exception:
+            raise self.exception(f"{self.name} failed")
+
+    def save_fingerprint(self):
+        pass
+
+
+@pytest.fixture
+def builder():
+    _global.set_options(
+        argparse.Namespace(make_dist=False, target="e", compiler_cache=None)
+    )
+    _global.set_neutralEnv(argparse.Namespace(jobserver=JobServer(2)))
+    builder = Builder.__new__(Builder)
+    builder.compiler_cache_stats = []
+    builder.failed_steps = []
+    yield builder
+    _global.reset_target_steps()
+    _global.set_neutralEnv(None)
+    _global.set_options(None)
+
+
+def add_steps(failing, exception):
+    steps = [("native", name) for name in STEPS]
+    for step in steps:
+        name = step[1]
+        _global.add_target_step(
+            step, StubStep(name, exception if name in failing else None)
+        )
+    dependencies = {
+        ("native", name): [("native", d) for d in deps]
+        for name, deps in DEPENDENCIES.items()
+    }
+    return steps, dependencies
+
+
+def test_build_step_stop_build(builder):
+    steps, dependencies = add_steps(["b"], StopBuild)
+    with pytest.raises(StopBuild, match="b failed"):
+        run_steps(steps, dependencies, builder.build_step, 2)
+    assert builder.failed_steps == [("native", "b")]
+    assert not _global.get_target_step(("native", "d")).built
+    # The tokens of the failed steps are released.
+    with _global.neutralEnv("jobserver").free_tokens(2) as free:
+        assert free == 2
+
+
+def test_build_step_error(builder, capsys):
+    steps, dependencies = add_steps(["b", "e"], ValueError)
+    run_steps(steps, dependencies, builder.build_step, 2)
+    # Other errors are reported, the build goes on.
+    assert sorted(builder.failed_steps) == [("native", "b"), ("native", "e")]
+    assert len(builder.compiler_cache_stats) == 3
+    out = capsys.readouterr().out
+    assert "ERROR during build of b: b failed" in out
+    assert "ERROR during build of e: e failed" in out
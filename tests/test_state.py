@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import argparse
+
+import pytest
+
+from kiwixbuild import _global
+from kiwixbuild.manifest import write_manifest
+from kiwixbuild.state import STATE_DB, BuildState, marker_file
+from kiwixbuild.utils import Context, SkipCommand
+
+
+def new_state(root):
+    os.makedirs(root, exist_ok=True)
+    return BuildState(str(root / STATE_DB), str(root))
+
+
+@pytest.fixture
+def root(tmp_path):
+    return tmp_path / "work"
+
+
+@pytest.fixture
+def state(root):
+    state = new_state(root)
+    _global.set_neutralEnv(argparse.Namespace(state=state))
+    yield state
+    _global.set_neutralEnv(None)
+
+
+def test_record(state, root):
+    path = str(root / "BUILD_native" / "zlib")
+    assert not state.is_done(path, "configure")
+    state.record(path, "configure", "done", fingerprint="abc")
+    state.record(path, "compile", "failed", fingerprint="def")
+    assert state.is_done(path, "configure")
+    assert not state.is_done(path, "compile")
+    assert state.fingerprint(path, "configure") == "abc"
+    assert state.fingerprint(path, "compile") is None
+    # A new run replaces the previous one.
+    state.record(path, "compile", "done")
+    assert state.is_done(path, "compile")
+    assert [(s["path"], s["name"]) for s in state.steps()] == [
+        (path, "configure"),
+        (path, "compile"),
+    ]
+
+
+def test_marker_migration(state, root):
+    path = root / "BUILD_native" / "zlib"
+    path.mkdir(parents=True)
+    marker = marker_file(str(path), "configure")
+    open(marker, "w").close()
+    assert os.path.basename(marker) == ".configure_ok"
+
+    assert Context._is_done(str(path), "configure")
+    assert not os.path.exists(marker)
+    assert state.is_done(str(path), "configure")
+    # Done once migrated.
+    assert Context._is_done(str(path), "configure")
+    assert not Context._is_done(str(path), "compile")
+
+
+def test_try_skip_marker(state, root):
+    path = root / "ARCHIVE"
+    path.mkdir()
+    open(marker_file(str(path), "download_zlib"), "w").close()
+    context = Context("download", None, False)
+    with pytest.raises(SkipCommand):
+        context.try_skip(str(path), "zlib")
+    context = Context("download", None, False)
+    context.try_skip(str(path), "icu4c")
+
+
+def test_removed_dir_not_done(state, root):
+    path = root / "BUILD_native" / "zlib"
+    path.mkdir(parents=True)
+    state.record(str(path), "configure", "done")
+    shutil.rmtree(path)
+    assert not Context._is_done(str(path), "configure")
+    assert state.steps() == []
+
+
+def test_forget(state, root):
+    install_dir = str(root / "BUILD_native" / "INSTALL")
+    for name in ("zlib", "zlib/sub", "zlib-other"):
+        state.record(str(root / "BUILD_native" / name), "configure", "done")
+    state.record_artifacts(install_dir, "zlib", "zlib-1", [])
+    os.makedirs(install_dir)
+    write_manifest(install_dir, "zlib", "zlib-1", [])
+    state.forget(str(root / "BUILD_native" / "zlib"))
+    assert [s["path"] for s in state.steps()] == [
+        str(root / "BUILD_native" / "zlib-other")
+    ]
+    assert len(state.artifacts()) == 1
+    state.forget(str(root / "BUILD_native"))
+    assert state.steps() == []
+    assert state.artifacts() == []
+
+
+def test_artifacts(state, root):
+    install_dir = str(root / "BUILD_native" / "INSTALL")
+    os.makedirs(install_dir)
+    for name in ("icu4c", "zlib"):
+        state.record_artifacts(install_dir, name, name + "-1", ["lib/" + name])
+        write_manifest(install_dir, name, name + "-1", [])
+    assert state.artifacts(install_dir) == [
+        {
+            "install_dir": install_dir,
+            "name": "icu4c",
+            "full_name": "icu4c-1",
+            "files": ["lib/icu4c"],
+        },
+        {
+            "install_dir": install_dir,
+            "name": "zlib",
+            "full_name": "zlib-1",
+            "files": ["lib/zlib"],
+        },
+    ]
+    assert state.artifacts(str(root / "other")) == []
+    # The artifacts are forgotten with their manifest.
+    os.remove(os.path.join(install_dir, ".manifests", "icu4c.json"))
+    assert [a["name"] for a in state.artifacts()] == ["zlib"]
+
+
+def test_export_import(state, root, tmp_path):
+    build_dir = root / "BUILD_native"
+    install_dir = str(build_dir / "INSTALL")
+    outside = str(tmp_path / "outside")
+    state.record(
+        str(build_dir / "zlib"),
+        "configure",
+        "done",
+        fingerprint="abc",
+        log_file=str(build_dir / "zlib" / "cmd_configure_log.txt"),
+    )
+    state.record(str(build_dir / "icu4c"), "compile", "failed")
+    state.record(outside, "download_zlib", "done")
+    os.makedirs(install_dir)
+    write_manifest(install_dir, "zlib", "zlib-1", [])
+    state.record_artifacts(install_dir, "zlib", "zlib-1", ["lib/libz.a"])
+    export_file = str(tmp_path / "state.json")
+    # The failed steps are not exported.
+    assert state.export_state(export_file) == 2
+    with open(export_file) as f:
+        assert str(root) not in f.read()
+
+    # Imported in a working dir somewhere else.
+    other_root = tmp_path / "other" / "work"
+    other = new_state(other_root)
+    assert other.import_state(export_file) == 2
+    other_build_dir = other_root / "BUILD_native"
+    assert sorted((s["path"], s["name"]) for s in other.steps()) == sorted(
+        [(str(other_build_dir / "zlib"), "configure"), (outside, "download_zlib")]
+    )
+    assert os.path.isdir(other_build_dir / "zlib")
+    assert other.fingerprint(str(other_build_dir / "zlib"), "configure") == "abc"
+    (step,) = [s for s in other.steps() if s["name"] == "configure"]
+    assert step["log_file"] == str(other_build_dir / "zlib" / "cmd_configure_log.txt")
+    assert not other.is_done(str(other_build_dir / "icu4c"), "compile")
+
+    # The artifacts are kept if the install dir comes with the state.
+    other_install_dir = str(other_build_dir / "INSTALL")
+    shutil.copytree(install_dir, other_install_dir)
+    assert [(a["install_dir"], a["files"]) for a in other.artifacts()] == [
+        (other_install_dir, ["lib/libz.a"])
+    ]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        [],
+        {"steps": []},
+        {"steps": [["a", "b"]], "artifacts": []},
+        {"steps": [[1, "b", "done", None, 0, 0, None]], "artifacts": []},
+        {"steps": [], "artifacts": "none"},
+    ],
+)
+def test_import_invalid(state, tmp_path, content):
+    export_file = tmp_path / "state.json"
+    export_file.write_text(json.dumps(content))
+    with pytest.raises(ValueError, match="is not an exported build state"):
+        state.import_state(str(export_file))
+    assert state.steps() == []
+
+
+def test_import_not_json(state, tmp_path):
+    export_file = tmp_path / "state.json"
+    export_file.write_text("not json")
+    with pytest.raises(ValueError):
+        state.import_state(str(export_file))
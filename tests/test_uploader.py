@@ -0,0 +1,144 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), os.pardir, ".github", "scripts")
+)
+
+from uploader import Uploader, file_sha256
+
+
+@pytest.fixture
+def remote(tmp_path):
+    path = tmp_path / "remote"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def uploader(remote):
+    logs = []
+    uploader = Uploader(local_dir=str(remote), log=logs.append)
+    uploader.logs = logs
+    yield uploader
+    uploader.close()
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    path = tmp_path / "archive.tar.gz"
+    path.write_bytes(os.urandom(3 * 1024 * 1024 + 17))
+    return path
+
+
+def remote_names(path):
+    return sorted(p.name for p in path.iterdir())
+
+
+def test_fresh_upload(uploader, remote, local_file):
+    uploader.upload(local_file, "host", "/data/nightly")
+
+    dest = remote / "data" / "nightly"
+    assert remote_names(dest) == ["archive.tar.gz", "archive.tar.gz.sha256"]
+    assert (dest / "archive.tar.gz").read_bytes() == local_file.read_bytes()
+    assert (dest / "archive.tar.gz.sha256").read_text() == "{}  {}\n".format(
+        file_sha256(local_file), local_file.name
+    )
+    assert uploader.logs[-1].startswith("Send ")
+
+
+def test_already_uploaded(uploader, remote, local_file):
+    uploader.upload(local_file, "host", "/data")
+    mtime = os.stat(str(remote / "data" / "archive.tar.gz")).st_mtime_ns
+
+    uploader.upload(local_file, "host", "/data", overwrite=False)
+    assert "already uploaded" in uploader.logs[-1]
+    assert os.stat(str(remote / "data" / "archive.tar.gz")).st_mtime_ns == mtime
+
+
+def test_resume(uploader, remote, local_file):
+    data = local_file.read_bytes()
+    dest = remote / "data"
+    dest.mkdir()
+    (dest / "archive.tar.gz.part").write_bytes(data[:1000000])
+    (dest / "archive.tar.gz.part.sha256").write_text(
+        "{}  archive.tar.gz\n".format(file_sha256(local_file))
+    )
+
+    uploader.upload(local_file, "host", "/data")
+    assert uploader.logs[-1].endswith(" at 1000000")
+    assert remote_names(dest) == ["archive.tar.gz", "archive.tar.gz.sha256"]
+    assert (dest / "archive.tar.gz").read_bytes() == data
+
+
+def test_no_resume_of_another_file(uploader, remote, local_file):
+    dest = remote / "data"
+    dest.mkdir()
+    (dest / "archive.tar.gz.part").write_bytes(b"x" * 1000)
+    (dest / "archive.tar.gz.part.sha256").write_text("0" * 64 + "  archive.tar.gz\n")
+
+    uploader.upload(local_file, "host", "/data")
+    assert uploader.logs[-1].startswith("Send ")
+    assert (dest / "archive.tar.gz").read_bytes() == local_file.read_bytes()
+
+
+def test_interrupted_before_rename(uploader, remote, local_file):
+    uploader.upload(local_file, "host", "/data")
+    dest = remote / "data"
+    # A new version, interrupted once its digest was written.
+    old_data = local_file.read_bytes()
+    local_file.write_bytes(os.urandom(len(old_data)))
+    (dest / "archive.tar.gz.part").write_bytes(local_file.read_bytes())
+    for digest_file in ("archive.tar.gz.part.sha256", "archive.tar.gz.sha256"):
+        (dest / digest_file).write_text(
+            "{}  archive.tar.gz\n".format(file_sha256(local_file))
+        )
+
+    uploader.upload(local_file, "host", "/data")
+    assert (dest / "archive.tar.gz").read_bytes() == local_file.read_bytes()
+    assert remote_names(dest) == ["archive.tar.gz", "archive.tar.gz.sha256"]
+
+
+def test_already_uploaded_stale_part(uploader, remote, local_file):
+    uploader.upload(local_file, "host", "/data", overwrite=False)
+    dest = remote / "data"
+    # Left by an interrupted upload of another version.
+    (dest / "archive.tar.gz.part").write_bytes(b"x" * 1000)
+    (dest / "archive.tar.gz.part.sha256").write_text("0" * 64 + "  archive.tar.gz\n")
+
+    uploader.upload(local_file, "host", "/data", overwrite=False)
+    assert "already uploaded" in uploader.logs[-1]
+    assert remote_names(dest) == ["archive.tar.gz", "archive.tar.gz.sha256"]
+
+
+def test_no_overwrite(uploader, remote, local_file, tmp_path):
+    uploader.upload(local_file, "host", "/data", overwrite=False)
+    dest = remote / "data" / "archive.tar.gz"
+    assert dest.stat().st_mode & 0o777 == 0o444
+
+    other = tmp_path / "other" / local_file.name
+    other.parent.mkdir()
+    other.write_bytes(b"other content")
+    with pytest.raises(FileExistsError):
+        uploader.upload(other, "host", "/data", overwrite=False)
+    assert dest.read_bytes() == local_file.read_bytes()
+
+    uploader.upload(other, "host", "/data")
+    assert dest.read_bytes() == b"other content"
+
+
+def test_upload_many(uploader, remote, tmp_path):
+    files = []
+    for i in range(8):
+        path = tmp_path / "file{}".format(i)
+        path.write_bytes(os.urandom(1024))
+        files.append(path)
+
+    uploader.upload_many(
+        [(f, "host", "/data/{}/dir".format(i % 2)) for i, f in enumerate(files)]
+    )
+    for i, f in enumerate(files):
+        uploaded = remote / "data" / str(i % 2) / "dir" / f.name
+        assert uploaded.read_bytes() == f.read_bytes()